@@ -0,0 +1,233 @@
+"""Per-user admission control for the analysis endpoints.
+
+Each user has a token bucket that refills at a steady rate up to a burst
+capacity. Every analysis costs tokens according to how heavy it is (a Whisper
+transcription costs far more than a text analysis), and a user may only have a
+few analyses in flight at once. Requests over either limit are refused with a
+Retry-After hint instead of reaching the models.
+
+State lives in this process by default. With a SQLite database path, all web
+workers on the node share the buckets; in-flight analyses are then leases that
+lapse after lease_timeout seconds, so a crashed worker cannot block a user.
+"""
+import logging
+import math
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Tokens per request; the bucket holds `capacity` tokens and refills at `refill_rate` per second
+DEFAULT_COSTS = {
+    'text': 1,
+    'questionnaire': 1,
+    'visual': 1,
+    'visual_batch': 4,
+    'transcribe': 10,
+    'audio': 12
+}
+
+def parse_costs(spec):
+    """Parse 'audio=12,transcribe=10' into {'audio': 12.0, 'transcribe': 10.0}"""
+    costs = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, cost = item.partition('=')
+        costs[name.strip()] = float(cost)
+    return costs
+
+class AdmissionDenied(Exception):
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Admission denied ({reason})")
+        self.reason = reason
+        self.retry_after = retry_after
+        # JSON error body, as for InferenceBusyError
+        if reason == 'concurrency':
+            message = 'Too many analyses in progress, please wait for one to finish'
+        else:
+            message = 'Too many analysis requests, please slow down'
+        self.details = {'error': message, 'reason': reason, 'retry_after': retry_after}
+
+class Lease:
+    """One admitted analysis; release it when the analysis finishes"""
+
+    __slots__ = ('user_id', 'lease_id', 'released')
+
+    def __init__(self, user_id, lease_id=None):
+        self.user_id = user_id
+        self.lease_id = lease_id
+        self.released = False
+
+def _refill(tokens, updated, now, capacity, refill_rate):
+    return min(capacity, tokens + max(0.0, now - updated) * refill_rate)
+
+def _wait_for(tokens, cost, refill_rate):
+    return max(1, math.ceil((cost - tokens) / refill_rate))
+
+class _Bucket:
+    __slots__ = ('tokens', 'updated', 'in_flight')
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+        self.in_flight = 0
+
+class MemoryStore:
+    """Buckets of this process only. Users at full capacity with nothing in flight are not stored."""
+
+    def __init__(self, sweep_every=1024):
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._sweep_every = sweep_every
+        self._operations = 0
+
+    def acquire(self, user_id, cost, capacity, refill_rate, max_in_flight, now):
+        with self._lock:
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = _Bucket(capacity, now)
+            if bucket.in_flight >= max_in_flight:
+                raise AdmissionDenied('concurrency', 1)
+            tokens = _refill(bucket.tokens, bucket.updated, now, capacity, refill_rate)
+            if tokens < cost:
+                raise AdmissionDenied('rate', _wait_for(tokens, cost, refill_rate))
+            bucket.tokens = tokens - cost
+            bucket.updated = now
+            bucket.in_flight += 1
+            self._buckets[user_id] = bucket
+            self._operations += 1
+            if self._operations % self._sweep_every == 0:
+                self._sweep(now, capacity, refill_rate)
+        return Lease(user_id)
+
+    def release(self, lease):
+        with self._lock:
+            bucket = self._buckets.get(lease.user_id)
+            if bucket is not None and bucket.in_flight > 0:
+                bucket.in_flight -= 1
+
+    def tracked_users(self):
+        return len(self._buckets)
+
+    def _sweep(self, now, capacity, refill_rate):
+        # Caller holds self._lock
+        idle = [
+            user_id for user_id, bucket in self._buckets.items()
+            if bucket.in_flight == 0 and _refill(bucket.tokens, bucket.updated, now, capacity, refill_rate) >= capacity
+        ]
+        for user_id in idle:
+            del self._buckets[user_id]
+
+class SQLiteStore:
+    """Buckets shared by every process using the same database file"""
+
+    def __init__(self, path, lease_timeout=600):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        self._local = threading.local()
+        connection = self._connection()
+        connection.execute('PRAGMA journal_mode=WAL')
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(admission_buckets)')]
+        if 'endpoint' in columns:
+            # Per-endpoint buckets of an earlier version; they only hold short-lived state
+            connection.execute('DROP TABLE admission_buckets')
+            connection.execute('DROP TABLE IF EXISTS admission_leases')
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS admission_buckets '
+            '(user_id INTEGER PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)'
+        )
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS admission_leases '
+            '(lease_id TEXT PRIMARY KEY, user_id INTEGER NOT NULL, expires REAL NOT NULL)'
+        )
+        connection.execute('CREATE INDEX IF NOT EXISTS admission_leases_user ON admission_leases (user_id)')
+
+    def acquire(self, user_id, cost, capacity, refill_rate, max_in_flight, now):
+        connection = self._connection()
+        # Take the write lock up front so the read-modify-write below is atomic across processes
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.execute('DELETE FROM admission_leases WHERE user_id = ? AND expires < ?', (user_id, now))
+            in_flight = connection.execute(
+                'SELECT COUNT(*) FROM admission_leases WHERE user_id = ?', (user_id,)
+            ).fetchone()[0]
+            if in_flight >= max_in_flight:
+                raise AdmissionDenied('concurrency', 1)
+            row = connection.execute(
+                'SELECT tokens, updated FROM admission_buckets WHERE user_id = ?', (user_id,)
+            ).fetchone()
+            tokens = _refill(row[0], row[1], now, capacity, refill_rate) if row else capacity
+            if tokens < cost:
+                raise AdmissionDenied('rate', _wait_for(tokens, cost, refill_rate))
+            connection.execute(
+                'INSERT OR REPLACE INTO admission_buckets (user_id, tokens, updated) VALUES (?, ?, ?)',
+                (user_id, tokens - cost, now)
+            )
+            lease = Lease(user_id, uuid.uuid4().hex)
+            connection.execute(
+                'INSERT INTO admission_leases (lease_id, user_id, expires) VALUES (?, ?, ?)',
+                (lease.lease_id, user_id, now + self.lease_timeout)
+            )
+            connection.execute('COMMIT')
+            return lease
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+
+    def release(self, lease):
+        self._connection().execute('DELETE FROM admission_leases WHERE lease_id = ?', (lease.lease_id,))
+
+    def tracked_users(self):
+        return self._connection().execute('SELECT COUNT(*) FROM admission_buckets').fetchone()[0]
+
+    def _connection(self):
+        # sqlite3 connections may not be shared between threads
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            self._local.connection = connection
+        return connection
+
+class AdmissionController:
+    def __init__(self, capacity=60, refill_rate=1.0, max_in_flight=2, costs=None, db_path=None, lease_timeout=600):
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self.max_in_flight = max_in_flight
+        self.costs = dict(DEFAULT_COSTS, **(costs or {}))
+        self.store = SQLiteStore(db_path, lease_timeout) if db_path else MemoryStore()
+        self.admitted = 0
+        self.rejected = {'rate': 0, 'concurrency': 0}
+
+    def acquire(self, user_id, endpoint):
+        """Admit one request or raise AdmissionDenied; returns the Lease to release afterwards"""
+        # A cost above the capacity could never be paid
+        cost = min(self.costs.get(endpoint, 1), self.capacity)
+        try:
+            lease = self.store.acquire(user_id, cost, self.capacity, self.refill_rate, self.max_in_flight, time.time())
+        except AdmissionDenied as e:
+            self.rejected[e.reason] += 1
+            logger.warning(f"Refused {endpoint} request from user {user_id}: {e.reason} limit")
+            raise
+        self.admitted += 1
+        return lease
+
+    def release(self, lease):
+        if lease.released:
+            return
+        lease.released = True
+        try:
+            self.store.release(lease)
+        except Exception as e:
+            logger.error(f"Error releasing admission lease: {str(e)}")
+
+    def get_stats(self):
+        return {
+            'mode': 'sqlite' if isinstance(self.store, SQLiteStore) else 'memory',
+            'admitted': self.admitted,
+            'rejected_rate': self.rejected['rate'],
+            'rejected_concurrency': self.rejected['concurrency'],
+            'tracked_users': self.store.tracked_users()
+        }
@@ -0,0 +1,212 @@
+"""Background analysis jobs, so request threads never wait for inference.
+
+A heavy request is turned into a job: the route stores the upload, submits a
+function and returns the job id at once. A small pool of worker threads runs
+jobs from a bounded priority queue. Clients poll the job or follow its status
+over server-sent events. A job that waits in the queue for longer than
+queue_timeout expires without running, and finished jobs are forgotten after
+result_ttl seconds.
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+import uuid
+
+from async_waiters import AsyncWaiters
+
+logger = logging.getLogger(__name__)
+
+class QueueFullError(Exception):
+    pass
+
+class Job:
+    def __init__(self, kind, user_id, func, priority, queue_timeout, cleanup=None):
+        self.job_id = uuid.uuid4().hex
+        self.kind = kind
+        self.user_id = user_id
+        self.func = func
+        self.priority = priority
+        self.cleanup = cleanup
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        # Incremented on every status change, used as the SSE event id
+        self.version = 1
+        # Async SSE streams of asgi_app.py following this job
+        self.waiters = AsyncWaiters()
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.expires_at = self.created_at + queue_timeout
+
+    @property
+    def finished(self):
+        return self.status in ('done', 'failed', 'expired')
+
+    def to_dict(self):
+        job = {
+            'job_id': self.job_id,
+            'kind': self.kind,
+            'status': self.status,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == 'done':
+            job['result'] = self.result
+        elif self.error is not None:
+            job['error'] = self.error
+        return job
+
+class JobQueue:
+    def __init__(self, workers=2, max_queued=32, queue_timeout=300, result_ttl=600):
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.result_ttl = result_ttl
+        self._heap = []
+        self._jobs = {}
+        self._order = itertools.count()
+        self._changed = threading.Condition()
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.rejected = 0
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f'analysis-job-{i}')
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, kind, user_id, func, priority=1, cleanup=None):
+        """Queue func() to run in the background; lower priorities run first.
+
+        cleanup() runs after the job finishes or expires (e.g. to delete its upload).
+        Raises QueueFullError when max_queued jobs are already waiting.
+        """
+        job = Job(kind, user_id, func, priority, self.queue_timeout, cleanup)
+        with self._changed:
+            expired = self._purge()
+            waiting = len(self._heap)
+            if waiting >= self.max_queued:
+                self.rejected += 1
+            else:
+                self._jobs[job.job_id] = job
+                heapq.heappush(self._heap, (priority, next(self._order), job))
+                self._changed.notify_all()
+        self._release_all(expired)
+        if waiting >= self.max_queued:
+            raise QueueFullError(f"{waiting} analysis jobs are already waiting")
+        logger.info(f"Queued {kind} job {job.job_id} for user {user_id} (priority {priority})")
+        return job
+
+    def get(self, job_id):
+        with self._changed:
+            expired = self._purge()
+            job = self._jobs.get(job_id)
+        self._release_all(expired)
+        return job
+
+    def wait_for_update(self, job, after_version, timeout=None):
+        """Block until the job changes past after_version (or timeout); returns its version"""
+        with self._changed:
+            self._changed.wait_for(lambda: job.version > after_version, timeout)
+            return job.version
+
+    def get_stats(self):
+        with self._changed:
+            running = sum(1 for job in self._jobs.values() if job.status == 'running')
+            return {
+                'queued': len(self._heap),
+                'running': running,
+                'workers': len(self._workers),
+                'completed': self.completed,
+                'failed': self.failed,
+                'expired': self.expired,
+                'rejected': self.rejected
+            }
+
+    def _work(self):
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: self._heap)
+                _, _, job = heapq.heappop(self._heap)
+                expired = time.time() > job.expires_at
+                if expired:
+                    self._expire(job)
+                else:
+                    self._set_status(job, 'running')
+                    job.started_at = time.time()
+            if expired:
+                # Outside the lock: cleanup deletes files and may write to the database
+                self._release(job)
+                continue
+
+            try:
+                result, status, error = job.func(), 'done', None
+            except Exception as e:
+                logger.error(f"Error in {job.kind} job {job.job_id}: {str(e)}")
+                # Exceptions may carry a structured error (see TranscriptionError)
+                result, status, error = None, 'failed', getattr(e, 'details', None) or str(e)
+            with self._changed:
+                job.result = result
+                self._set_status(job, status, error=error)
+                if status == 'done':
+                    self.completed += 1
+                else:
+                    self.failed += 1
+            self._release(job)
+
+    def _release(self, job):
+        # The function is no longer needed and may hold a large upload
+        job.func = None
+        if job.cleanup:
+            try:
+                job.cleanup()
+            except Exception as e:
+                logger.error(f"Error cleaning up job {job.job_id}: {str(e)}")
+
+    def _release_all(self, jobs):
+        # Caller must not hold self._changed
+        for job in jobs:
+            self._release(job)
+
+    def _expire(self, job):
+        # Caller holds self._changed, and releases the job once it has let go of it
+        self._set_status(job, 'expired', error='Job waited too long in the queue')
+        self.expired += 1
+
+    def _set_status(self, job, status, error=None):
+        # Caller holds self._changed
+        job.status = status
+        if error is not None:
+            job.error = error
+        if job.finished and job.finished_at is None:
+            job.finished_at = time.time()
+        job.version += 1
+        self._changed.notify_all()
+        job.waiters.notify()
+
+    def _purge(self):
+        # Caller holds self._changed; returns the jobs it expired, for the caller to release after unlocking
+        now = time.time()
+        expired = []
+        if any(now > job.expires_at for _, _, job in self._heap):
+            waiting = []
+            for entry in self._heap:
+                if now > entry[2].expires_at:
+                    self._expire(entry[2])
+                    expired.append(entry[2])
+                else:
+                    waiting.append(entry)
+            heapq.heapify(waiting)
+            self._heap = waiting
+        stale = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and now - job.finished_at > self.result_ttl
+        ]
+        for job_id in stale:
+            del self._jobs[job_id]
+        return expired
@@ -1,10 +1,25 @@
-from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session
+from flask import Flask, request, jsonify, render_template, redirect, url_for, flash, session, g, Response, stream_with_context
 from flask_login import LoginManager, login_required, login_user, logout_user, current_user
+from flask_sock import Sock
+from simple_websocket import ConnectionClosed
 from text_analyzer import TextAnalyzer
 from audio_analyzer import AudioAnalyzer
 from visual_analyzer import VisualAnalyzer
+from face_recognition import FaceRecognition
+from stream_sessions import StreamSessionManager
 from recommendation_engine import RecommendationEngine
+from wellbeing import WellbeingTracker
+from analysis_jobs import JobQueue, QueueFullError
+from admission import AdmissionController, AdmissionDenied, parse_costs
+from metrics import metrics, stage, format_gauges
+from structured_logging import log_pipeline, configure_logging, parse_sample_rates
+from request_profiler import RequestProfiler, ProfilerBusyError
 from emotion_detector import EmotionDetector
+from intent_matcher import build_chat_intents, CRISIS
+from semantic_index import QAIndex
+from generation_scheduler import create_chat_generator
+from model_client import ModelClient, RemoteEncoder, ModelServerError, InferenceBusyError
+from inference_pool import InferencePool, parse_worker_counts
 from models import db, User
 import os
 import logging
@@ -22,18 +37,45 @@ from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 import re
 import random
-
-# Configure logging
-logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-logger = logging.getLogger(__name__)
+import json
+import uuid
+import threading
+from functools import wraps
 
 load_dotenv()
 
+# Configure logging: a background thread writes the records as JSON lines, and
+# debug lines are only kept for a sample of each route's requests
+configure_logging(
+    level=os.getenv('LOG_LEVEL', 'DEBUG'),
+    json_lines=os.getenv('LOG_FORMAT', 'json') == 'json',
+    log_file=os.getenv('LOG_FILE') or None,
+    sample_rates=parse_sample_rates(os.getenv('LOG_DEBUG_SAMPLING', 'default=0.05')),
+    queue_size=int(os.getenv('LOG_QUEUE_SIZE', '10000'))
+)
+logger = logging.getLogger(__name__)
+
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'your-secret-key-here')
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///mental_health.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Maximum number of frames accepted by /analyze/visual/batch
+MAX_VISUAL_BATCH = int(os.getenv('MAX_VISUAL_BATCH', '32'))
+
+# Seconds between SSE heartbeats, and the reconnect delay suggested to EventSource clients
+SSE_HEARTBEAT_SECONDS = float(os.getenv('SSE_HEARTBEAT_SECONDS', '15'))
+SSE_RETRY_MS = 3000
+
+# Largest single frame accepted over the /ws/frames WebSocket
+MAX_STREAM_FRAME_BYTES = int(os.getenv('MAX_STREAM_FRAME_BYTES', str(512 * 1024)))
+
+# Queue priority of background analysis jobs (lower runs first); 'priority=low' defers a job
+JOB_PRIORITIES = {'visual': 0, 'transcribe': 1, 'audio': 2}
+JOB_LOW_PRIORITY_OFFSET = 10
+
+sock = Sock(app)
+
 # Initialize database
 db.init_app(app)
 
@@ -43,9 +85,41 @@ with app.app_context():
 
 logger.info("Initializing Flask app...")
 
+# With MODEL_SERVER_SOCKET set, the models are loaded once by model_server.py and shared
+# by every web worker on the node; the objects below are then thin proxies
+MODEL_SERVER_SOCKET = os.getenv('MODEL_SERVER_SOCKET')
+model_client = ModelClient(MODEL_SERVER_SOCKET) if MODEL_SERVER_SOCKET else None
+if model_client:
+    logger.info(f"Using the model server at {MODEL_SERVER_SOCKET}")
+
+# Without a model server, INFERENCE_WORKERS (e.g. 'whisper=1,visual=2') runs those models in
+# worker processes with bounded queues instead of in the request threads
+inference_pool = None
+INFERENCE_WORKERS = os.getenv('INFERENCE_WORKERS', '')
+if INFERENCE_WORKERS and not model_client:
+    try:
+        logger.info("Initializing InferencePool...")
+        inference_pool = InferencePool(
+            parse_worker_counts(INFERENCE_WORKERS),
+            max_queued=int(os.getenv('INFERENCE_QUEUE_SIZE', '8')),
+            threads_per_worker=int(os.getenv('INFERENCE_THREADS', '0')) or None
+        )
+        logger.info("InferencePool initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize InferencePool: {str(e)}")
+        logger.error(traceback.format_exc())
+
+def model_backend(name):
+    """The model server or inference pool serving a model, or None to load it in this process"""
+    if model_client:
+        return model_client
+    if inference_pool and name in inference_pool.services:
+        return inference_pool
+    return None
+
 try:
     logger.info("Initializing TextAnalyzer...")
-    text_analyzer = TextAnalyzer()
+    text_analyzer = model_backend('text').service('text') if model_backend('text') else TextAnalyzer()
     logger.info("TextAnalyzer initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize TextAnalyzer: {str(e)}")
@@ -61,11 +135,43 @@ except Exception as e:
 
 try:
     logger.info("Initializing VisualAnalyzer...")
-    visual_analyzer = VisualAnalyzer()
+    # Build and warm up the facial emotion model now (or in the background) instead of on the first request
+    if model_backend('visual'):
+        visual_analyzer = model_backend('visual').service('visual')
+    else:
+        visual_analyzer = VisualAnalyzer(background_warmup=os.getenv('VISUAL_BACKGROUND_WARMUP', '0') == '1')
     logger.info("VisualAnalyzer initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize VisualAnalyzer: {str(e)}")
     logger.error(traceback.format_exc())
+    visual_analyzer = None
+
+try:
+    logger.info("Initializing FaceRecognition...")
+    # Shares the VisualAnalyzer's emotion model; the camera is only opened on /face/start.
+    # FACE_WORKER_PROCESS=1 moves detection and inference out of the web process.
+    # The camera belongs to this process, so with a model server it loads its own emotion model.
+    face_recognizer = FaceRecognition(
+        emotion_model=None if model_backend('visual') else visual_analyzer.emotion_model,
+        use_worker_process=os.getenv('FACE_WORKER_PROCESS', '0') == '1'
+    )
+    logger.info("FaceRecognition initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize FaceRecognition: {str(e)}")
+    logger.error(traceback.format_exc())
+
+try:
+    logger.info("Initializing StreamSessionManager...")
+    # Browser camera streams from every user share this pool of analysis threads
+    stream_manager = StreamSessionManager(
+        visual_analyzer,
+        workers=int(os.getenv('STREAM_WORKERS', '2')),
+        queue_size=int(os.getenv('STREAM_QUEUE_SIZE', '2'))
+    )
+    logger.info("StreamSessionManager initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize StreamSessionManager: {str(e)}")
+    logger.error(traceback.format_exc())
 
 try:
     logger.info("Initializing RecommendationEngine...")
@@ -75,9 +181,54 @@ except Exception as e:
     logger.error(f"Failed to initialize RecommendationEngine: {str(e)}")
     logger.error(traceback.format_exc())
 
+try:
+    logger.info("Initializing WellbeingTracker...")
+    # Per-user rolling aggregates, updated on every analysis and read by the recommendations
+    wellbeing_tracker = WellbeingTracker(
+        recommendation_engine,
+        alpha=float(os.getenv('WELLBEING_EMA_ALPHA', '0.3'))
+    )
+    logger.info("WellbeingTracker initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize WellbeingTracker: {str(e)}")
+    logger.error(traceback.format_exc())
+
+try:
+    logger.info("Initializing JobQueue...")
+    # Analyses submitted through /jobs run on these workers instead of in request threads
+    job_queue = JobQueue(
+        workers=int(os.getenv('JOB_WORKERS', '2')),
+        max_queued=int(os.getenv('JOB_QUEUE_SIZE', '32')),
+        queue_timeout=float(os.getenv('JOB_QUEUE_TIMEOUT', '300')),
+        result_ttl=float(os.getenv('JOB_RESULT_TTL', '600'))
+    )
+    logger.info("JobQueue initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize JobQueue: {str(e)}")
+    logger.error(traceback.format_exc())
+
+# Per-user token buckets and in-flight caps in front of the analysis endpoints
+admission = None
+if os.getenv('ADMISSION_CONTROL', '1') == '1':
+    try:
+        logger.info("Initializing AdmissionController...")
+        admission = AdmissionController(
+            capacity=float(os.getenv('ADMISSION_CAPACITY', '60')),
+            refill_rate=float(os.getenv('ADMISSION_REFILL_RATE', '1')),
+            max_in_flight=int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '2')),
+            costs=parse_costs(os.getenv('ADMISSION_COSTS', '')),
+            # A shared SQLite file keeps the limits consistent across web workers
+            db_path=os.getenv('ADMISSION_DB') or None
+        )
+        logger.info("AdmissionController initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize AdmissionController: {str(e)}")
+        logger.error(traceback.format_exc())
+        admission = None
+
 try:
     logger.info("Initializing EmotionDetector...")
-    emotion_detector = EmotionDetector()
+    emotion_detector = model_backend('voice').service('voice') if model_backend('voice') else EmotionDetector()
     logger.info("EmotionDetector initialized successfully")
 except Exception as e:
     logger.error(f"Failed to initialize EmotionDetector: {str(e)}")
@@ -86,7 +237,7 @@ except Exception as e:
 # Initialize Whisper model
 try:
     logger.info("Loading Whisper model...")
-    whisper_model = whisper.load_model("base")
+    whisper_model = model_backend('whisper').service('whisper') if model_backend('whisper') else whisper.load_model("base")
     logger.info("Whisper model loaded successfully")
 except Exception as e:
     logger.error(f"Failed to load Whisper model: {str(e)}")
@@ -96,18 +247,37 @@ except Exception as e:
 # Initialize model and tokenizer for chatbot
 try:
     logger.info("Loading DialoGPT model and tokenizer...")
-    chat_tokenizer = AutoTokenizer.from_pretrained("microsoft/DialoGPT-medium")
-    chat_model = AutoModelForCausalLM.from_pretrained("microsoft/DialoGPT-medium")
+    if model_client:
+        chat_generator = model_client.service('chat')
+    else:
+        chat_tokenizer = AutoTokenizer.from_pretrained("microsoft/DialoGPT-medium")
+        chat_model = AutoModelForCausalLM.from_pretrained("microsoft/DialoGPT-medium")
+        # Replies stream token by token, each session keeps its DialoGPT cache and concurrent
+        # replies share one decoding batch (CHAT_BATCH_SIZE=0 generates each reply on its own)
+        chat_generator = create_chat_generator(chat_tokenizer, chat_model)
     logger.info("Model and tokenizer loaded successfully")
 except Exception as e:
     logger.error(f"Failed to load model: {str(e)}")
     logger.error(traceback.format_exc())
     raise
 
+# Generative chat: the chat page streams DialoGPT replies instead of canned answers
+CHAT_GENERATIVE = os.getenv('CHAT_GENERATIVE', '0') == '1'
+
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
+# Users allowed on the /admin routes, e.g. 'alice,bob'
+ADMIN_USERNAMES = {name.strip() for name in os.getenv('ADMIN_USERNAMES', '').split(',') if name.strip()}
+
+# On-demand sampling of live requests, armed at /admin/profile
+request_profiler = RequestProfiler(
+    os.getenv('PROFILE_DIR', os.path.join(app.instance_path, 'profiles')),
+    interval=float(os.getenv('PROFILE_INTERVAL_MS', '5')) / 1000,
+    max_seconds=float(os.getenv('PROFILE_MAX_SECONDS', '600'))
+)
+
 @login_manager.user_loader
 def load_user(user_id):
     return User.query.get(int(user_id))
@@ -128,7 +298,7 @@ def convert_webm_to_wav(input_path, output_path):
         for path in ffmpeg_paths:
             if path and os.path.exists(path):
                 ffmpeg_path = path
-                logger.info(f"Found ffmpeg at: {ffmpeg_path}")
+                logger.debug("Found ffmpeg at: %s", ffmpeg_path)
                 break
         
         if ffmpeg_path is None:
@@ -145,19 +315,199 @@ def convert_webm_to_wav(input_path, output_path):
             output_path
         ]
         
-        logger.info(f"Running ffmpeg command: {' '.join(command)}")
-        result = subprocess.run(command, capture_output=True, text=True)
+        logger.debug("Running ffmpeg command: %s", command)
+        with stage('ffmpeg'):
+            result = subprocess.run(command, capture_output=True, text=True)
         
         if result.returncode != 0:
             logger.error(f"ffmpeg error: {result.stderr}")
             raise Exception(f"ffmpeg conversion failed: {result.stderr}")
         
-        logger.info(f"Successfully converted {input_path} to {output_path}")
+        logger.debug("Converted %s to %s", input_path, output_path)
         return True
     except Exception as e:
         logger.error(f"Error converting audio: {str(e)}")
         raise
 
+def remove_temp_files(*paths):
+    for path in paths:
+        if path and os.path.exists(path):
+            try:
+                os.unlink(path)
+                logger.debug("Cleaned up temporary file: %s", path)
+            except Exception as e:
+                logger.error(f"Error cleaning up temporary file: {str(e)}")
+
+def save_upload(file_storage, suffix='.webm'):
+    """Save an uploaded file to a temporary path; the caller removes it"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+        file_storage.save(temp_file.name)
+        logger.debug("Saved upload to temporary file: %s", temp_file.name)
+        return temp_file.name
+
+class TranscriptionError(Exception):
+    """Transcription failed both after conversion and directly; details is the JSON error body"""
+
+    def __init__(self, details):
+        super().__init__(details['error'])
+        self.details = details
+
+def run_audio_analysis(webm_path, user_id):
+    """Voice emotion plus transcription and text analysis of one recording"""
+    # Convert WebM to WAV for analysis
+    wav_path = webm_path + '.wav'
+    try:
+        convert_webm_to_wav(webm_path, wav_path)
+        
+        # Perform voice modulation and emotion analysis
+        with stage('voice_emotion'):
+            voice_analysis = emotion_detector.detect_emotion(wav_path)
+        
+        # Perform text analysis on transcribed audio (separate from voice analysis)
+        text_analysis = None
+        if whisper_model is not None:
+            with stage('whisper'):
+                result = whisper_model.transcribe(wav_path)
+            text = result['text']
+            with stage('text_analysis'):
+                text_analysis = {
+                    'transcription': text,
+                    'text_analysis': text_analyzer.analyze(text)
+                }
+        
+        # Combine results
+        analysis = {
+            'voice_analysis': voice_analysis,
+            'text_analysis': text_analysis
+        }
+        
+        with stage('wellbeing'):
+            history = wellbeing_tracker.update(user_id, 'audio', analysis)
+        with stage('recommendations'):
+            recommendations = recommendation_engine.get_recommendations(analysis, history)
+        return {
+            'analysis': analysis,
+            'recommendations': recommendations
+        }
+    finally:
+        remove_temp_files(wav_path)
+
+def run_transcription(webm_path):
+    """Whisper transcription of one recording, converted to WAV first when ffmpeg works"""
+    wav_path = webm_path + '.wav'
+    try:
+        # Try to convert WebM to WAV
+        try:
+            convert_webm_to_wav(webm_path, wav_path)
+            
+            # Transcribe the audio using Whisper
+            logger.debug("Starting transcription with Whisper")
+            with stage('whisper'):
+                result = whisper_model.transcribe(wav_path)
+            logger.debug("Transcription completed successfully")
+            
+            return {'text': result['text']}
+        except InferenceBusyError:
+            raise
+        except Exception as e:
+            logger.warning(f"Error converting audio: {str(e)}")
+            logger.warning("Attempting direct transcription with Whisper")
+            
+            # Try to transcribe the WebM file directly with Whisper
+            try:
+                logger.info("Attempting to transcribe WebM file directly with Whisper")
+                with stage('whisper'):
+                    result = whisper_model.transcribe(webm_path)
+                logger.info("Direct transcription completed successfully")
+                return {'text': result['text']}
+            except InferenceBusyError:
+                raise
+            except Exception as direct_error:
+                logger.error(f"Direct transcription failed: {str(direct_error)}")
+                
+                # Provide detailed error information
+                raise TranscriptionError({
+                    'error': 'Failed to process audio file. Please check your FFmpeg installation.',
+                    'ffmpeg_error': str(e),
+                    'whisper_error': str(direct_error),
+                    'installation_guide': {
+                        'windows': 'Download from https://ffmpeg.org/download.html and add to PATH',
+                        'macos': 'Run: brew install ffmpeg',
+                        'linux': 'Run: sudo apt-get install ffmpeg'
+                    },
+                    'troubleshooting': [
+                        'Make sure FFmpeg is installed and accessible from the command line',
+                        'Try running "ffmpeg -version" in a command prompt to verify installation',
+                        'Check if the PATH environment variable includes the FFmpeg directory',
+                        'Restart the application after installing FFmpeg'
+                    ]
+                })
+    finally:
+        remove_temp_files(wav_path)
+
+def run_text_analysis(text, user_id):
+    with stage('text_analysis'):
+        analysis = text_analyzer.analyze(text)
+    logger.debug("Text analysis completed successfully")
+    
+    # Get recommendations
+    try:
+        with stage('wellbeing'):
+            history = wellbeing_tracker.update(user_id, 'text', analysis)
+        with stage('recommendations'):
+            recommendations = recommendation_engine.get_recommendations(analysis, history)
+        logger.debug("Recommendations generated successfully")
+    except Exception as e:
+        logger.error(f"Error generating recommendations: {str(e)}")
+        logger.error(traceback.format_exc())
+        recommendations = []  # Return empty recommendations if there's an error
+    
+    return {
+        'analysis': analysis,
+        'recommendations': recommendations
+    }
+
+# Questionnaire answers arrive as question_1 ... question_10, in this category order
+QUESTIONNAIRE_CATEGORIES = [
+    'energy_level', 'thought_patterns', 'sleep_quality', 'social_connection', 'self_relationship',
+    'motivation', 'stress_management', 'purpose', 'self_care', 'life_satisfaction'
+]
+
+def run_questionnaire_analysis(responses, user_id):
+    # Convert question responses to category responses
+    category_responses = {
+        category: responses.get(f'question_{number}', '')
+        for number, category in enumerate(QUESTIONNAIRE_CATEGORIES, start=1)
+    }
+    with stage('questionnaire_analysis'):
+        analysis = text_analyzer.analyze_questionnaire(category_responses)
+    with stage('wellbeing'):
+        wellbeing_tracker.update(user_id, 'questionnaire', analysis)
+    return analysis
+
+def run_visual_batch_analysis(images, user_id):
+    # Faces from all frames go through the emotion model in a single batch
+    with stage('visual_analysis'):
+        result = visual_analyzer.analyze_batch(images)
+    with stage('wellbeing'):
+        history = wellbeing_tracker.update(user_id, 'visual', result['summary'])
+    with stage('recommendations'):
+        result['recommendations'] = recommendation_engine.get_recommendations(result['summary'], history)
+    return result
+
+def run_visual_analysis(image_data, user_id):
+    # Analyze the image using DeepFace
+    with stage('visual_analysis'):
+        analysis = visual_analyzer.analyze(image_data)
+    with stage('wellbeing'):
+        history = wellbeing_tracker.update(user_id, 'visual', analysis)
+    with stage('recommendations'):
+        recommendations = recommendation_engine.get_recommendations(analysis, history)
+    return {
+        'analysis': analysis,
+        'recommendations': recommendations
+    }
+
 # Mental health related keywords and responses
 MENTAL_HEALTH_KEYWORDS = {
     # Anxiety-related questions
@@ -377,22 +727,148 @@ CONVERSATIONAL_PROMPTS = {
     }
 }
 
+CRISIS_KEYWORDS = ['suicide', 'kill myself', 'end it all', 'want to die']
+
+# Crisis keywords, conversational prompts, specific questions and topics, compiled once
+CHAT_INTENTS = build_chat_intents(
+    MENTAL_HEALTH_KEYWORDS,
+    CONVERSATIONAL_PROMPTS,
+    CRISIS_KEYWORDS,
+    MENTAL_HEALTH_KEYWORDS['crisis']['suicide prevention']
+)
+
+# Semantic retrieval answers questions that don't contain a literal key
+qa_index = None
+if os.getenv('CHAT_RETRIEVAL', '1') == '1':
+    try:
+        logger.info("Initializing Q&A retrieval index...")
+        qa_index = QAIndex(
+            MENTAL_HEALTH_KEYWORDS,
+            encoder=RemoteEncoder(model_backend('encoder')) if model_backend('encoder') else None,
+            index_path=os.getenv('QA_INDEX_PATH', os.path.join(app.instance_path, 'qa_index.npz')),
+            min_score=float(os.getenv('QA_MIN_SIMILARITY', '0.45'))
+        )
+        logger.info("Q&A retrieval index initialized successfully")
+    except Exception as e:
+        logger.error(f"Failed to initialize Q&A retrieval index: {str(e)}")
+        logger.error(traceback.format_exc())
+        qa_index = None
+
 def generate_mental_health_response(user_input):
-    # Convert input to lowercase for case-insensitive matching
-    input_lower = user_input.lower()
+    # One pass over the message finds the highest-priority intent
+    with stage('intent_match'):
+        responses = CHAT_INTENTS.match(user_input)
+    if responses:
+        return random.choice(responses)
     
-    # Check for crisis keywords first
-    if any(keyword in input_lower for keyword in ['suicide', 'kill myself', 'end it all', 'want to die']):
-        return random.choice(MENTAL_HEALTH_KEYWORDS['crisis'])
-    
-    # Check for other mental health keywords
-    for keyword, responses in MENTAL_HEALTH_KEYWORDS.items():
-        if keyword in input_lower:
-            return random.choice(responses)
+    # Otherwise answer with the most similar known question, if any is close enough
+    if qa_index is not None:
+        try:
+            with stage('retrieval'):
+                answer = qa_index.answer(user_input)
+            if answer:
+                return answer
+        except Exception as e:
+            logger.error(f"Error in Q&A retrieval: {str(e)}")
     
     # If no specific keyword matches, return a general supportive response
     return random.choice(GENERAL_SUPPORT)
 
+@app.before_request
+def start_request_logging():
+    g.log_token = log_pipeline.begin_request(request.endpoint or 'unmatched')
+
+@app.before_request
+def start_request_profile():
+    profile = request_profiler.begin(request.endpoint or 'unmatched')
+    if profile is not None:
+        g.profile = profile
+
+@app.before_request
+def start_request_timing():
+    g.request_timing = metrics.begin_request(request.endpoint or 'unmatched')
+
+@app.after_request
+def add_server_timing(response):
+    # Stage durations of this request, shown in the browser's network panel
+    timing = g.pop('request_timing', None)
+    if timing is not None:
+        response.headers['Server-Timing'] = metrics.finish_request(*timing, response.status_code)
+    return response
+
+@app.teardown_request
+def finish_request_timing(error=None):
+    # after_request is skipped when a view raises
+    timing = g.pop('request_timing', None)
+    if timing is not None:
+        metrics.finish_request(*timing, 500)
+
+@app.after_request
+def add_request_id(response):
+    # Matches the request_id field of this request's log lines
+    request_id = log_pipeline.current_request_id()
+    if request_id is not None:
+        response.headers['X-Request-ID'] = request_id
+    return response
+
+@app.teardown_request
+def end_request_profile(error=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        request_profiler.end(profile)
+
+@app.teardown_request
+def end_request_logging(error=None):
+    token = g.pop('log_token', None)
+    if token is not None:
+        log_pipeline.end_request(token)
+
+def busy_response(error):
+    # Shed load quickly instead of queueing behind a saturated model
+    logger.warning(f"Rejected request: {str(error)}")
+    return jsonify(error.details), 429, {'Retry-After': str(error.retry_after)}
+
+def admission_controlled(endpoint):
+    """Apply the per-user limits to an analysis route; the request counts as in flight until it returns"""
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            if admission is None:
+                return view(*args, **kwargs)
+            try:
+                lease = admission.acquire(current_user.id, endpoint)
+            except AdmissionDenied as e:
+                return busy_response(e)
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission.release(lease)
+        return wrapped
+    return decorator
+
+def get_visual_readiness():
+    """Readiness of the visual model; a pooled model answers from its workers without waiting in its queue"""
+    if visual_analyzer is None:
+        return {'ready': False}
+    if inference_pool and 'visual' in inference_pool.services:
+        return inference_pool.get_readiness('visual')
+    if model_client:
+        try:
+            return model_client.call('pool', 'get_readiness', 'visual')
+        except ModelServerError:
+            # The model server loads the visual model itself rather than in its pool
+            pass
+        except OSError as e:
+            return {'ready': False, 'error': str(e)}
+    return visual_analyzer.get_status()
+
+@app.route('/ready')
+def ready():
+    # Readiness probe: reports model load and warm-up times
+    status = {'visual': get_visual_readiness()}
+    is_ready = all(component['ready'] for component in status.values())
+    return jsonify({'ready': is_ready, 'components': status}), 200 if is_ready else 503
+
 @app.route('/')
 def home():
     if not current_user.is_authenticated:
@@ -446,6 +922,11 @@ def signup():
         if User.query.filter_by(username=username).first():
             flash('Username already exists', 'error')
             return redirect(url_for('signup'))
+
+        # Admin rights come with the name, so a listed admin that has no account yet can't be claimed
+        if username in ADMIN_USERNAMES:
+            flash('Username is not available', 'error')
+            return redirect(url_for('signup'))
         
         if User.query.filter_by(email=email).first():
             flash('Email already exists', 'error')
@@ -470,6 +951,7 @@ def logout():
 
 @app.route('/analyze/text', methods=['POST'])
 @login_required
+@admission_controlled('text')
 def analyze_text():
     try:
         # Get text from request
@@ -483,31 +965,19 @@ def analyze_text():
             logger.error("Empty text provided")
             return jsonify({'error': 'Empty text provided'}), 400
         
-        logger.info(f"Analyzing text: {text[:100]}...")  # Log first 100 chars
+        # Length only: the text itself is the user's private journal
+        logger.debug("Analyzing text (%d characters)", len(text))
         
         # Perform text analysis
         try:
-            analysis = text_analyzer.analyze(text)
-            logger.info("Text analysis completed successfully")
+            return jsonify(run_text_analysis(text, current_user.id))
+        except InferenceBusyError as e:
+            return busy_response(e)
         except Exception as e:
             logger.error(f"Error in text analysis: {str(e)}")
             logger.error(traceback.format_exc())
             return jsonify({'error': f'Text analysis error: {str(e)}'}), 500
         
-        # Get recommendations
-        try:
-            recommendations = recommendation_engine.get_recommendations(analysis)
-            logger.info("Recommendations generated successfully")
-        except Exception as e:
-            logger.error(f"Error generating recommendations: {str(e)}")
-            logger.error(traceback.format_exc())
-            recommendations = []  # Return empty recommendations if there's an error
-        
-        return jsonify({
-            'analysis': analysis,
-            'recommendations': recommendations
-        })
-        
     except Exception as e:
         logger.error(f"Unexpected error in text analysis endpoint: {str(e)}")
         logger.error(traceback.format_exc())
@@ -515,68 +985,31 @@ def analyze_text():
 
 @app.route('/analyze/audio', methods=['POST'])
 @login_required
+@admission_controlled('audio')
 def analyze_audio():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
     
-    audio_file = request.files['audio']
-    
     # Create temporary file for audio processing
     temp_webm_path = None
-    temp_wav_path = None
     
     try:
         # Save the uploaded file to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_webm:
-            temp_webm_path = temp_webm.name
-            audio_file.save(temp_webm_path)
-            logger.info(f"Saved audio to temporary file: {temp_webm_path}")
-        
-        # Convert WebM to WAV for analysis
-        temp_wav_path = temp_webm_path + '.wav'
-        convert_webm_to_wav(temp_webm_path, temp_wav_path)
-        
-        # Perform voice modulation and emotion analysis
-        voice_analysis = emotion_detector.detect_emotion(temp_wav_path)
-        
-        # Perform text analysis on transcribed audio (separate from voice analysis)
-        text_analysis = None
-        if whisper_model is not None:
-            result = whisper_model.transcribe(temp_wav_path)
-            text = result['text']
-            text_analysis = {
-                'transcription': text,
-                'text_analysis': text_analyzer.analyze(text)
-            }
-        
-        # Combine results
-        analysis = {
-            'voice_analysis': voice_analysis,
-            'text_analysis': text_analysis
-        }
-        
-        recommendations = recommendation_engine.get_recommendations(analysis)
-        
-        return jsonify({
-            'analysis': analysis,
-            'recommendations': recommendations
-        })
+        temp_webm_path = save_upload(request.files['audio'])
+        return jsonify(run_audio_analysis(temp_webm_path, current_user.id))
+    except InferenceBusyError as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"Error in audio analysis: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': f'Audio analysis error: {str(e)}'}), 500
     finally:
         # Clean up temporary files
-        for path in [temp_webm_path, temp_wav_path]:
-            if path and os.path.exists(path):
-                try:
-                    os.unlink(path)
-                    logger.info(f"Cleaned up temporary file: {path}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up temporary file: {str(e)}")
+        remove_temp_files(temp_webm_path)
 
 @app.route('/analyze/visual', methods=['POST'])
 @login_required
+@admission_controlled('visual')
 def analyze_visual():
     if 'image' not in request.files:
         return jsonify({'error': 'No image file provided'}), 400
@@ -584,20 +1017,34 @@ def analyze_visual():
     try:
         image_file = request.files['image']
         image_data = image_file.read()
-        
-        # Analyze the image using DeepFace
-        analysis = visual_analyzer.analyze(image_data)
-        
-        return jsonify({
-            'analysis': analysis,
-            'recommendations': recommendation_engine.get_recommendations(analysis)
-        })
+        return jsonify(run_visual_analysis(image_data, current_user.id))
+    except InferenceBusyError as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"Error in visual analysis: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/analyze/visual/batch', methods=['POST'])
+@login_required
+@admission_controlled('visual_batch')
+def analyze_visual_batch():
+    images = request.files.getlist('images')
+    if not images:
+        return jsonify({'error': 'No image files provided'}), 400
+    if len(images) > MAX_VISUAL_BATCH:
+        return jsonify({'error': f'Too many images, at most {MAX_VISUAL_BATCH} per request'}), 400
+
+    try:
+        return jsonify(run_visual_batch_analysis([image.read() for image in images], current_user.id))
+    except InferenceBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error in batch visual analysis: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/transcribe', methods=['POST'])
 @login_required
+@admission_controlled('transcribe')
 def transcribe():
     if 'audio' not in request.files:
         return jsonify({'error': 'No audio file provided'}), 400
@@ -606,107 +1053,168 @@ def transcribe():
         return jsonify({'error': 'Speech recognition model not loaded'}), 500
     
     audio_file = request.files['audio']
-    logger.info(f"Received audio file: {audio_file.filename}, size: {audio_file.content_length} bytes")
+    logger.debug("Received audio file: %s, size: %s bytes", audio_file.filename, audio_file.content_length)
     
     # Create temporary files
     temp_webm_path = None
-    temp_wav_path = None
     
     try:
         # Save the uploaded file to a temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.webm') as temp_webm:
-            temp_webm_path = temp_webm.name
-            audio_file.save(temp_webm_path)
-            logger.info(f"Saved audio to temporary file: {temp_webm_path}")
+        temp_webm_path = save_upload(audio_file)
         
         # Check if the file exists and has content
         if not os.path.exists(temp_webm_path) or os.path.getsize(temp_webm_path) == 0:
             logger.error(f"Temporary file is missing or empty: {temp_webm_path}")
             return jsonify({'error': 'Invalid audio file'}), 400
         
-        # Try to convert WebM to WAV
-        try:
-            temp_wav_path = temp_webm_path + '.wav'
-            convert_webm_to_wav(temp_webm_path, temp_wav_path)
-            
-            # Transcribe the audio using Whisper
-            logger.info("Starting transcription with Whisper")
-            result = whisper_model.transcribe(temp_wav_path)
-            logger.info("Transcription completed successfully")
-            
-            return jsonify({'text': result['text']})
-        except Exception as e:
-            logger.warning(f"Error converting audio: {str(e)}")
-            logger.warning("Attempting direct transcription with Whisper")
-            
-            # Try to transcribe the WebM file directly with Whisper
-            try:
-                logger.info("Attempting to transcribe WebM file directly with Whisper")
-                result = whisper_model.transcribe(temp_webm_path)
-                logger.info("Direct transcription completed successfully")
-                return jsonify({'text': result['text']})
-            except Exception as direct_error:
-                logger.error(f"Direct transcription failed: {str(direct_error)}")
-                
-                # Provide detailed error information
-                error_details = {
-                    'error': 'Failed to process audio file. Please check your FFmpeg installation.',
-                    'ffmpeg_error': str(e),
-                    'whisper_error': str(direct_error),
-                    'installation_guide': {
-                        'windows': 'Download from https://ffmpeg.org/download.html and add to PATH',
-                        'macos': 'Run: brew install ffmpeg',
-                        'linux': 'Run: sudo apt-get install ffmpeg'
-                    },
-                    'troubleshooting': [
-                        'Make sure FFmpeg is installed and accessible from the command line',
-                        'Try running "ffmpeg -version" in a command prompt to verify installation',
-                        'Check if the PATH environment variable includes the FFmpeg directory',
-                        'Restart the application after installing FFmpeg'
-                    ]
-                }
-                
-                return jsonify(error_details), 500
+        return jsonify(run_transcription(temp_webm_path))
+    except TranscriptionError as e:
+        return jsonify(e.details), 500
+    except InferenceBusyError as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"Error in transcription: {str(e)}")
         logger.error(traceback.format_exc())
         return jsonify({'error': f'Transcription error: {str(e)}'}), 500
     finally:
         # Clean up temporary files
-        for path in [temp_webm_path, temp_wav_path]:
-            if path and os.path.exists(path):
-                try:
-                    os.unlink(path)
-                    logger.info(f"Cleaned up temporary file: {path}")
-                except Exception as e:
-                    logger.error(f"Error cleaning up temporary file: {str(e)}")
+        remove_temp_files(temp_webm_path)
+
+def enqueue_job(kind, user_id, run, cleanup=None, low_priority=False):
+    """Queue run(user_id) as a background job; raises AdmissionDenied or QueueFullError after cleaning up"""
+    priority = JOB_PRIORITIES[kind]
+    if low_priority:
+        priority += JOB_LOW_PRIORITY_OFFSET
+
+    # A job counts against the user's limits until it finishes or expires
+    lease = None
+    if admission is not None:
+        try:
+            lease = admission.acquire(user_id, kind)
+        except AdmissionDenied:
+            if cleanup:
+                cleanup()
+            raise
+
+    def job():
+        # Workers run outside any request; the wellbeing update needs the app's database
+        route = f'job_{kind}'
+        with app.app_context(), metrics.request_timing(route), log_pipeline.request_logging(route), request_profiler.profiling(route):
+            return run(user_id)
+
+    def finish():
+        if lease is not None:
+            admission.release(lease)
+        if cleanup:
+            cleanup()
+
+    try:
+        return job_queue.submit(kind, user_id, job, priority, finish)
+    except QueueFullError:
+        finish()
+        raise
+
+def submit_job(kind, run, cleanup=None):
+    """Queue run(user_id) as a background job and answer 202 with where to find the result"""
+    try:
+        queued = enqueue_job(kind, current_user.id, run, cleanup, low_priority=request.values.get('priority') == 'low')
+    except AdmissionDenied as e:
+        return busy_response(e)
+    except QueueFullError as e:
+        logger.warning(f"Rejected {kind} job: {str(e)}")
+        return jsonify({'error': 'The analysis queue is full, please try again shortly'}), 503, {'Retry-After': '5'}
+
+    status_url = url_for('job_status', job_id=queued.job_id)
+    return jsonify({
+        'job_id': queued.job_id,
+        'status': queued.status,
+        'status_url': status_url,
+        'events_url': url_for('job_events', job_id=queued.job_id)
+    }), 202, {'Location': status_url}
+
+@app.route('/jobs/analyze/audio', methods=['POST'])
+@login_required
+def submit_audio_job():
+    if 'audio' not in request.files:
+        return jsonify({'error': 'No audio file provided'}), 400
+    temp_webm_path = save_upload(request.files['audio'])
+    return submit_job('audio', lambda user_id: run_audio_analysis(temp_webm_path, user_id),
+                      cleanup=lambda: remove_temp_files(temp_webm_path))
+
+@app.route('/jobs/transcribe', methods=['POST'])
+@login_required
+def submit_transcription_job():
+    if 'audio' not in request.files:
+        return jsonify({'error': 'No audio file provided'}), 400
+    if whisper_model is None:
+        return jsonify({'error': 'Speech recognition model not loaded'}), 500
+    temp_webm_path = save_upload(request.files['audio'])
+    if os.path.getsize(temp_webm_path) == 0:
+        remove_temp_files(temp_webm_path)
+        return jsonify({'error': 'Invalid audio file'}), 400
+    return submit_job('transcribe', lambda user_id: run_transcription(temp_webm_path),
+                      cleanup=lambda: remove_temp_files(temp_webm_path))
+
+@app.route('/jobs/analyze/visual', methods=['POST'])
+@login_required
+def submit_visual_job():
+    if 'image' not in request.files:
+        return jsonify({'error': 'No image file provided'}), 400
+    image_data = request.files['image'].read()
+    return submit_job('visual', lambda user_id: run_visual_analysis(image_data, user_id))
+
+def find_job(job_id):
+    # Other users' jobs look the same as unknown ones
+    job = job_queue.get(job_id)
+    return job if job is not None and job.user_id == current_user.id else None
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/events')
+@login_required
+def job_events(job_id):
+    # Server-sent events: one 'status' event per change until the job finishes
+    job = find_job(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def events():
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        version = 0
+        while True:
+            new_version = job_queue.wait_for_update(job, version, timeout=SSE_HEARTBEAT_SECONDS)
+            if new_version > version:
+                version = new_version
+                yield f"id: {version}\nevent: status\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.finished:
+                    return
+            else:
+                yield ": heartbeat\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
 
 @app.route('/analyze/questionnaire', methods=['POST'])
 @login_required
+@admission_controlled('questionnaire')
 def analyze_questionnaire():
     try:
         responses = request.get_json()
         if not responses:
             return jsonify({'error': 'No responses provided'}), 400
 
-        # Convert question responses to category responses
-        category_responses = {
-            'energy_level': responses.get('question_1', ''),
-            'thought_patterns': responses.get('question_2', ''),
-            'sleep_quality': responses.get('question_3', ''),
-            'social_connection': responses.get('question_4', ''),
-            'self_relationship': responses.get('question_5', ''),
-            'motivation': responses.get('question_6', ''),
-            'stress_management': responses.get('question_7', ''),
-            'purpose': responses.get('question_8', ''),
-            'self_care': responses.get('question_9', ''),
-            'life_satisfaction': responses.get('question_10', '')
-        }
-
-        # Analyze questionnaire responses
-        analysis = text_analyzer.analyze_questionnaire(category_responses)
-        
-        return jsonify(analysis)
+        return jsonify(run_questionnaire_analysis(responses, current_user.id))
+    except InferenceBusyError as e:
+        return busy_response(e)
     except Exception as e:
         logger.error(f"Error in questionnaire analysis: {str(e)}")
         return jsonify({'error': str(e)}), 500
@@ -732,10 +1240,252 @@ def chat():
         logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({'error': 'An error occurred while processing your message'}), 500
 
+@app.route('/face')
+@login_required
+def face_page():
+    return render_template('face_recognition.html')
+
+@app.route('/face/start', methods=['POST'])
+@login_required
+def face_start():
+    try:
+        if face_recognizer.start():
+            return jsonify({'status': 'success'})
+        return jsonify({'status': 'error', 'message': face_recognizer.error}), 500
+    except Exception as e:
+        logger.error(f"Error starting face recognition: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/face/stop', methods=['POST'])
+@login_required
+def face_stop():
+    try:
+        face_recognizer.stop()
+        return jsonify({'status': 'success'})
+    except Exception as e:
+        logger.error(f"Error stopping face recognition: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+def face_emotion_payload(emotion):
+    return {
+        'status': 'success',
+        'running': face_recognizer.is_running,
+        'dominant_emotion': emotion['dominant_emotion'],
+        'confidence': emotion['confidence'],
+        # The page renders fractions (0-1)
+        'emotions': {name: score / 100 for name, score in emotion['emotion_scores'].items()}
+    }
+
+@app.route('/face/emotion')
+@login_required
+def face_emotion():
+    try:
+        return jsonify(face_emotion_payload(face_recognizer.get_current_emotion()))
+    except Exception as e:
+        logger.error(f"Error getting face emotion: {str(e)}")
+        return jsonify({'status': 'error', 'message': str(e)}), 500
+
+@app.route('/face/emotion/stream')
+@login_required
+def face_emotion_stream():
+    # Server-sent events: one event per significant emotion change, comments as heartbeats.
+    # EventSource reconnects with Last-Event-ID, so an unchanged result isn't sent twice.
+    try:
+        last_version = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_version = 0
+    if last_version > face_recognizer.emotion_version:
+        # Counter restarted with the server
+        last_version = 0
+
+    def events(version):
+        yield f"retry: {SSE_RETRY_MS}\n\n"
+        while True:
+            new_version, emotion = face_recognizer.wait_for_emotion(version, timeout=SSE_HEARTBEAT_SECONDS)
+            if new_version > version:
+                version = new_version
+                yield f"id: {version}\nevent: emotion\ndata: {json.dumps(face_emotion_payload(emotion))}\n\n"
+            else:
+                yield ": heartbeat\n\n"
+
+    return Response(
+        stream_with_context(events(last_version)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@sock.route('/ws/frames')
+def stream_frames(ws):
+    # Browsers send downscaled JPEG frames as binary messages and get JSON results back
+    if not current_user.is_authenticated:
+        ws.close(reason=1008, message='Login required')
+        return
+
+    stream = stream_manager.open(current_user.id)
+    send_lock = threading.Lock()
+
+    def send_results():
+        # Woken by the analysis workers when a result is ready; exits once the stream is closed
+        sent_version = 0
+        try:
+            while True:
+                version, result = stream.wait_for_result(sent_version)
+                if stream.closed:
+                    return
+                sent_version = version
+                with send_lock:
+                    ws.send(json.dumps({
+                        'status': 'success',
+                        'analysis': result,
+                        'stats': stream.get_stats()
+                    }))
+        except ConnectionClosed:
+            pass
+
+    sender = threading.Thread(target=send_results, name=f'stream-sender-{stream.session_id}', daemon=True)
+    sender.start()
+    try:
+        while True:
+            data = ws.receive()
+            if isinstance(data, bytes):
+                if len(data) > MAX_STREAM_FRAME_BYTES:
+                    with send_lock:
+                        ws.send(json.dumps({'status': 'error', 'message': 'Frame too large'}))
+                else:
+                    stream_manager.submit(stream, data)
+    except ConnectionClosed:
+        pass
+    finally:
+        stream_manager.close(stream)
+        sender.join(timeout=1)
+
+@app.route('/chat/stream', methods=['POST'])
+@login_required
+def chat_stream():
+    # Server-sent events over a POST response: one 'token' event per generated piece, then 'done'
+    data = request.get_json() or {}
+    user_message = data.get('message', '').strip()
+    if not user_message:
+        return jsonify({'error': 'No message provided'}), 400
+
+    if 'chat_session_id' not in session:
+        session['chat_session_id'] = uuid.uuid4().hex
+    session_id = f"{current_user.id}:{session['chat_session_id']}"
+
+    # Crisis messages always get the vetted crisis answer, never generated text
+    priority, responses = CHAT_INTENTS.match_with_priority(user_message)
+
+    def events():
+        try:
+            if priority == CRISIS:
+                yield f"event: token\ndata: {json.dumps(random.choice(responses))}\n\n"
+            else:
+                for piece in chat_generator.stream(session_id, user_message):
+                    yield f"event: token\ndata: {json.dumps(piece)}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"Error in chat generation: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield f"event: error\ndata: {json.dumps('An error occurred while generating a response')}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@app.route('/chat/stats')
+@login_required
+def chat_stats():
+    # Generation throughput and queueing of the shared chat batch
+    return jsonify(chat_generator.get_stats())
+
+def get_inference_stats():
+    """Stats of each pooled model, here or in the model server; {} without an inference pool"""
+    if model_client:
+        try:
+            return model_client.call('pool', 'get_stats')
+        except ModelServerError:
+            # The model server runs without an inference pool
+            return {}
+    return inference_pool.get_stats() if inference_pool else {}
+
+@app.route('/inference/stats')
+@login_required
+def inference_stats():
+    # Queue depth, rejections and service time of each pooled model
+    return jsonify(get_inference_stats())
+
+def admin_required(view):
+    """Restrict a route to the users listed in ADMIN_USERNAMES"""
+    @wraps(view)
+    @login_required
+    def wrapped(*args, **kwargs):
+        if current_user.username not in ADMIN_USERNAMES:
+            logger.warning(f"User {current_user.username} tried to reach admin route {request.path}")
+            return jsonify({'error': 'Admin access required'}), 403
+        return view(*args, **kwargs)
+    return wrapped
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def admin_profile():
+    """Arm, inspect or stop request profiling.
+
+    POST {"route": "analyze_audio", "requests": 5} profiles the next five audio
+    analyses; {"route": "analyze_text", "seconds": 60} every text analysis in
+    the next minute. Routes are endpoint names, or job_<kind> for background
+    jobs, or '*'. Results are written to PROFILE_DIR.
+    """
+    if request.method == 'GET':
+        return jsonify(request_profiler.get_status() or {'state': 'idle'})
+    if request.method == 'DELETE':
+        stats = request_profiler.stop()
+        if stats is None:
+            return jsonify({'error': 'No profiling session is running'}), 404
+        return jsonify(stats)
+
+    data = request.get_json(silent=True) or {}
+    route = data.get('route')
+    if not route:
+        return jsonify({'error': 'No route given'}), 400
+    try:
+        requests = int(data['requests']) if data.get('requests') else None
+        seconds = float(data['seconds']) if data.get('seconds') else None
+        stats = request_profiler.start(route, requests=requests, seconds=seconds)
+    except (TypeError, ValueError) as e:
+        return jsonify({'error': str(e)}), 400
+    except ProfilerBusyError as e:
+        return jsonify({'error': str(e)}), 409
+    logger.info(f"User {current_user.username} started profiling session {stats['session_id']}")
+    return jsonify(stats), 202
+
+# When set, /metrics requires 'Authorization: Bearer <METRICS_TOKEN>'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Stage latency histograms and request counts, plus the queue gauges, for Prometheus
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    lines = [metrics.render().rstrip('\n')]
+    lines += format_gauges('naan_jobs', job_queue.get_stats())
+    if admission is not None:
+        lines += format_gauges('naan_admission', admission.get_stats())
+    lines += format_gauges('naan_logging', log_pipeline.get_stats())
+    try:
+        lines += format_gauges('naan_inference', get_inference_stats(), label='service')
+        lines += format_gauges('naan_chat', chat_generator.get_stats())
+    except Exception as e:
+        # The model server may be down; the request metrics are still worth scraping
+        logger.warning(f"Could not collect model metrics: {str(e)}")
+    return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
 @app.route('/chatbot')
 @login_required
 def chatbot():
-    return render_template('chat.html')
+    return render_template('chat.html', generative=CHAT_GENERATIVE)
 
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
@@ -0,0 +1,588 @@
+"""ASGI serving mode for the web app.
+
+    uvicorn asgi_app:app --host 127.0.0.1 --port 5000
+    python asgi_app.py
+
+Routes that wait on clients or models (uploads, analyses, background jobs,
+chat, server-sent events and the frame WebSocket) are async here: request
+bodies are read on the event loop, inference is awaited on a thread pool and
+an idle stream only holds a coroutine, so one process can keep thousands of
+slow or idle connections open. Every other route (pages, login, signup,
+stats) is passed to the Flask app in app.py, so both modes share the models,
+templates, JSON responses and the Flask session cookie.
+"""
+import asyncio
+import contextvars
+import functools
+import json
+import logging
+import os
+import random
+import shutil
+import tempfile
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+
+import uvicorn
+from a2wsgi import WSGIMiddleware
+from itsdangerous import BadSignature
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import UploadFile
+from starlette.responses import JSONResponse, RedirectResponse, StreamingResponse
+from starlette.routing import Mount, Route, WebSocketRoute
+
+import app as web
+from admission import AdmissionDenied
+from analysis_jobs import QueueFullError
+from async_waiters import wait_for_change
+from intent_matcher import CRISIS
+from metrics import metrics
+from structured_logging import log_pipeline
+from model_client import InferenceBusyError
+
+logger = logging.getLogger(__name__)
+
+# Model calls run here rather than on the event loop
+inference_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('ASGI_INFERENCE_THREADS', '8')),
+    thread_name_prefix='asgi-inference'
+)
+
+SSE_HEADERS = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+async def run_inference(func, *args):
+    """Await func(*args) on the inference threads, inside the Flask app context"""
+    def call():
+        # The wellbeing updates use the app's database
+        with web.app.app_context(), web.request_profiler.attached():
+            return func(*args)
+    # Carries the request's timing and profile into the worker thread, so its stages reach Server-Timing
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(inference_executor, context.run, call)
+
+_END_OF_STREAM = object()
+
+async def iterate_on_thread(make_iterator):
+    """Yield the items of a blocking iterator, created, stepped and closed on one thread of its own.
+
+    Thread-local state the iterator holds across its yields, such as
+    torch.inference_mode() in DialogueGenerator.stream, stays in effect for
+    every step. Items reach the event loop through an asyncio queue; when the
+    consumer stops early, the iterator is closed after its next item.
+    """
+    loop = asyncio.get_running_loop()
+    items = asyncio.Queue()
+    stop = threading.Event()
+
+    def put(entry):
+        try:
+            loop.call_soon_threadsafe(items.put_nowait, entry)
+        except RuntimeError:
+            # The event loop has closed
+            pass
+
+    def pump():
+        try:
+            iterator = iter(make_iterator())
+            try:
+                for item in iterator:
+                    put((item, None))
+                    if stop.is_set():
+                        break
+            finally:
+                close = getattr(iterator, 'close', None)
+                if close is not None:
+                    close()
+            put((_END_OF_STREAM, None))
+        except Exception as e:
+            put((None, e))
+
+    # Same request context (timing, logging) as the route
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(pump,), name='asgi-stream', daemon=True).start()
+    try:
+        while True:
+            item, error = await items.get()
+            if error is not None:
+                raise error
+            if item is _END_OF_STREAM:
+                return
+            yield item
+    finally:
+        stop.set()
+
+def read_session(connection):
+    """The Flask session of a request or WebSocket, or {} when missing or tampered with"""
+    cookie = connection.cookies.get(web.app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return {}
+    serializer = web.app.session_interface.get_signing_serializer(web.app)
+    try:
+        return serializer.loads(cookie, max_age=int(web.app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return {}
+
+def save_session(response, data):
+    # Same cookie attributes as Flask's own session cookie
+    interface = web.app.session_interface
+    samesite = interface.get_cookie_samesite(web.app)
+    response.set_cookie(
+        web.app.config['SESSION_COOKIE_NAME'],
+        interface.get_signing_serializer(web.app).dumps(dict(data)),
+        path=interface.get_cookie_path(web.app),
+        domain=interface.get_cookie_domain(web.app),
+        secure=interface.get_cookie_secure(web.app),
+        httponly=interface.get_cookie_httponly(web.app),
+        samesite=samesite.lower() if samesite else None
+    )
+
+def load_user_id(user_id):
+    with web.app.app_context():
+        user = web.User.query.get(int(user_id))
+        return user.id if user else None
+
+async def current_user_id(connection):
+    """Id of the user logged in through the Flask app, or None"""
+    user_id = read_session(connection).get('_user_id')
+    if user_id is None:
+        return None
+    return await run_in_threadpool(load_user_id, user_id)
+
+def instrumented(handler):
+    """Time and tag the route like app.py's request hooks: stage histograms, Server-Timing and X-Request-ID headers"""
+    @functools.wraps(handler)
+    async def wrapped(request):
+        log_token = log_pipeline.begin_request(handler.__name__)
+        # The event loop thread serves every request; run_inference attaches the threads doing this one's work
+        profile = web.request_profiler.begin(handler.__name__, track_thread=False)
+        timing, token = metrics.begin_request(handler.__name__)
+        try:
+            response = await handler(request)
+        except Exception:
+            metrics.finish_request(timing, token, 500)
+            log_pipeline.end_request(log_token)
+            raise
+        finally:
+            if profile is not None:
+                web.request_profiler.end(profile)
+        response.headers['Server-Timing'] = metrics.finish_request(timing, token, response.status_code)
+        response.headers['X-Request-ID'] = log_pipeline.current_request_id()
+        log_pipeline.end_request(log_token)
+        return response
+    return wrapped
+
+def login_required(handler):
+    @functools.wraps(handler)
+    async def wrapped(request):
+        user_id = await current_user_id(request)
+        if user_id is None:
+            return RedirectResponse(f"/login?next={quote(request.url.path)}", status_code=302)
+        request.state.user_id = user_id
+        return await handler(request)
+    return wrapped
+
+def busy_response(error):
+    logger.warning(f"Rejected request: {str(error)}")
+    return JSONResponse(error.details, status_code=429, headers={'Retry-After': str(error.retry_after)})
+
+def admission_controlled(endpoint):
+    """Same per-user limits as app.admission_controlled"""
+    def decorator(handler):
+        @functools.wraps(handler)
+        async def wrapped(request):
+            if web.admission is None:
+                return await handler(request)
+            try:
+                lease = await run_in_threadpool(web.admission.acquire, request.state.user_id, endpoint)
+            except AdmissionDenied as e:
+                return busy_response(e)
+            try:
+                return await handler(request)
+            finally:
+                await run_in_threadpool(web.admission.release, lease)
+        return wrapped
+    return decorator
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+async def save_upload(upload, suffix='.webm'):
+    """Copy an uploaded file to a temporary path; the caller removes it"""
+    def copy():
+        with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as temp_file:
+            shutil.copyfileobj(upload.file, temp_file)
+            return temp_file.name
+    path = await run_in_threadpool(copy)
+    logger.debug("Saved upload to temporary file: %s", path)
+    return path
+
+async def form_file(request, name):
+    form = await request.form()
+    upload = form.get(name)
+    return form, upload if isinstance(upload, UploadFile) else None
+
+@instrumented
+@login_required
+@admission_controlled('text')
+async def analyze_text(request):
+    data = await read_json(request)
+    if not data or 'text' not in data:
+        logger.error("No text provided in request")
+        return JSONResponse({'error': 'No text provided'}, status_code=400)
+    text = data['text']
+    if not text.strip():
+        logger.error("Empty text provided")
+        return JSONResponse({'error': 'Empty text provided'}, status_code=400)
+
+    logger.debug("Analyzing text (%d characters)", len(text))
+    try:
+        return JSONResponse(await run_inference(web.run_text_analysis, text, request.state.user_id))
+    except InferenceBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error in text analysis: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JSONResponse({'error': f'Text analysis error: {str(e)}'}, status_code=500)
+
+@instrumented
+@login_required
+@admission_controlled('audio')
+async def analyze_audio(request):
+    _, upload = await form_file(request, 'audio')
+    if upload is None:
+        return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+
+    temp_webm_path = None
+    try:
+        temp_webm_path = await save_upload(upload)
+        return JSONResponse(await run_inference(web.run_audio_analysis, temp_webm_path, request.state.user_id))
+    except InferenceBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error in audio analysis: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JSONResponse({'error': f'Audio analysis error: {str(e)}'}, status_code=500)
+    finally:
+        web.remove_temp_files(temp_webm_path)
+
+@instrumented
+@login_required
+@admission_controlled('visual')
+async def analyze_visual(request):
+    _, upload = await form_file(request, 'image')
+    if upload is None:
+        return JSONResponse({'error': 'No image file provided'}, status_code=400)
+    try:
+        image_data = await upload.read()
+        return JSONResponse(await run_inference(web.run_visual_analysis, image_data, request.state.user_id))
+    except InferenceBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error in visual analysis: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+@instrumented
+@login_required
+@admission_controlled('visual_batch')
+async def analyze_visual_batch(request):
+    form = await request.form()
+    images = [image for image in form.getlist('images') if isinstance(image, UploadFile)]
+    if not images:
+        return JSONResponse({'error': 'No image files provided'}, status_code=400)
+    if len(images) > web.MAX_VISUAL_BATCH:
+        return JSONResponse({'error': f'Too many images, at most {web.MAX_VISUAL_BATCH} per request'}, status_code=400)
+    try:
+        image_data = [await image.read() for image in images]
+        return JSONResponse(await run_inference(web.run_visual_batch_analysis, image_data, request.state.user_id))
+    except InferenceBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error in batch visual analysis: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+@instrumented
+@login_required
+@admission_controlled('transcribe')
+async def transcribe(request):
+    _, upload = await form_file(request, 'audio')
+    if upload is None:
+        logger.error("No audio file in request")
+        return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+    if web.whisper_model is None:
+        logger.error("Whisper model not loaded")
+        return JSONResponse({'error': 'Speech recognition model not loaded'}, status_code=500)
+
+    temp_webm_path = None
+    try:
+        temp_webm_path = await save_upload(upload)
+        if os.path.getsize(temp_webm_path) == 0:
+            logger.error(f"Temporary file is missing or empty: {temp_webm_path}")
+            return JSONResponse({'error': 'Invalid audio file'}, status_code=400)
+        return JSONResponse(await run_inference(web.run_transcription, temp_webm_path))
+    except web.TranscriptionError as e:
+        return JSONResponse(e.details, status_code=500)
+    except InferenceBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error in transcription: {str(e)}")
+        logger.error(traceback.format_exc())
+        return JSONResponse({'error': f'Transcription error: {str(e)}'}, status_code=500)
+    finally:
+        web.remove_temp_files(temp_webm_path)
+
+@instrumented
+@login_required
+@admission_controlled('questionnaire')
+async def analyze_questionnaire(request):
+    responses = await read_json(request)
+    if not responses:
+        return JSONResponse({'error': 'No responses provided'}, status_code=400)
+    try:
+        return JSONResponse(await run_inference(web.run_questionnaire_analysis, responses, request.state.user_id))
+    except InferenceBusyError as e:
+        return busy_response(e)
+    except Exception as e:
+        logger.error(f"Error in questionnaire analysis: {str(e)}")
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+async def submit_job(request, kind, run, cleanup=None):
+    """Queue run(user_id) as a background job and answer 202, as app.submit_job does"""
+    form = await request.form()
+    low_priority = (request.query_params.get('priority') or form.get('priority')) == 'low'
+    try:
+        queued = await run_in_threadpool(web.enqueue_job, kind, request.state.user_id, run, cleanup, low_priority)
+    except AdmissionDenied as e:
+        return busy_response(e)
+    except QueueFullError as e:
+        logger.warning(f"Rejected {kind} job: {str(e)}")
+        return JSONResponse({'error': 'The analysis queue is full, please try again shortly'},
+                            status_code=503, headers={'Retry-After': '5'})
+
+    status_url = request.app.url_path_for('job_status', job_id=queued.job_id)
+    return JSONResponse({
+        'job_id': queued.job_id,
+        'status': queued.status,
+        'status_url': status_url,
+        'events_url': request.app.url_path_for('job_events', job_id=queued.job_id)
+    }, status_code=202, headers={'Location': status_url})
+
+@instrumented
+@login_required
+async def submit_audio_job(request):
+    _, upload = await form_file(request, 'audio')
+    if upload is None:
+        return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+    temp_webm_path = await save_upload(upload)
+    return await submit_job(request, 'audio', lambda user_id: web.run_audio_analysis(temp_webm_path, user_id),
+                            cleanup=lambda: web.remove_temp_files(temp_webm_path))
+
+@instrumented
+@login_required
+async def submit_transcription_job(request):
+    _, upload = await form_file(request, 'audio')
+    if upload is None:
+        return JSONResponse({'error': 'No audio file provided'}, status_code=400)
+    if web.whisper_model is None:
+        return JSONResponse({'error': 'Speech recognition model not loaded'}, status_code=500)
+    temp_webm_path = await save_upload(upload)
+    if os.path.getsize(temp_webm_path) == 0:
+        web.remove_temp_files(temp_webm_path)
+        return JSONResponse({'error': 'Invalid audio file'}, status_code=400)
+    return await submit_job(request, 'transcribe', lambda user_id: web.run_transcription(temp_webm_path),
+                            cleanup=lambda: web.remove_temp_files(temp_webm_path))
+
+@instrumented
+@login_required
+async def submit_visual_job(request):
+    _, upload = await form_file(request, 'image')
+    if upload is None:
+        return JSONResponse({'error': 'No image file provided'}, status_code=400)
+    image_data = await upload.read()
+    return await submit_job(request, 'visual', lambda user_id: web.run_visual_analysis(image_data, user_id))
+
+def find_job(request):
+    # Other users' jobs look the same as unknown ones
+    job = web.job_queue.get(request.path_params['job_id'])
+    return job if job is not None and job.user_id == request.state.user_id else None
+
+@instrumented
+@login_required
+async def job_status(request):
+    job = find_job(request)
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+    return JSONResponse(job.to_dict())
+
+@instrumented
+@login_required
+async def job_events(request):
+    job = find_job(request)
+    if job is None:
+        return JSONResponse({'error': 'Job not found'}, status_code=404)
+
+    async def events():
+        yield f"retry: {web.SSE_RETRY_MS}\n\n"
+        version = 0
+        # Woken by the job queue on every status change; an idle stream only waits
+        with job.waiters.watching() as changed:
+            while True:
+                if job.version > version:
+                    version = job.version
+                    yield f"id: {version}\nevent: status\ndata: {json.dumps(job.to_dict())}\n\n"
+                    if job.finished:
+                        return
+                if not await wait_for_change(changed, web.SSE_HEARTBEAT_SECONDS):
+                    yield ": heartbeat\n\n"
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers=SSE_HEADERS)
+
+@instrumented
+@login_required
+async def chat(request):
+    data = await read_json(request)
+    user_message = data.get('message', '') if isinstance(data, dict) else ''
+    if not user_message:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+    try:
+        # Retrieval may call the sentence encoder
+        return JSONResponse({'response': await run_inference(web.generate_mental_health_response, user_message)})
+    except Exception as e:
+        logger.error(f"Error in chat endpoint: {str(e)}")
+        return JSONResponse({'error': 'An error occurred while processing your message'}, status_code=500)
+
+@instrumented
+@login_required
+async def chat_stream(request):
+    data = await read_json(request) or {}
+    user_message = data.get('message', '').strip()
+    if not user_message:
+        return JSONResponse({'error': 'No message provided'}, status_code=400)
+
+    session = read_session(request)
+    new_chat_session = 'chat_session_id' not in session
+    if new_chat_session:
+        session['chat_session_id'] = uuid.uuid4().hex
+    session_id = f"{request.state.user_id}:{session['chat_session_id']}"
+
+    # Crisis messages always get the vetted crisis answer, never generated text
+    priority, responses = web.CHAT_INTENTS.match_with_priority(user_message)
+
+    async def events():
+        try:
+            if priority == CRISIS:
+                yield f"event: token\ndata: {json.dumps(random.choice(responses))}\n\n"
+            else:
+                # The whole reply is generated on one thread, which closes the generator if the client leaves
+                pieces = iterate_on_thread(lambda: web.chat_generator.stream(session_id, user_message))
+                try:
+                    async for piece in pieces:
+                        yield f"event: token\ndata: {json.dumps(piece)}\n\n"
+                finally:
+                    await pieces.aclose()
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"Error in chat generation: {str(e)}")
+            logger.error(traceback.format_exc())
+            yield f"event: error\ndata: {json.dumps('An error occurred while generating a response')}\n\n"
+
+    response = StreamingResponse(events(), media_type='text/event-stream', headers=SSE_HEADERS)
+    if new_chat_session:
+        save_session(response, session)
+    return response
+
+@instrumented
+@login_required
+async def face_emotion_stream(request):
+    # Same events as app.face_emotion_stream
+    try:
+        last_version = int(request.headers.get('Last-Event-ID', 0))
+    except ValueError:
+        last_version = 0
+    face_recognizer = web.face_recognizer
+    if last_version > face_recognizer.emotion_version:
+        # Counter restarted with the server
+        last_version = 0
+
+    async def events(version):
+        yield f"retry: {web.SSE_RETRY_MS}\n\n"
+        with face_recognizer.emotion_waiters.watching() as changed:
+            while True:
+                if face_recognizer.emotion_version > version:
+                    version, emotion = face_recognizer.wait_for_emotion(version, timeout=0)
+                    yield f"id: {version}\nevent: emotion\ndata: {json.dumps(web.face_emotion_payload(emotion))}\n\n"
+                if not await wait_for_change(changed, web.SSE_HEARTBEAT_SECONDS):
+                    yield ": heartbeat\n\n"
+
+    return StreamingResponse(events(last_version), media_type='text/event-stream', headers=SSE_HEADERS)
+
+async def stream_frames(websocket):
+    # Same protocol as app.stream_frames: binary JPEG frames in, JSON results out
+    await websocket.accept()
+    user_id = await current_user_id(websocket)
+    if user_id is None:
+        await websocket.close(code=1008, reason='Login required')
+        return
+
+    session = web.stream_manager.open(user_id)
+
+    async def send_results():
+        sent_version = 0
+        # Woken by the stream's analysis workers on a new result or on close
+        with session.result_waiters.watching() as changed:
+            while not session.closed:
+                if session.result_version > sent_version:
+                    sent_version, result = session.result_version, session.result
+                    await websocket.send_text(json.dumps({
+                        'status': 'success',
+                        'analysis': result,
+                        'stats': session.get_stats()
+                    }))
+                await wait_for_change(changed)
+
+    sender = asyncio.create_task(send_results())
+    try:
+        while True:
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            data = message.get('bytes')
+            if data is None:
+                continue
+            if len(data) > web.MAX_STREAM_FRAME_BYTES:
+                await websocket.send_text(json.dumps({'status': 'error', 'message': 'Frame too large'}))
+            else:
+                web.stream_manager.submit(session, data)
+    finally:
+        sender.cancel()
+        web.stream_manager.close(session)
+
+app = Starlette(routes=[
+    Route('/analyze/text', analyze_text, methods=['POST']),
+    Route('/analyze/audio', analyze_audio, methods=['POST']),
+    Route('/analyze/visual', analyze_visual, methods=['POST']),
+    Route('/analyze/visual/batch', analyze_visual_batch, methods=['POST']),
+    Route('/transcribe', transcribe, methods=['POST']),
+    Route('/analyze/questionnaire', analyze_questionnaire, methods=['POST']),
+    Route('/jobs/analyze/audio', submit_audio_job, methods=['POST']),
+    Route('/jobs/transcribe', submit_transcription_job, methods=['POST']),
+    Route('/jobs/analyze/visual', submit_visual_job, methods=['POST']),
+    Route('/jobs/{job_id}', job_status, name='job_status'),
+    Route('/jobs/{job_id}/events', job_events, name='job_events'),
+    Route('/chat', chat, methods=['POST']),
+    Route('/chat/stream', chat_stream, methods=['POST']),
+    Route('/face/emotion/stream', face_emotion_stream),
+    WebSocketRoute('/ws/frames', stream_frames),
+    # Pages, login, signup, stats and the camera controls stay with Flask
+    Mount('/', app=WSGIMiddleware(web.app, workers=int(os.getenv('ASGI_WSGI_THREADS', '10'))))
+])
+
+if __name__ == '__main__':
+    # log_config=None keeps uvicorn's own loggers on the queue set up by app.py
+    uvicorn.run(app, host=os.getenv('HOST', '127.0.0.1'), port=int(os.getenv('PORT', '5000')), log_config=None)
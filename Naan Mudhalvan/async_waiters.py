@@ -0,0 +1,50 @@
+"""Wake coroutines on an event loop when a thread changes something they watch.
+
+The job queue, the face recognizer and the camera stream sessions change their
+state on worker threads. The async routes of asgi_app.py wait for those changes
+on an asyncio.Event each: notify() sets the Event of every waiter through its
+loop's call_soon_threadsafe, so an idle stream costs nothing until there is
+something to send.
+"""
+import asyncio
+import contextlib
+import threading
+
+class AsyncWaiters:
+    def __init__(self):
+        self._waiters = set()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def watching(self):
+        """An asyncio.Event set on every notify() while the block runs; call from the event loop"""
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+    def notify(self):
+        """Wake every waiter; safe to call from any thread"""
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, event in waiters:
+            try:
+                loop.call_soon_threadsafe(event.set)
+            except RuntimeError:
+                # The waiter's loop has closed
+                pass
+
+async def wait_for_change(event, timeout=None):
+    """Wait until the event is set, then clear it; returns False if the timeout passed first"""
+    try:
+        await asyncio.wait_for(event.wait(), timeout)
+        return True
+    except asyncio.TimeoutError:
+        return False
+    finally:
+        # Cleared before the caller looks at the new state, so a later change sets it again
+        event.clear()
@@ -0,0 +1,275 @@
+"""Latency, throughput and memory of every analyzer hot path, on synthetic fixtures.
+
+    python bench_analyzers.py [--cases text,audio_features] [--iterations 30] [--output report.json]
+
+Fixtures are generated on the fly, so the suite runs offline once the models
+are cached: text of a few sizes, questionnaire answers, tones and speech-like
+audio (harmonics under a syllable-rate envelope), drawn faces encoded as JPEG
+at several resolutions, and analysis dicts for the recommendation engine. The
+chat case imports app.py, so it loads the whole app first.
+
+Each case is timed on its own, then run a few more times under tracemalloc for
+the peak Python heap it allocates (native buffers of torch or ONNX Runtime are
+not counted). Prints a JSON report with p50/p90/p99 latency, throughput and
+peak memory per case.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import shutil
+import tempfile
+import time
+import tracemalloc
+import wave
+
+import cv2
+import numpy as np
+
+WORDS = {
+    'sad': ['sad', 'lonely', 'tired', 'empty', 'crying', 'hopeless', 'lost'],
+    'anxious': ['anxious', 'worried', 'panic', 'nervous', 'overwhelmed', 'stressed', 'restless'],
+    'happy': ['happy', 'grateful', 'calm', 'excited', 'proud', 'relaxed', 'hopeful'],
+    'filler': ['i', 'feel', 'today', 'work', 'sleep', 'friends', 'family', 'because', 'and', 'the', 'really', 'again']
+}
+
+QUESTIONNAIRE_ANSWERS = [
+    'I have been sleeping badly and feel tired most days',
+    'My thoughts keep racing and I worry about everything',
+    'I see friends every week and we talk a lot',
+    'I am proud of myself and take time for self care',
+    'No motivation to do anything, nothing feels meaningful'
+]
+
+def make_texts(rng, words):
+    mood = rng.choice(['sad', 'anxious', 'happy'])
+    return [
+        ' '.join(rng.choice(WORDS[mood] if rng.random() < 0.3 else WORDS['filler']) for _ in range(words))
+        for _ in range(8)
+    ]
+
+def make_questionnaires(rng):
+    return [
+        {f'question_{i}': rng.choice(QUESTIONNAIRE_ANSWERS) for i in range(1, 11)}
+        for _ in range(8)
+    ]
+
+def make_tone(seconds, sr=22050, frequency=440.0):
+    t = np.arange(int(seconds * sr)) / sr
+    return (0.3 * np.sin(2 * np.pi * frequency * t)).astype(np.float32), sr
+
+def make_speech_like(seconds, rng, sr=22050):
+    # A gliding pitch with harmonics, switched on and off at a syllable rate, plus breath noise
+    t = np.arange(int(seconds * sr)) / sr
+    pitch = rng.uniform(110, 220) * (1 + 0.1 * np.sin(2 * np.pi * 0.5 * t))
+    phase = 2 * np.pi * np.cumsum(pitch) / sr
+    voice = sum(np.sin(k * phase) / k for k in range(1, 12))
+    envelope = np.clip(np.sin(2 * np.pi * rng.uniform(3, 5) * t), 0, None) ** 2
+    signal = voice * envelope + 0.02 * rng.standard_normal(len(t))
+    return (0.3 * signal / np.abs(signal).max()).astype(np.float32), sr
+
+def encode_wav(samples, sr):
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes((samples * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+def write_audio(directory, name, samples, sr):
+    path = os.path.join(directory, f'{name}.wav')
+    with open(path, 'wb') as f:
+        f.write(encode_wav(samples, sr))
+    return path
+
+def make_face_jpeg(width, height, rng):
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    img[:] = (rng.integers(60, 200), rng.integers(60, 200), rng.integers(60, 200))
+    cx, cy, size = width // 2, height // 2, min(width, height) // 3
+    cv2.ellipse(img, (cx, cy), (int(size * 0.8), size), 0, 0, 360, (150, 180, 220), -1)
+    for dx in (-size // 3, size // 3):
+        cv2.ellipse(img, (cx + dx, cy - size // 4), (size // 8, size // 14), 0, 0, 360, (40, 40, 40), -1)
+    cv2.line(img, (cx, cy - size // 10), (cx, cy + size // 6), (120, 140, 180), 2)
+    cv2.ellipse(img, (cx, cy + size // 2), (size // 3, size // 8), 0, 0, 180, (60, 60, 150), 3)
+    ok, encoded = cv2.imencode('.jpg', img, [cv2.IMWRITE_JPEG_QUALITY, 90])
+    return encoded.tobytes()
+
+def make_analyses(rng):
+    analyses = []
+    for _ in range(8):
+        emotions = {name: float(rng.random()) for name in ('happiness', 'sadness', 'anxiety', 'anger', 'calm')}
+        analyses.append({'emotions': emotions, 'mental_health_score': int(rng.integers(5, 26))})
+    return analyses
+
+HISTORY = {'wellbeing': 0.42, 'trend': -0.05, 'emotions': {'anxiety': 0.6, 'sadness': 0.5}, 'sessions': 12}
+
+CHAT_MESSAGES = [
+    'hi there',
+    'I have been feeling really anxious about work lately',
+    'how can I sleep better when my mind keeps racing at night',
+    'what is the weather like on mars',
+    'thank you'
+]
+
+def text_cases(rng, fixtures):
+    from text_analyzer import TextAnalyzer
+    analyzer = TextAnalyzer()
+    cases = [(f'text_analyze_{words}_words', analyzer.analyze, make_texts(rng, words)) for words in (10, 40, 100)]
+    cases.append(('text_analyze_questionnaire', analyzer.analyze_questionnaire, make_questionnaires(rng)))
+    return cases
+
+def audio_cases(rng, fixtures):
+    from emotion_detector import EmotionDetector
+    detector = EmotionDetector()
+    clips = {
+        'tone_3s': make_tone(3),
+        'speech_3s': make_speech_like(3, rng),
+        # extract_features only reads the first 3 s; longer clips show the cost of opening them
+        'speech_10s': make_speech_like(10, rng)
+    }
+    cases = []
+    for name, (samples, sr) in clips.items():
+        path = write_audio(fixtures, name, samples, sr)
+        cases.append((f'audio_extract_features_{name}', detector.extract_features, [path]))
+        cases.append((f'audio_detect_emotion_{name}', detector.detect_emotion, [path]))
+    return cases
+
+def visual_cases(rng, fixtures):
+    from visual_analyzer import VisualAnalyzer
+    analyzer = VisualAnalyzer()
+    return [
+        (f'visual_analyze_{width}x{height}', analyzer.analyze, [make_face_jpeg(width, height, rng) for _ in range(4)])
+        for width, height in ((320, 240), (640, 480), (1280, 720))
+    ]
+
+def recommendation_cases(rng, fixtures):
+    from recommendation_engine import RecommendationEngine
+    engine = RecommendationEngine()
+    analyses = make_analyses(rng)
+
+    def uncached(analysis):
+        # The fixed analyses only hit the output cache after warmup; this times formatting them too
+        engine.clear_cache()
+        return engine.get_recommendations(analysis)
+
+    return [
+        ('recommendations', engine.get_recommendations, analyses),
+        ('recommendations_uncached', uncached, analyses),
+        ('recommendations_with_history', lambda analysis: engine.get_recommendations(analysis, HISTORY), analyses)
+    ]
+
+def chat_cases(rng, fixtures):
+    import app
+    return [('chat_response', app.generate_mental_health_response, CHAT_MESSAGES)]
+
+CASE_GROUPS = {
+    'text': text_cases,
+    'audio': audio_cases,
+    'visual': visual_cases,
+    'recommendations': recommendation_cases,
+    'chat': chat_cases
+}
+
+def summarize(latencies, elapsed, errors, peak_bytes):
+    values = np.array(latencies) * 1000
+    result = {
+        'iterations': len(latencies),
+        'errors': errors,
+        'throughput_per_s': round(len(latencies) / elapsed, 2) if elapsed else None,
+        'peak_alloc_kb': round(peak_bytes / 1024, 1)
+    }
+    if len(values):
+        result.update({
+            'p50_ms': round(float(np.percentile(values, 50)), 3),
+            'p90_ms': round(float(np.percentile(values, 90)), 3),
+            'p99_ms': round(float(np.percentile(values, 99)), 3),
+            'mean_ms': round(float(values.mean()), 3),
+            'max_ms': round(float(values.max()), 3)
+        })
+    return result
+
+def run_case(func, inputs, iterations, warmup, memory_runs):
+    def call(i):
+        func(inputs[i % len(inputs)])
+
+    errors = []
+    for i in range(warmup):
+        try:
+            call(i)
+        except Exception as e:
+            errors.append(str(e))
+
+    latencies = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        start = time.perf_counter()
+        try:
+            call(i)
+        except Exception as e:
+            errors.append(str(e))
+            continue
+        latencies.append(time.perf_counter() - start)
+    elapsed = time.perf_counter() - started
+
+    # A separate pass: tracemalloc slows allocation-heavy code down too much to time it
+    tracemalloc.start()
+    try:
+        for i in range(memory_runs):
+            try:
+                call(i)
+            except Exception:
+                pass
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    result = summarize(latencies, elapsed, len(errors), peak)
+    if errors:
+        result['first_error'] = errors[0]
+    return result
+
+def run(groups, iterations, warmup, memory_runs, seed=0):
+    rng = np.random.default_rng(seed)
+    random.seed(seed)
+    fixtures = tempfile.mkdtemp(prefix='bench-analyzers-')
+    report = {'iterations': iterations, 'warmup': warmup, 'cases': {}}
+    try:
+        for group in groups:
+            start = time.perf_counter()
+            try:
+                cases = CASE_GROUPS[group](rng, fixtures)
+            except Exception as e:
+                # A missing model or library skips its group, not the whole suite
+                report['cases'][group] = {'error': f"Setup failed: {str(e)}"}
+                continue
+            setup_ms = round((time.perf_counter() - start) * 1000, 1)
+            for name, func, inputs in cases:
+                result = run_case(func, inputs, iterations, warmup, memory_runs)
+                result['setup_ms'] = setup_ms
+                report['cases'][name] = result
+    finally:
+        shutil.rmtree(fixtures, ignore_errors=True)
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the analyzer hot paths on synthetic fixtures')
+    parser.add_argument('--cases', default=','.join(CASE_GROUPS),
+                        help=f"Comma-separated case groups: {', '.join(CASE_GROUPS)}")
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--warmup', type=int, default=3)
+    parser.add_argument('--memory-runs', type=int, default=3)
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    groups = [group.strip() for group in args.cases.split(',') if group.strip()]
+    unknown = [group for group in groups if group not in CASE_GROUPS]
+    if unknown:
+        parser.error(f"Unknown case groups: {', '.join(unknown)}")
+
+    report = json.dumps(run(groups, args.iterations, args.warmup, args.memory_runs), indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
@@ -0,0 +1,71 @@
+"""Matching cost of the compiled intent matcher versus the old per-phrase substring loop.
+
+    python bench_intent_matcher.py [--sizes 100,1000,10000] [--messages 2000]
+
+Synthetic phrase tables of increasing size are matched against the same set of
+chat-like messages. The compiled matcher's time per message should stay roughly
+flat as the table grows, while the substring loop grows linearly with it.
+Prints a JSON report with per-message latency for both approaches.
+"""
+import argparse
+import json
+import random
+import time
+
+from intent_matcher import IntentMatcher, normalize
+
+WORDS = [
+    'anxiety', 'sleep', 'stress', 'work', 'feel', 'tired', 'help', 'panic', 'sad', 'alone',
+    'friends', 'family', 'therapy', 'manage', 'better', 'night', 'worry', 'focus', 'day', 'calm'
+]
+
+def make_phrases(size, rng):
+    # Made-up tokens keep phrases unique and rarely matching, like most of a real table
+    return [f"{rng.choice(WORDS)} x{i} {rng.choice(WORDS)}" for i in range(size)]
+
+def make_messages(count, rng):
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 25))) for _ in range(count)]
+
+def substring_match(phrases, text):
+    text = normalize(text)
+    for phrase in phrases:
+        if phrase in text:
+            return phrase
+    return None
+
+def time_per_message(match, messages):
+    start = time.perf_counter()
+    for message in messages:
+        match(message)
+    return (time.perf_counter() - start) / len(messages) * 1e6
+
+def run(sizes, message_count, seed=0):
+    rng = random.Random(seed)
+    messages = make_messages(message_count, rng)
+    report = []
+    for size in sizes:
+        phrases = make_phrases(size, rng)
+        matcher = IntentMatcher()
+        for phrase in phrases:
+            matcher.add(phrase, phrase)
+
+        start = time.perf_counter()
+        matcher.compile()
+        compile_ms = (time.perf_counter() - start) * 1000
+
+        report.append({
+            'phrases': size,
+            'compile_ms': round(compile_ms, 2),
+            'compiled_us_per_message': round(time_per_message(matcher.match, messages), 2),
+            'substring_us_per_message': round(time_per_message(lambda m: substring_match(phrases, m), messages), 2)
+        })
+    return {'messages': message_count, 'results': report}
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the compiled intent matcher')
+    parser.add_argument('--sizes', default='100,1000,10000')
+    parser.add_argument('--messages', type=int, default=2000)
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    print(json.dumps(run(sizes, args.messages), indent=2))
@@ -0,0 +1,176 @@
+"""Streaming DialoGPT replies that reuse each conversation's attention cache.
+
+DialoGPT sees a conversation as its turns joined by EOS tokens. Instead of
+re-encoding that whole history every turn, each chat session keeps the model's
+past_key_values, so a new turn only runs the model over the new message and
+then one token at a time while generating.
+
+History is capped with a sliding window of whole turns. GPT-2 uses absolute
+position embeddings, so the cache can't simply be cut at the front; when the
+history outgrows max_history_tokens, the oldest turns are dropped until it fits
+in half the window and that remainder is re-encoded once. Time to first token
+is therefore bounded by the window size, not by the length of the conversation.
+"""
+import collections
+import logging
+import threading
+import time
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+class ChatSession:
+    def __init__(self, session_id):
+        self.session_id = session_id
+        self.lock = threading.Lock()
+        # Token ids of each finished turn (user or bot), EOS included
+        self.turns = collections.deque()
+        self.past_key_values = None
+        # Tokens that belong to the history but haven't been through the model yet
+        self.pending = []
+        self.last_used = time.time()
+
+    @property
+    def history_tokens(self):
+        return sum(len(turn) for turn in self.turns)
+
+    def reset_cache(self):
+        self.past_key_values = None
+        self.pending = [token for turn in self.turns for token in turn]
+
+class ChatSessionStore:
+    """Bounded LRU of chat sessions; the least recently used one is evicted with its cache"""
+
+    def __init__(self, max_sessions=256):
+        self.max_sessions = max_sessions
+        self._sessions = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = ChatSession(session_id)
+                self._sessions[session_id] = session
+                while len(self._sessions) > self.max_sessions:
+                    self._sessions.popitem(last=False)
+                    self.evictions += 1
+            else:
+                self._sessions.move_to_end(session_id)
+            session.last_used = time.time()
+            return session
+
+    def discard(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def __len__(self):
+        return len(self._sessions)
+
+class DialogueGenerator:
+    def __init__(self, tokenizer, model, session_store=None, max_history_tokens=256,
+                 max_new_tokens=80, temperature=0.7, top_k=50):
+        self.tokenizer = tokenizer
+        self.model = model
+        self.model.eval()
+        self.sessions = session_store or ChatSessionStore()
+        self.max_history_tokens = max_history_tokens
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_k = top_k
+        self.eos_token_id = tokenizer.eos_token_id
+
+    def stream(self, session_id, message):
+        """Yield the reply to message piece by piece as it is generated"""
+        session = self.sessions.get(session_id)
+        with session.lock:
+            self.begin_turn(session, message)
+
+            started = time.perf_counter()
+            reply = []
+            sent = 0
+            finished = False
+            try:
+                with torch.inference_mode():
+                    logits = self._forward(session, session.pending)
+                    session.pending = []
+                    for _ in range(self.max_new_tokens):
+                        token = self.sample(logits)[0]
+                        if token == self.eos_token_id:
+                            break
+                        reply.append(token)
+                        if len(reply) == 1:
+                            logger.info(f"Chat session {session_id}: first token after "
+                                        f"{(time.perf_counter() - started) * 1000:.0f} ms")
+                        piece = self.text_delta(reply, sent)
+                        if piece:
+                            yield piece
+                            sent += len(piece)
+                        logits = self._forward(session, [token])
+                finished = True
+            finally:
+                self.finish_turn(session, reply, complete=finished)
+
+            piece = self.text_delta(reply, sent, final=True)
+            if piece:
+                yield piece
+
+    def generate(self, session_id, message):
+        """Whole reply at once"""
+        return ''.join(self.stream(session_id, message)).strip()
+
+    def get_stats(self):
+        return {'batching': False, 'sessions': len(self.sessions)}
+
+    def begin_turn(self, session, message):
+        """Add the user's message to the history; session.pending is then what the model must read"""
+        user_turn = self.tokenizer.encode(message + self.tokenizer.eos_token)
+        # Keep the newest part of very long messages
+        user_turn = user_turn[-(self.max_history_tokens // 2):]
+        session.turns.append(user_turn)
+        session.pending.extend(user_turn)
+        self._trim(session)
+
+    def finish_turn(self, session, reply, unfed=(), complete=True):
+        """Record the bot's reply; unfed are reply tokens sampled but not yet run through the model"""
+        session.turns.append(reply + [self.eos_token_id])
+        if complete:
+            # The closing EOS is part of the history but only goes through the model next turn
+            session.pending = list(unfed) + [self.eos_token_id]
+        else:
+            # Client went away or the model failed mid-reply: rebuild the cache next turn
+            session.reset_cache()
+
+    def text_delta(self, reply, sent, final=False):
+        """Text of a partial reply beyond the first `sent` characters already sent"""
+        decoded = self.tokenizer.decode(reply, skip_special_tokens=True)
+        # Hold back partial multi-byte characters until the next token completes them
+        if not final and decoded.endswith('\ufffd'):
+            return ''
+        return decoded[sent:]
+
+    def sample(self, logits):
+        """Next token for each row of logits (or for a single 1-D row)"""
+        logits = logits.reshape(-1, logits.shape[-1])
+        if self.temperature <= 0:
+            return torch.argmax(logits, dim=-1).tolist()
+        values, indices = torch.topk(logits / self.temperature, min(self.top_k, logits.shape[-1]))
+        choices = torch.multinomial(torch.softmax(values, dim=-1), 1)
+        return torch.gather(indices, 1, choices).squeeze(1).tolist()
+
+    def _forward(self, session, tokens):
+        input_ids = torch.tensor([tokens], dtype=torch.long)
+        outputs = self.model(input_ids=input_ids, past_key_values=session.past_key_values, use_cache=True)
+        session.past_key_values = outputs.past_key_values
+        return outputs.logits[0, -1, :]
+
+    def _trim(self, session):
+        # Room is left for the reply so the positions stay within the model's context
+        if session.history_tokens + self.max_new_tokens <= self.max_history_tokens:
+            return
+        target = self.max_history_tokens // 2
+        while len(session.turns) > 1 and session.history_tokens > target:
+            session.turns.popleft()
+        session.reset_cache()
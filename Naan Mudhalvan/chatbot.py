@@ -2,8 +2,10 @@ from flask import Flask, render_template, request, jsonify
 from transformers import AutoModelForCausalLM, AutoTokenizer
 import torch
 import logging
+import os
 import re
 import random
+from intent_matcher import build_chat_intents
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -11,12 +13,17 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 
-# Initialize model and tokenizer
+# Initialize model and tokenizer; with MODEL_SERVER_SOCKET set, DialoGPT is loaded once
+# by model_server.py (see model_client.py) and this process keeps no copy of the weights
+MODEL_SERVER_SOCKET = os.getenv('MODEL_SERVER_SOCKET')
 try:
-    logger.info("Loading DialoGPT model and tokenizer...")
-    tokenizer = AutoTokenizer.from_pretrained("microsoft/DialoGPT-medium")
-    model = AutoModelForCausalLM.from_pretrained("microsoft/DialoGPT-medium")
-    logger.info("Model and tokenizer loaded successfully")
+    if MODEL_SERVER_SOCKET:
+        logger.info(f"Using the model server at {MODEL_SERVER_SOCKET}")
+    else:
+        logger.info("Loading DialoGPT model and tokenizer...")
+        tokenizer = AutoTokenizer.from_pretrained("microsoft/DialoGPT-medium")
+        model = AutoModelForCausalLM.from_pretrained("microsoft/DialoGPT-medium")
+        logger.info("Model and tokenizer loaded successfully")
 except Exception as e:
     logger.error(f"Failed to load model: {str(e)}")
     raise
@@ -240,33 +247,23 @@ CONVERSATIONAL_PROMPTS = {
     }
 }
 
+CRISIS_KEYWORDS = ['suicide', 'kill myself', 'end it all', 'want to die']
+
+# Crisis keywords, conversational prompts, specific questions and categories (in that
+# order of priority), compiled once into a single matcher
+CHAT_INTENTS = build_chat_intents(
+    MENTAL_HEALTH_QA,
+    CONVERSATIONAL_PROMPTS,
+    CRISIS_KEYWORDS,
+    MENTAL_HEALTH_QA['crisis']['suicide prevention']
+)
+
 def generate_mental_health_response(user_input):
-    # Convert input to lowercase for case-insensitive matching
-    input_lower = user_input.lower()
-    
-    # Check for crisis keywords first
-    if any(keyword in input_lower for keyword in ['suicide', 'kill myself', 'end it all', 'want to die']):
-        return random.choice(MENTAL_HEALTH_QA['crisis']['suicide prevention'])
-    
-    # Check for conversational prompts
-    for category, prompts in CONVERSATIONAL_PROMPTS.items():
-        for key, responses in prompts.items():
-            if key in input_lower:
-                return random.choice(responses)
-    
-    # Check for specific questions in the Q&A database
-    for category, questions in MENTAL_HEALTH_QA.items():
-        for question, answer in questions.items():
-            if question in input_lower:
-                return answer
-    
-    # Check for category keywords
-    for category, questions in MENTAL_HEALTH_QA.items():
-        if category in input_lower:
-            return random.choice(list(questions.values()))
+    # One pass over the message finds the highest-priority intent
+    responses = CHAT_INTENTS.match(user_input)
     
     # If no specific match, return a general supportive response
-    return random.choice(GENERAL_SUPPORT)
+    return random.choice(responses or GENERAL_SUPPORT)
 
 @app.route('/')
 def home():
@@ -0,0 +1,103 @@
+"""Parity and latency comparison of the ONNX emotion backend against DeepFace.analyze.
+
+    python compare_emotion_backends.py --onnx models/emotion.onnx [--images path/to/faces] [--samples 50]
+
+Face crops are read from --images (any image files) or generated synthetically.
+Prints a JSON report with per-backend latency percentiles and score differences.
+"""
+import argparse
+import json
+import os
+import time
+
+import cv2
+import numpy as np
+
+from facial_emotion import DeepFaceEmotionClassifier, OnnxEmotionClassifier
+
+def load_faces(images_dir, samples):
+    faces = []
+    if images_dir:
+        for name in sorted(os.listdir(images_dir)):
+            img = cv2.imread(os.path.join(images_dir, name))
+            if img is not None:
+                faces.append(cv2.resize(img, (48, 48), interpolation=cv2.INTER_AREA))
+            if len(faces) >= samples:
+                break
+    rng = np.random.default_rng(0)
+    while len(faces) < samples:
+        # Smooth random blobs give the CNN non-trivial activations without needing real faces
+        noise = rng.integers(0, 256, (12, 12, 3), dtype=np.uint8)
+        faces.append(cv2.resize(noise, (48, 48), interpolation=cv2.INTER_CUBIC))
+    return faces
+
+def percentiles(latencies):
+    values = np.array(latencies) * 1000
+    return {
+        'p50_ms': round(float(np.percentile(values, 50)), 3),
+        'p95_ms': round(float(np.percentile(values, 95)), 3),
+        'mean_ms': round(float(values.mean()), 3)
+    }
+
+def timed(fn, faces):
+    results, latencies = [], []
+    for face in faces:
+        start = time.perf_counter()
+        results.append(fn(face))
+        latencies.append(time.perf_counter() - start)
+    return results, latencies
+
+def compare(onnx_path, faces):
+    from deepface import DeepFace
+
+    labels = DeepFaceEmotionClassifier.labels
+    keras_classifier = DeepFaceEmotionClassifier()
+    onnx_classifier = OnnxEmotionClassifier(onnx_path)
+
+    # Warm every path up so graph building doesn't skew the first sample
+    DeepFace.analyze(faces[0], actions=['emotion'], enforce_detection=False, detector_backend='skip')
+    keras_classifier.predict(faces[:1])
+    onnx_classifier.predict(faces[:1])
+
+    reference, analyze_latency = timed(
+        lambda face: DeepFace.analyze(face, actions=['emotion'], enforce_detection=False, detector_backend='skip')[0]['emotion'],
+        faces
+    )
+    keras_scores, keras_latency = timed(lambda face: keras_classifier.predict([face])[0], faces)
+    onnx_scores, onnx_latency = timed(lambda face: onnx_classifier.predict([face])[0], faces)
+
+    start = time.perf_counter()
+    onnx_classifier.predict(faces)
+    onnx_batch_ms = (time.perf_counter() - start) * 1000
+
+    def diff(a, b):
+        a = np.array([[row[label] for label in labels] for row in a])
+        b = np.array([[row[label] for label in labels] for row in b])
+        return {
+            'max_abs_diff_pct': round(float(np.abs(a - b).max()), 4),
+            'mean_abs_diff_pct': round(float(np.abs(a - b).mean()), 4),
+            'top1_agreement': round(float((a.argmax(axis=1) == b.argmax(axis=1)).mean()), 4)
+        }
+
+    return {
+        'samples': len(faces),
+        'latency': {
+            'deepface_analyze': percentiles(analyze_latency),
+            'keras_direct': percentiles(keras_latency),
+            'onnx': percentiles(onnx_latency),
+            'onnx_batch_per_face_ms': round(onnx_batch_ms / len(faces), 3)
+        },
+        'parity': {
+            'onnx_vs_deepface_analyze': diff(onnx_scores, reference),
+            'onnx_vs_keras_direct': diff(onnx_scores, keras_scores)
+        }
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare ONNX and DeepFace emotion backends')
+    parser.add_argument('--onnx', default=os.path.join('models', 'emotion.onnx'))
+    parser.add_argument('--images', default=None, help='Directory of face images (optional)')
+    parser.add_argument('--samples', type=int, default=50)
+    args = parser.parse_args()
+
+    print(json.dumps(compare(args.onnx, load_faces(args.images, args.samples)), indent=2))
@@ -5,6 +5,7 @@ from sklearn.ensemble import RandomForestClassifier
 import joblib
 import os
 import logging
+from metrics import stage
 
 class EmotionDetector:
     def __init__(self):
@@ -161,20 +162,22 @@ class EmotionDetector:
         """Detect emotion from audio file."""
         try:
             # Extract features and modulation score
-            features, modulation_score = self.extract_features(audio_path)
+            with stage('librosa_features'):
+                features, modulation_score = self.extract_features(audio_path)
             
             # Reshape features for prediction
             features = features.reshape(1, -1)
             
-            # Scale features
-            features_scaled = self.scaler.transform(features)
-            
-            # Predict emotion
-            emotion_idx = self.classifier.predict(features_scaled)[0]
+            with stage('voice_classifier'):
+                # Scale features
+                features_scaled = self.scaler.transform(features)
+                
+                # Predict emotion
+                emotion_idx = self.classifier.predict(features_scaled)[0]
+                
+                # Get prediction probabilities
+                probabilities = self.classifier.predict_proba(features_scaled)[0]
             emotion = self.emotions[emotion_idx]
-            
-            # Get prediction probabilities
-            probabilities = self.classifier.predict_proba(features_scaled)[0]
             confidence = probabilities[emotion_idx]
             
             return {
@@ -0,0 +1,144 @@
+"""Facial emotion analysis in a dedicated worker process.
+
+The web process keeps capturing frames into a shared-memory FrameRingBuffer;
+the worker maps the same block, runs face detection/tracking and the emotion
+model on the newest frame, and writes one compact JSON line to stdout
+whenever the result changes significantly. The worker exits when its stdin is closed, so it never outlives the
+web process that started it.
+
+The worker is started as a plain subprocess rather than through
+multiprocessing's spawn/fork so it neither re-imports app.py (which loads
+every model at import time) nor inherits a forked copy of TensorFlow.
+"""
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import threading
+
+import numpy as np
+
+from frame_buffer import FrameRingBuffer
+
+logger = logging.getLogger(__name__)
+
+class EmotionWorkerProcess:
+    """Web-process handle for an analysis worker attached to a shared frame buffer"""
+
+    def __init__(self, frame_buffer, on_result, analysis_interval=1.0, emotion_backend=None):
+        self.frame_buffer = frame_buffer
+        self.on_result = on_result
+        self.analysis_interval = analysis_interval
+        self.emotion_backend = emotion_backend
+        self.process = None
+        self._reader = None
+
+    def start(self):
+        command = [
+            sys.executable, os.path.abspath(__file__),
+            '--shm', self.frame_buffer.name,
+            '--shape', ','.join(str(n) for n in self.frame_buffer.frame_shape),
+            '--slots', str(self.frame_buffer.slots),
+            '--dtype', self.frame_buffer.dtype.str,
+            '--interval', str(self.analysis_interval)
+        ]
+        if self.emotion_backend:
+            command += ['--backend', self.emotion_backend]
+
+        self.process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            text=True,
+            bufsize=1
+        )
+        self._reader = threading.Thread(target=self._read_results, name='emotion-worker-reader')
+        self._reader.daemon = True
+        self._reader.start()
+        logger.info(f"Started emotion worker process {self.process.pid}")
+
+    def _read_results(self):
+        for line in self.process.stdout:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue
+            self.on_result({
+                'dominant_emotion': result['dominant'],
+                'emotion_scores': dict(zip(result['labels'], result['scores'])),
+                'confidence': result['confidence']
+            })
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self, timeout=5.0):
+        if self.process is None:
+            return
+        try:
+            # Closing stdin tells the worker to finish its current frame and exit
+            self.process.stdin.close()
+            self.process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        if self._reader:
+            self._reader.join(timeout)
+        logger.info(f"Emotion worker process {self.process.pid} stopped")
+        self.process = None
+
+def write_result(emotion):
+    """FaceRecognition.on_emotion inside the worker: one compact JSON line per changed result"""
+    labels = list(emotion['emotion_scores'])
+    line = json.dumps({
+        'dominant': emotion['dominant_emotion'],
+        'confidence': round(emotion['confidence'], 2),
+        'labels': labels,
+        'scores': [round(emotion['emotion_scores'][label], 2) for label in labels]
+    }, separators=(',', ':'))
+    sys.stdout.write(line + '\n')
+    sys.stdout.flush()
+
+def main():
+    parser = argparse.ArgumentParser(description='Facial emotion analysis worker')
+    parser.add_argument('--shm', required=True)
+    parser.add_argument('--shape', required=True)
+    parser.add_argument('--slots', type=int, default=4)
+    parser.add_argument('--dtype', default='|u1')
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--backend', default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    from face_recognition import FaceRecognition
+
+    shape = tuple(int(n) for n in args.shape.split(','))
+    frame_buffer = FrameRingBuffer.attach(args.shm, shape, args.slots, np.dtype(args.dtype))
+
+    recognizer = FaceRecognition(emotion_backend=args.backend)
+    recognizer.frame_buffer = frame_buffer
+    recognizer.analysis_interval = args.interval
+    recognizer.on_emotion = write_result
+    recognizer.is_running = True
+
+    def wait_for_parent():
+        # EOF on stdin means the web process stopped us (or died)
+        sys.stdin.read()
+        recognizer.is_running = False
+
+    watcher = threading.Thread(target=wait_for_parent, name='emotion-worker-stdin')
+    watcher.daemon = True
+    watcher.start()
+
+    try:
+        recognizer._analysis_loop()
+    finally:
+        frame_buffer.close()
+
+if __name__ == '__main__':
+    main()
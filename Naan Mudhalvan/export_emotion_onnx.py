@@ -0,0 +1,34 @@
+"""Export DeepFace's facial emotion CNN to ONNX for the ONNX Runtime backend.
+
+Run once on a machine with deepface/TensorFlow and tf2onnx (pip install tf2onnx==1.14.0,
+not part of requirements.txt) installed:
+
+    python export_emotion_onnx.py --output models/emotion.onnx
+
+Then start the app with EMOTION_BACKEND=onnx; TensorFlow is not needed at runtime.
+"""
+import argparse
+import logging
+import os
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+def export(output_path, opset=13):
+    import tensorflow as tf
+    import tf2onnx
+    from deepface import DeepFace
+
+    model = DeepFace.build_model('Emotion')
+    input_signature = [tf.TensorSpec((None, 48, 48, 1), tf.float32, name='face')]
+
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    tf2onnx.convert.from_keras(model, input_signature=input_signature, opset=opset, output_path=output_path)
+    logger.info(f"Exported emotion model to {output_path}")
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Export the DeepFace emotion model to ONNX')
+    parser.add_argument('--output', default=os.path.join('models', 'emotion.onnx'))
+    parser.add_argument('--opset', type=int, default=13)
+    args = parser.parse_args()
+    export(args.output, args.opset)
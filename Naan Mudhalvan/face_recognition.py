@@ -1,22 +1,41 @@
 import cv2
 import numpy as np
-from deepface import DeepFace
+from async_waiters import AsyncWaiters
+from facial_emotion import EmotionModel
+from frame_buffer import FrameRingBuffer
 import logging
 import time
-from threading import Thread
-import queue
+from threading import Condition, Event, Lock, Thread
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class FaceRecognition:
-    def __init__(self):
+    def __init__(self, emotion_model=None, emotion_backend=None, background_warmup=False,
+                 tracking=True, redetect_interval=10, track_min_score=0.6, change_threshold=4.0,
+                 use_worker_process=False, push_threshold=5.0):
         self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        self.emotion_queue = queue.Queue()
+        self.emotion_backend = emotion_backend
+        # With a worker process, detection and inference run there: frames are passed
+        # through shared memory and only small emotion results come back
+        self.use_worker_process = use_worker_process
+        self.worker = None
+        # Share the VisualAnalyzer's model when given one, so weights are loaded once
+        self.emotion_model = emotion_model
+        if self.emotion_model is None and not use_worker_process:
+            self.emotion_model = EmotionModel(backend=emotion_backend, background=background_warmup)
         self.is_running = False
         self.thread = None
+        self.analysis_thread = None
         self.cap = None
+        self.camera_index = 0
+        self.buffer_slots = 4
+        self.frame_buffer = None
+        # Held while the shared ring is read from request threads and while stop() closes it
+        self._buffer_lock = Lock()
+        self.error = None
+        self._camera_ready = Event()
         self.last_analysis_time = 0
         self.analysis_interval = 1.0  # Analyze every 1 second
         self.current_emotion = {
@@ -25,84 +44,182 @@ class FaceRecognition:
             'confidence': 100
         }
 
-    def start(self):
-        """Start the face recognition thread"""
+        # Subscribers (SSE streams, the worker's stdout) only hear about an emotion when the
+        # dominant emotion changes or some score moves by at least push_threshold points
+        self.push_threshold = push_threshold
+        self.emotion_version = 0
+        self.on_emotion = None
+        self._published_emotion = None
+        self._emotion_changed = Condition()
+        # Async SSE streams of asgi_app.py
+        self.emotion_waiters = AsyncWaiters()
+
+        # Tracking mode: full Haar detection only every redetect_interval analyses,
+        # template matching around the previous box in between
+        self.tracking = tracking
+        self.redetect_interval = redetect_interval
+        self.track_min_score = track_min_score
+        self.face_box = None
+        self._face_template = None
+        self._analyses_since_detection = 0
+
+        # Emotion inference is skipped while the face ROI differs from the last
+        # analyzed one by less than change_threshold (mean absolute grey-level difference)
+        self.change_threshold = change_threshold
+        self._last_analyzed_roi = None
+
+        self.stats = {
+            'detections': 0,
+            'tracked': 0,
+            'inferences': 0,
+            'skipped_inferences': 0
+        }
+
+    def start(self, timeout=5.0):
+        """Start the capture and analysis threads; returns False if the camera can't be opened"""
         if self.is_running:
-            return
-        
+            return True
+
         self.is_running = True
-        self.thread = Thread(target=self._run)
+        self.error = None
+        self._camera_ready.clear()
+        self.thread = Thread(target=self._run, name='face-capture')
         self.thread.daemon = True
         self.thread.start()
+
+        # Wait for the camera so callers can report a failure to open it
+        self._camera_ready.wait(timeout)
+        if self.error:
+            self.stop()
+            return False
+
+        if self.use_worker_process:
+            from emotion_worker import EmotionWorkerProcess
+            self.worker = EmotionWorkerProcess(
+                self.frame_buffer,
+                self.publish_emotion,
+                analysis_interval=self.analysis_interval,
+                emotion_backend=self.emotion_backend
+            )
+            self.worker.start()
+        else:
+            self.analysis_thread = Thread(target=self._analysis_loop, name='face-analysis')
+            self.analysis_thread.daemon = True
+            self.analysis_thread.start()
         logger.info("Face recognition started")
+        return True
 
     def stop(self):
-        """Stop the face recognition thread"""
+        """Stop the capture and analysis threads"""
         self.is_running = False
-        if self.thread:
-            self.thread.join()
+        for thread in (self.thread, self.analysis_thread):
+            if thread:
+                thread.join()
+        self.thread = None
+        self.analysis_thread = None
+        if self.worker:
+            self.worker.stop()
+            self.worker = None
         if self.cap:
             self.cap.release()
+        with self._buffer_lock:
+            if self.frame_buffer is not None and self.frame_buffer.shm is not None:
+                # The web process created the shared block, so it also destroys it
+                self.frame_buffer.close(unlink=True)
+                self.frame_buffer = None
         logger.info("Face recognition stopped")
 
     def _run(self):
-        """Main face recognition loop"""
+        """Capture loop: the only code that reads from the camera"""
         try:
-            self.cap = cv2.VideoCapture(0)
+            self.cap = cv2.VideoCapture(self.camera_index)
             if not self.cap.isOpened():
-                logger.error("Failed to open camera")
+                self.error = "Failed to open camera"
+                logger.error(self.error)
                 return
 
+            ret, frame = self.cap.read()
+            if not ret:
+                self.error = "Failed to capture frame"
+                logger.error(self.error)
+                return
+
+            # Preallocate the ring once; frames are decoded straight into its slots
+            if self.use_worker_process:
+                self.frame_buffer = FrameRingBuffer.create_shared(frame.shape, slots=self.buffer_slots)
+            elif self.frame_buffer is None or self.frame_buffer.frame_shape != frame.shape:
+                self.frame_buffer = FrameRingBuffer(frame.shape, slots=self.buffer_slots)
+            self.frame_buffer.write(frame)
+            self._camera_ready.set()
+
             while self.is_running:
-                ret, frame = self.cap.read()
+                sequence, slot = self.frame_buffer.writable_slot()
+                # read() blocks until the camera delivers the next frame, so no sleep is needed
+                ret, frame = self.cap.read(slot)
                 if not ret:
                     logger.error("Failed to capture frame")
                     continue
-
-                current_time = time.time()
-                if current_time - self.last_analysis_time >= self.analysis_interval:
-                    self._analyze_frame(frame)
-                    self.last_analysis_time = current_time
-
-                # Add a small delay to prevent high CPU usage
-                time.sleep(0.1)
+                if frame is not slot:
+                    # The backend allocated a new array (e.g. resolution change)
+                    if frame.shape != slot.shape:
+                        continue
+                    np.copyto(slot, frame)
+                self.frame_buffer.publish(sequence)
 
         except Exception as e:
+            self.error = str(e)
             logger.error(f"Error in face recognition: {str(e)}")
         finally:
+            self._camera_ready.set()
             if self.cap:
                 self.cap.release()
 
+    def _analysis_loop(self):
+        """Consumer loop: analyzes the newest captured frame every analysis_interval"""
+        last_sequence = 0
+        frame = None
+        while self.is_running:
+            current_time = time.time()
+            wait = self.analysis_interval - (current_time - self.last_analysis_time)
+            if wait > 0:
+                time.sleep(wait)
+                continue
+
+            frame_buffer = self.frame_buffer
+            if frame_buffer is None:
+                # Camera still opening
+                time.sleep(self.analysis_interval)
+                continue
+            if frame is None or frame.shape != frame_buffer.frame_shape:
+                frame = np.empty(frame_buffer.frame_shape, dtype=frame_buffer.dtype)
+            sequence, latest, _ = frame_buffer.read_latest(out=frame, after=last_sequence)
+            self.last_analysis_time = time.time()
+            if sequence is None:
+                continue
+            last_sequence = sequence
+            self._analyze_frame(latest)
+
     def _analyze_frame(self, frame):
         """Analyze a single frame for facial emotions"""
         try:
-            # Convert to grayscale for face detection
+            # Convert to grayscale for face detection and tracking
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            
-            # Detect faces
-            faces = self.face_cascade.detectMultiScale(
-                gray,
-                scaleFactor=1.1,
-                minNeighbors=5,
-                minSize=(30, 30)
-            )
 
-            if len(faces) > 0:
-                # Get the largest face
-                x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+            face_box = self._locate_face(gray)
+            if face_box is not None:
+                x, y, w, h = face_box
                 face_roi = frame[y:y+h, x:x+w]
 
-                # Analyze emotions using DeepFace
-                result = DeepFace.analyze(
-                    face_roi,
-                    actions=['emotion'],
-                    enforce_detection=False
-                )
-
-                # Get emotion scores
-                emotion_scores = result[0]['emotion']
-                dominant_emotion = result[0]['dominant_emotion']
-                
+                # Steady footage: reuse the current emotion instead of running the CNN again
+                if not self._roi_changed(gray[y:y+h, x:x+w]):
+                    self.stats['skipped_inferences'] += 1
+                    return
+
+                # Analyze emotions with the preloaded emotion model
+                emotion_scores = self.emotion_model.predict([face_roi])[0]
+                dominant_emotion = max(emotion_scores, key=emotion_scores.get)
+                self.stats['inferences'] += 1
+
                 # Convert scores to percentages
                 total_score = sum(emotion_scores.values())
                 emotion_percentages = {
@@ -110,32 +227,130 @@ class FaceRecognition:
                     for emotion, score in emotion_scores.items()
                 }
 
-                self.current_emotion = {
+                self.publish_emotion({
                     'dominant_emotion': dominant_emotion,
                     'emotion_scores': emotion_percentages,
                     'confidence': emotion_percentages[dominant_emotion]
-                }
-
-                # Put the result in the queue
-                self.emotion_queue.put(self.current_emotion)
+                })
 
         except Exception as e:
             logger.error(f"Error analyzing frame: {str(e)}")
 
+    def _locate_face(self, gray):
+        """Return the face box for this frame, detecting or tracking as configured"""
+        needs_detection = (
+            not self.tracking or
+            self.face_box is None or
+            self._analyses_since_detection >= self.redetect_interval
+        )
+
+        face_box = None
+        if not needs_detection:
+            face_box = self._track_face(gray)
+            if face_box is not None:
+                self.stats['tracked'] += 1
+                self._analyses_since_detection += 1
+        if face_box is None:
+            face_box = self._detect_face(gray)
+            self.stats['detections'] += 1
+            self._analyses_since_detection = 0
+
+        self.face_box = face_box
+        if face_box is not None and self.tracking:
+            x, y, w, h = face_box
+            self._face_template = gray[y:y+h, x:x+w].copy()
+        return face_box
+
+    def _detect_face(self, gray):
+        """Full Haar cascade detection; returns the largest face or None"""
+        faces = self.face_cascade.detectMultiScale(
+            gray,
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(30, 30)
+        )
+        if len(faces) == 0:
+            return None
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        return int(x), int(y), int(w), int(h)
+
+    def _track_face(self, gray):
+        """Follow the previous face box by template matching in a window around it"""
+        x, y, w, h = self.face_box
+        pad_x, pad_y = w // 2, h // 2
+        x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+        x1, y1 = min(gray.shape[1], x + w + pad_x), min(gray.shape[0], y + h + pad_y)
+        search = gray[y0:y1, x0:x1]
+        if search.shape[0] < h or search.shape[1] < w:
+            return None
+
+        scores = cv2.matchTemplate(search, self._face_template, cv2.TM_CCOEFF_NORMED)
+        _, best_score, _, best_loc = cv2.minMaxLoc(scores)
+        if best_score < self.track_min_score:
+            # Lost the face; the caller falls back to a full detection
+            return None
+        return x0 + best_loc[0], y0 + best_loc[1], w, h
+
+    def _roi_changed(self, gray_roi):
+        """Frame-difference gate on the face ROI, compared at the emotion model's input size"""
+        roi = cv2.resize(gray_roi, self.emotion_model.input_size, interpolation=cv2.INTER_AREA)
+        if self._last_analyzed_roi is not None and self.change_threshold > 0:
+            difference = float(np.mean(cv2.absdiff(roi, self._last_analyzed_roi)))
+            if difference < self.change_threshold:
+                return False
+        self._last_analyzed_roi = roi
+        return True
+
+    def get_status(self):
+        """Readiness data for the emotion model used by this recognizer, plus tracking counters"""
+        if self.use_worker_process:
+            status = {'worker_process': True, 'worker_alive': bool(self.worker and self.worker.is_alive())}
+        else:
+            status = self.emotion_model.get_status()
+            status['stats'] = dict(self.stats)
+        status['running'] = self.is_running
+        with self._buffer_lock:
+            status['frames_captured'] = self.frame_buffer.latest_sequence if self.frame_buffer else 0
+        return status
+
+    def publish_emotion(self, emotion):
+        """Store a new result and notify subscribers if it changed significantly"""
+        with self._emotion_changed:
+            # Compared with the last published result so slow drifts still get through
+            changed = self._is_significant_change(self._published_emotion, emotion)
+            self.current_emotion = emotion
+            if not changed:
+                return
+            self._published_emotion = emotion
+            self.emotion_version += 1
+            self._emotion_changed.notify_all()
+        self.emotion_waiters.notify()
+        if self.on_emotion:
+            self.on_emotion(emotion)
+
+    def _is_significant_change(self, previous, emotion):
+        if previous is None or previous['dominant_emotion'] != emotion['dominant_emotion']:
+            return True
+        labels = set(previous['emotion_scores']) | set(emotion['emotion_scores'])
+        return any(
+            abs(previous['emotion_scores'].get(label, 0) - emotion['emotion_scores'].get(label, 0)) >= self.push_threshold
+            for label in labels
+        )
+
+    def wait_for_emotion(self, after_version, timeout=None):
+        """Block until the emotion version passes after_version; returns (version, emotion)"""
+        with self._emotion_changed:
+            self._emotion_changed.wait_for(lambda: self.emotion_version > after_version, timeout)
+            return self.emotion_version, self.current_emotion
+
     def get_current_emotion(self):
         """Get the current emotion analysis"""
-        try:
-            # Get the latest emotion from the queue
-            while not self.emotion_queue.empty():
-                self.current_emotion = self.emotion_queue.get_nowait()
-            return self.current_emotion
-        except queue.Empty:
-            return self.current_emotion
+        return self.current_emotion
 
     def get_frame(self):
-        """Get the current camera frame"""
-        if self.cap and self.cap.isOpened():
-            ret, frame = self.cap.read()
-            if ret:
-                return frame
-        return None 
\ No newline at end of file
+        """Get a copy of the latest captured frame without touching the camera"""
+        with self._buffer_lock:
+            if self.frame_buffer is None:
+                return None
+            _, frame, _ = self.frame_buffer.read_latest()
+        return frame
@@ -0,0 +1,164 @@
+import abc
+import cv2
+import numpy as np
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Default location of the exported ONNX emotion model (see export_emotion_onnx.py)
+DEFAULT_ONNX_PATH = os.path.join('models', 'emotion.onnx')
+
+class EmotionClassifier(abc.ABC):
+    """Shared pre/post-processing for the 48x48 grayscale facial emotion CNN"""
+
+    # Output order of the DeepFace emotion model
+    labels = ['angry', 'disgust', 'fear', 'happy', 'sad', 'surprise', 'neutral']
+    input_size = (48, 48)
+    name = None
+
+    def preprocess(self, faces):
+        """Convert BGR or grayscale face crops into a (n, 48, 48, 1) float32 batch"""
+        batch = np.empty((len(faces), self.input_size[1], self.input_size[0], 1), dtype=np.float32)
+        for i, face in enumerate(faces):
+            if face.ndim == 3:
+                face = cv2.cvtColor(face, cv2.COLOR_BGR2GRAY)
+            if face.shape[:2] != (self.input_size[1], self.input_size[0]):
+                face = cv2.resize(face, self.input_size, interpolation=cv2.INTER_AREA)
+            batch[i, :, :, 0] = face
+        batch /= 255.0
+        return batch
+
+    def predict(self, faces):
+        """Classify face crops in one forward pass; returns DeepFace-style percentage dicts"""
+        if len(faces) == 0:
+            return []
+        return self._to_scores(self._forward(self.preprocess(faces)))
+
+    @abc.abstractmethod
+    def _forward(self, batch):
+        """Run the CNN on a preprocessed batch; returns (n, 7) probabilities"""
+
+    def _to_scores(self, predictions):
+        predictions = np.asarray(predictions, dtype=np.float64)
+        totals = predictions.sum(axis=1, keepdims=True)
+        totals[totals == 0] = 1
+        percentages = 100 * predictions / totals
+        return [
+            {label: float(row[i]) for i, label in enumerate(self.labels)}
+            for row in percentages
+        ]
+
+class DeepFaceEmotionClassifier(EmotionClassifier):
+    """DeepFace's facial emotion CNN, built once and called directly on face crops"""
+
+    name = 'deepface'
+
+    def __init__(self):
+        # Imported here so TensorFlow is only loaded when this backend is used
+        from deepface import DeepFace
+        self.model = DeepFace.build_model('Emotion')
+
+    def _forward(self, batch):
+        return self.model.predict(batch, verbose=0)
+
+class OnnxEmotionClassifier(EmotionClassifier):
+    """The same emotion CNN exported to ONNX and run with ONNX Runtime (no TensorFlow)"""
+
+    name = 'onnx'
+
+    def __init__(self, model_path=None):
+        import onnxruntime as ort
+        self.model_path = model_path or DEFAULT_ONNX_PATH
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(
+                f"ONNX emotion model not found at {self.model_path}. Run export_emotion_onnx.py first."
+            )
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def _forward(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+CLASSIFIER_BACKENDS = {
+    DeepFaceEmotionClassifier.name: DeepFaceEmotionClassifier,
+    OnnxEmotionClassifier.name: OnnxEmotionClassifier
+}
+
+def create_classifier(backend='deepface', model_path=None):
+    """Instantiate the emotion classifier for the given backend name"""
+    if backend not in CLASSIFIER_BACKENDS:
+        raise ValueError(f"Unknown emotion backend '{backend}', expected one of {sorted(CLASSIFIER_BACKENDS)}")
+    if backend == OnnxEmotionClassifier.name:
+        return OnnxEmotionClassifier(model_path)
+    return DeepFaceEmotionClassifier()
+
+class EmotionModel:
+    """Owns an emotion classifier, loads and warms it up, and reports readiness"""
+
+    def __init__(self, backend=None, model_path=None, background=False, load_timeout=120):
+        self.backend = backend or os.getenv('EMOTION_BACKEND', DeepFaceEmotionClassifier.name)
+        self.model_path = model_path or os.getenv('EMOTION_ONNX_PATH', DEFAULT_ONNX_PATH)
+        self.classifier = None
+        self.load_timeout = load_timeout
+        self._ready = threading.Event()
+        self.status = {
+            'ready': False,
+            'backend': self.backend,
+            'model_load_ms': None,
+            'warmup_ms': None,
+            'error': None
+        }
+
+        if background:
+            thread = threading.Thread(target=self._load, name='emotion-model-warmup')
+            thread.daemon = True
+            thread.start()
+        else:
+            self._load()
+
+    def _load(self):
+        try:
+            start = time.perf_counter()
+            classifier = create_classifier(self.backend, self.model_path)
+            self.status['model_load_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+            # Run a dummy inference so graph building happens now, not in a request
+            start = time.perf_counter()
+            classifier.predict([np.zeros(classifier.input_size[::-1], dtype=np.uint8)])
+            self.status['warmup_ms'] = round((time.perf_counter() - start) * 1000, 2)
+
+            self.classifier = classifier
+            self.status['ready'] = True
+            logger.info(f"Emotion model ready (load {self.status['model_load_ms']} ms, warm-up {self.status['warmup_ms']} ms)")
+        except Exception as e:
+            self.status['error'] = str(e)
+            logger.error(f"Failed to load emotion model: {str(e)}")
+        finally:
+            self._ready.set()
+
+    @property
+    def labels(self):
+        return EmotionClassifier.labels
+
+    @property
+    def input_size(self):
+        return EmotionClassifier.input_size
+
+    def wait_ready(self, timeout=None):
+        return self._ready.wait(self.load_timeout if timeout is None else timeout)
+
+    def predict(self, faces):
+        """Classify a list of face crops, waiting for a background load if needed"""
+        if not self.wait_ready():
+            raise RuntimeError("Emotion model is still loading")
+        if self.classifier is None:
+            raise RuntimeError(f"Emotion model unavailable: {self.status['error']}")
+        return self.classifier.predict(faces)
+
+    def get_status(self):
+        return dict(self.status)
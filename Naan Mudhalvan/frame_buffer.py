@@ -0,0 +1,126 @@
+from multiprocessing import shared_memory
+import numpy as np
+import time
+
+class FrameRingBuffer:
+    """Fixed-size ring of preallocated frames with one writer and any number of readers.
+
+    The writer fills slots in order and publishes each frame with a sequence number.
+    Readers never take a lock: they copy the newest slot and check that its sequence
+    number did not change while copying (a seqlock), retrying otherwise.
+    """
+
+    # header[0] holds the latest published sequence number, header[1 + i] the sequence
+    # number stored in slot i (-1 while the writer is filling it)
+    LATEST = 0
+
+    def __init__(self, frame_shape, slots=4, dtype=np.uint8, shm=None):
+        if slots < 2:
+            raise ValueError("A ring buffer needs at least 2 slots")
+        self.frame_shape = tuple(frame_shape)
+        self.slots = slots
+        self.dtype = np.dtype(dtype)
+        self.shm = shm
+
+        if shm is None:
+            self.frames = np.zeros((slots,) + self.frame_shape, dtype=self.dtype)
+            self.header = np.zeros(slots + 1, dtype=np.int64)
+            self.timestamps = np.zeros(slots, dtype=np.float64)
+        else:
+            # NumPy views straight onto the shared block: [header | timestamps | frames]
+            header_bytes = (slots + 1) * 8
+            self.header = np.ndarray((slots + 1,), dtype=np.int64, buffer=shm.buf)
+            self.timestamps = np.ndarray((slots,), dtype=np.float64, buffer=shm.buf, offset=header_bytes)
+            self.frames = np.ndarray(
+                (slots,) + self.frame_shape, dtype=self.dtype, buffer=shm.buf,
+                offset=header_bytes + slots * 8
+            )
+
+    @classmethod
+    def shared_size(cls, frame_shape, slots, dtype=np.uint8):
+        frame_bytes = int(np.prod(frame_shape)) * np.dtype(dtype).itemsize
+        return (slots + 1) * 8 + slots * 8 + slots * frame_bytes
+
+    @classmethod
+    def create_shared(cls, frame_shape, slots=4, dtype=np.uint8):
+        """Allocate the ring in a new multiprocessing shared-memory block"""
+        shm = shared_memory.SharedMemory(create=True, size=cls.shared_size(frame_shape, slots, dtype))
+        frame_buffer = cls(frame_shape, slots, dtype, shm=shm)
+        frame_buffer.header[:] = 0
+        return frame_buffer
+
+    @classmethod
+    def attach(cls, name, frame_shape, slots=4, dtype=np.uint8):
+        """Map a ring created by another process with create_shared()"""
+        try:
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:
+            # Python < 3.13: stop the resource tracker from unlinking the creator's block on exit
+            from multiprocessing import resource_tracker
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(frame_shape, slots, dtype, shm=shm)
+
+    @property
+    def name(self):
+        return self.shm.name if self.shm is not None else None
+
+    def close(self, unlink=False):
+        """Release a shared-memory mapping (and destroy the block if unlink is set)"""
+        if self.shm is None:
+            return
+        # The views must go before the mapping can be closed
+        self.frames = self.header = self.timestamps = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+        self.shm = None
+
+    @property
+    def latest_sequence(self):
+        return int(self.header[self.LATEST])
+
+    def writable_slot(self):
+        """Return (sequence, array) for the next frame; only the producer may call this"""
+        sequence = self.latest_sequence + 1
+        index = sequence % self.slots
+        # Mark the slot as being written so readers racing with us retry
+        self.header[1 + index] = -1
+        return sequence, self.frames[index]
+
+    def publish(self, sequence, timestamp=None):
+        """Make the frame written into the slot for sequence visible to readers"""
+        index = sequence % self.slots
+        self.timestamps[index] = time.time() if timestamp is None else timestamp
+        self.header[1 + index] = sequence
+        self.header[self.LATEST] = sequence
+
+    def write(self, frame, timestamp=None):
+        """Copy a frame into the next slot and publish it"""
+        sequence, slot = self.writable_slot()
+        np.copyto(slot, frame)
+        self.publish(sequence, timestamp)
+        return sequence
+
+    def read_latest(self, out=None, after=0, retries=3):
+        """Copy the newest frame newer than sequence `after`.
+
+        Returns (sequence, frame, timestamp), or (None, None, None) if no such frame exists
+        or the writer kept overwriting it.
+        """
+        for _ in range(retries):
+            sequence = self.latest_sequence
+            if sequence <= after:
+                return None, None, None
+            index = sequence % self.slots
+            if self.header[1 + index] != sequence:
+                continue
+            if out is None:
+                frame = self.frames[index].copy()
+            else:
+                np.copyto(out, self.frames[index])
+                frame = out
+            timestamp = float(self.timestamps[index])
+            if self.header[1 + index] == sequence:
+                return sequence, frame, timestamp
+        return None, None, None
@@ -0,0 +1,305 @@
+"""Continuous batching for DialoGPT chat replies.
+
+One scheduler thread owns the model. At every decoding step it runs a single
+forward pass over all active replies at once, then retires the ones that
+finished and admits waiting requests before the next step, so a new user never
+waits for a whole batch to drain. Each sequence keeps its own conversation
+cache: it is merged into the shared, left-padded batch cache on admission and
+sliced back out on retirement, ready to be reused by the session's next turn.
+"""
+import collections
+import logging
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import torch
+
+from chat_generation import DialogueGenerator, ChatSessionStore
+
+logger = logging.getLogger(__name__)
+
+class GenerationRequest:
+    """Handle returned by submit(); iterate it to receive the reply piece by piece"""
+
+    _END = object()
+
+    def __init__(self, session_id, message):
+        self.session_id = session_id
+        self.message = message
+        self.submitted_at = time.perf_counter()
+        self.admitted_at = None
+        self.cancelled = False
+        self._pieces = queue.Queue()
+
+    def put(self, piece):
+        self._pieces.put(piece)
+
+    def close(self, error=None):
+        self._pieces.put(error if error is not None else self._END)
+
+    def __iter__(self):
+        try:
+            while True:
+                piece = self._pieces.get()
+                if piece is self._END:
+                    return
+                if isinstance(piece, Exception):
+                    raise piece
+                yield piece
+        finally:
+            # Stops generating for a client that went away
+            self.cancelled = True
+
+class _Sequence:
+    def __init__(self, request, session):
+        self.request = request
+        self.session = session
+        self.reply = []
+        self.sent = 0
+        self.next_token = None
+        # Valid (non-padding) positions of this row in the batch cache
+        self.length = 0
+
+def _as_tuples(past_key_values):
+    # Newer transformers return Cache objects; the batch cache is handled as (key, value) tuples
+    if hasattr(past_key_values, 'to_legacy_cache'):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+def _left_pad(tensor, length):
+    missing = length - tensor.shape[2]
+    if missing <= 0:
+        return tensor
+    padding = tensor.new_zeros(tensor.shape[:2] + (missing,) + tensor.shape[3:])
+    return torch.cat([padding, tensor], dim=2)
+
+class GenerationScheduler:
+    def __init__(self, generator, max_batch_size=8, stats_window=512):
+        self.generator = generator
+        self.max_batch_size = max_batch_size
+        self._waiting = collections.deque()
+        self._condition = threading.Condition()
+        self._active = []
+        self._cache = None
+
+        self.tokens_generated = 0
+        self.requests_completed = 0
+        self._token_times = collections.deque(maxlen=stats_window)
+        self._queue_waits = collections.deque(maxlen=stats_window)
+        self._batch_sizes = collections.deque(maxlen=stats_window)
+
+        self._thread = threading.Thread(target=self._run, name='generation-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, session_id, message):
+        request = GenerationRequest(session_id, message)
+        with self._condition:
+            self._waiting.append(request)
+            self._condition.notify()
+        return request
+
+    def stream(self, session_id, message):
+        """Same interface as DialogueGenerator.stream"""
+        return iter(self.submit(session_id, message))
+
+    def get_stats(self):
+        with self._condition:
+            waiting = len(self._waiting)
+        token_times = list(self._token_times)
+        waits = np.array(self._queue_waits) * 1000 if self._queue_waits else np.zeros(1)
+        elapsed = token_times[-1] - token_times[0] if len(token_times) > 1 else 0
+        return {
+            'batching': True,
+            'sessions': len(self.generator.sessions),
+            'active': len(self._active),
+            'waiting': waiting,
+            'tokens_generated': self.tokens_generated,
+            'requests_completed': self.requests_completed,
+            'tokens_per_second': round((len(token_times) - 1) / elapsed, 1) if elapsed > 0 else 0.0,
+            'queue_wait_p50_ms': round(float(np.percentile(waits, 50)), 1),
+            'queue_wait_p95_ms': round(float(np.percentile(waits, 95)), 1),
+            'mean_batch_size': round(float(np.mean(self._batch_sizes)), 2) if self._batch_sizes else 0.0
+        }
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._waiting and not self._active:
+                    self._condition.wait()
+            try:
+                with torch.inference_mode():
+                    self._admit()
+                    if self._active:
+                        self._step()
+                if not self._active:
+                    # Only requests for busy sessions are waiting; don't spin
+                    time.sleep(0.01)
+            except Exception as e:
+                logger.error(f"Error in generation step: {str(e)}")
+                self._fail_all(e)
+
+    def _admit(self):
+        """Move waiting requests into the batch, one prefill each, until the batch is full"""
+        deferred = []
+        while len(self._active) < self.max_batch_size:
+            with self._condition:
+                if not self._waiting:
+                    break
+                request = self._waiting.popleft()
+            if request.cancelled:
+                request.close()
+                continue
+            session = self.generator.sessions.get(request.session_id)
+            if not session.lock.acquire(blocking=False):
+                # That session is still answering its previous message
+                deferred.append(request)
+                continue
+
+            request.admitted_at = time.perf_counter()
+            self._queue_waits.append(request.admitted_at - request.submitted_at)
+            sequence = _Sequence(request, session)
+            try:
+                self.generator.begin_turn(session, request.message)
+                outputs = self.generator.model(
+                    input_ids=torch.tensor([session.pending], dtype=torch.long),
+                    past_key_values=session.past_key_values,
+                    use_cache=True
+                )
+                session.pending = []
+                cache = _as_tuples(outputs.past_key_values)
+                sequence.length = cache[0][0].shape[2]
+                token = self.generator.sample(outputs.logits[0, -1, :])[0]
+            except Exception as e:
+                logger.error(f"Error starting reply for chat session {request.session_id}: {str(e)}")
+                self._retire(sequence, complete=False, error=e)
+                continue
+
+            if self._accept(sequence, token):
+                self._merge(sequence, cache)
+            else:
+                session.past_key_values = cache
+                self._retire(sequence)
+
+        if deferred:
+            with self._condition:
+                self._waiting.extendleft(reversed(deferred))
+
+    def _step(self):
+        """One decoding step for every active sequence"""
+        sequences = self._active
+        width = self._cache[0][0].shape[2]
+        input_ids = torch.tensor([[s.next_token] for s in sequences], dtype=torch.long)
+        position_ids = torch.tensor([[s.length] for s in sequences], dtype=torch.long)
+        # Left padding is masked out; the new token is always visible
+        attention_mask = torch.zeros((len(sequences), width + 1), dtype=torch.long)
+        for row, sequence in enumerate(sequences):
+            attention_mask[row, width - sequence.length:] = 1
+
+        outputs = self.generator.model(
+            input_ids=input_ids,
+            past_key_values=self._cache,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            use_cache=True
+        )
+        self._cache = _as_tuples(outputs.past_key_values)
+        self._batch_sizes.append(len(sequences))
+        tokens = self.generator.sample(outputs.logits[:, -1, :])
+
+        finished = []
+        for row, (sequence, token) in enumerate(zip(sequences, tokens)):
+            sequence.length += 1
+            sequence.next_token = None
+            if not self._accept(sequence, token):
+                finished.append(row)
+        if finished:
+            self._split(finished)
+
+    def _accept(self, sequence, token):
+        """Record a sampled token; False when the sequence should be retired"""
+        if token == self.generator.eos_token_id or sequence.request.cancelled:
+            return False
+        sequence.reply.append(token)
+        sequence.next_token = token
+        self.tokens_generated += 1
+        self._token_times.append(time.perf_counter())
+        piece = self.generator.text_delta(sequence.reply, sequence.sent)
+        if piece:
+            sequence.request.put(piece)
+            sequence.sent += len(piece)
+        return len(sequence.reply) < self.generator.max_new_tokens
+
+    def _merge(self, sequence, cache):
+        if self._cache is None:
+            self._cache = cache
+        else:
+            width = max(self._cache[0][0].shape[2], sequence.length)
+            self._cache = tuple(
+                tuple(torch.cat([_left_pad(batch, width), _left_pad(new, width)], dim=0)
+                      for batch, new in zip(batch_layer, new_layer))
+                for batch_layer, new_layer in zip(self._cache, cache)
+            )
+        self._active.append(sequence)
+
+    def _split(self, rows):
+        """Retire the given batch rows, handing each its own slice of the cache"""
+        width = self._cache[0][0].shape[2]
+        for row in rows:
+            sequence = self._active[row]
+            sequence.session.past_key_values = tuple(
+                tuple(tensor[row:row + 1, :, width - sequence.length:].clone() for tensor in layer)
+                for layer in self._cache
+            )
+            self._retire(sequence)
+
+        retired = set(rows)
+        keep = [row for row in range(len(self._active)) if row not in retired]
+        self._active = [self._active[row] for row in keep]
+        if not keep:
+            self._cache = None
+            return
+        # Drop rows and any left padding no remaining row needs
+        new_width = max(s.length for s in self._active)
+        index = torch.tensor(keep, dtype=torch.long)
+        self._cache = tuple(
+            tuple(tensor.index_select(0, index)[:, :, width - new_width:] for tensor in layer)
+            for layer in self._cache
+        )
+
+    def _retire(self, sequence, complete=True, error=None):
+        unfed = [sequence.next_token] if sequence.next_token is not None else []
+        self.generator.finish_turn(sequence.session, sequence.reply, unfed, complete=complete)
+        sequence.session.lock.release()
+        piece = self.generator.text_delta(sequence.reply, sequence.sent, final=True)
+        if piece and error is None:
+            sequence.request.put(piece)
+        sequence.request.close(error)
+        self.requests_completed += 1
+
+    def _fail_all(self, error):
+        for sequence in self._active:
+            self._retire(sequence, complete=False, error=error)
+        self._active = []
+        self._cache = None
+
+def create_chat_generator(tokenizer, model):
+    """DialoGPT reply generator configured from the CHAT_* environment variables.
+
+    Returns a GenerationScheduler, or the plain DialogueGenerator when
+    CHAT_BATCH_SIZE is 0; both provide stream() and get_stats().
+    """
+    generator = DialogueGenerator(
+        tokenizer,
+        model,
+        ChatSessionStore(max_sessions=int(os.getenv('CHAT_MAX_SESSIONS', '256'))),
+        max_history_tokens=int(os.getenv('CHAT_MAX_HISTORY_TOKENS', '256')),
+        max_new_tokens=int(os.getenv('CHAT_MAX_NEW_TOKENS', '80'))
+    )
+    batch_size = int(os.getenv('CHAT_BATCH_SIZE', '8'))
+    if batch_size <= 0:
+        return generator
+    return GenerationScheduler(generator, max_batch_size=batch_size)
@@ -0,0 +1,244 @@
+"""Pool of inference worker processes with a bounded queue per model.
+
+Each model is pinned to its own worker processes (e.g. two for the visual
+model, one for Whisper), so a burst on one model cannot starve the others, and
+every worker is limited to a few BLAS/OpenMP threads so the workers together
+do not oversubscribe the CPU. Calls wait in the model's queue for a free
+worker; when the queue is full the call fails at once with InferenceBusyError
+instead of piling up behind the backlog.
+
+A worker is a single-service model_server.py process on a private Unix socket
+and handles one call at a time.
+"""
+import atexit
+import logging
+import math
+import os
+import queue
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from model_client import ModelClient, RemoteService, InferenceBusyError
+from model_protocol import ProtocolError
+
+logger = logging.getLogger(__name__)
+
+MODEL_SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'model_server.py')
+
+# Chat replies stream from one batching scheduler and stay out of the pool
+POOLED_SERVICES = {'text', 'voice', 'whisper', 'visual', 'encoder'}
+
+# Thread-count variables read by the numeric libraries when a worker imports them
+THREAD_VARIABLES = ('OMP_NUM_THREADS', 'MKL_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS')
+
+def parse_worker_counts(spec):
+    """Parse 'whisper=1,visual=2' into {'whisper': 1, 'visual': 2}"""
+    counts = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, count = item.partition('=')
+        name = name.strip()
+        if name not in POOLED_SERVICES:
+            raise ValueError(f"'{name}' cannot run in the inference pool")
+        counts[name] = int(count) if count.strip() else 1
+        if counts[name] < 1:
+            raise ValueError(f"'{name}' needs at least one worker")
+    return counts
+
+class _Call:
+    def __init__(self, method, args, kwargs):
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class _Worker:
+    def __init__(self, service, index, socket_path, threads):
+        self.service = service
+        self.name = f'{service}-{index}'
+        self.socket_path = socket_path
+        self.threads = threads
+        self.process = None
+        self.client = None
+        self.restarts = 0
+
+    def start(self):
+        env = dict(os.environ)
+        for variable in THREAD_VARIABLES:
+            env[variable] = str(self.threads)
+        # The worker must not start a pool of its own
+        env['INFERENCE_WORKERS'] = ''
+        self.process = subprocess.Popen(
+            [sys.executable, MODEL_SERVER_SCRIPT, '--socket', self.socket_path,
+             '--services', self.service, '--workers', ''],
+            env=env
+        )
+        self.client = ModelClient(self.socket_path, max_idle=1)
+        logger.info(f"Started inference worker {self.name} (pid {self.process.pid}, {self.threads} threads)")
+
+    @property
+    def ready(self):
+        # The socket only appears once the worker has loaded its model
+        return self.process is not None and self.process.poll() is None and os.path.exists(self.socket_path)
+
+    def wait_ready(self):
+        # The socket only appears once the worker has loaded its model
+        while not os.path.exists(self.socket_path):
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Inference worker {self.name} exited with code {self.process.returncode}")
+            time.sleep(0.1)
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+class _ServiceQueue:
+    def __init__(self, name, workers, max_queued):
+        self.name = name
+        self.workers = workers
+        self.calls = queue.Queue(maxsize=max_queued)
+        self.busy = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        # Moving average of the time a worker spends on one call, for Retry-After
+        self.service_time = 1.0
+        self.lock = threading.Lock()
+
+class InferencePool:
+    def __init__(self, worker_counts, max_queued=8, threads_per_worker=None, service_time_alpha=0.2):
+        self.service_time_alpha = service_time_alpha
+        self._socket_dir = tempfile.mkdtemp(prefix='inference-pool-')
+        total = sum(worker_counts.values())
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // max(total, 1))
+
+        self._queues = {}
+        self._workers = []
+        for name, count in worker_counts.items():
+            workers = [
+                _Worker(name, index, os.path.join(self._socket_dir, f'{name}-{index}.sock'), threads_per_worker)
+                for index in range(count)
+            ]
+            self._queues[name] = _ServiceQueue(name, workers, max_queued)
+            for worker in workers:
+                worker.start()
+                thread = threading.Thread(target=self._dispatch, args=(self._queues[name], worker),
+                                          name=f'inference-dispatch-{worker.name}')
+                thread.daemon = True
+                thread.start()
+                self._workers.append(worker)
+        atexit.register(self.close)
+
+    @property
+    def services(self):
+        return set(self._queues)
+
+    def call(self, service, method, *args, **kwargs):
+        """Run a model method on a worker; raises InferenceBusyError when the model's queue is full"""
+        service_queue = self._queues.get(service)
+        if service_queue is None:
+            raise LookupError(f"Service '{service}' is not in the inference pool")
+        call = _Call(method, args, kwargs)
+        try:
+            service_queue.calls.put_nowait(call)
+        except queue.Full:
+            with service_queue.lock:
+                service_queue.rejected += 1
+            raise InferenceBusyError(service, self._retry_after(service_queue))
+        call.done.wait()
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def service(self, name):
+        return RemoteService(self, name)
+
+    def get_stats(self):
+        stats = {}
+        for name, service_queue in self._queues.items():
+            with service_queue.lock:
+                stats[name] = {
+                    'workers': len(service_queue.workers),
+                    'alive': sum(1 for w in service_queue.workers if w.process.poll() is None),
+                    'queued': service_queue.calls.qsize(),
+                    'max_queued': service_queue.calls.maxsize,
+                    'busy': service_queue.busy,
+                    'completed': service_queue.completed,
+                    'failed': service_queue.failed,
+                    'rejected': service_queue.rejected,
+                    'restarts': sum(w.restarts for w in service_queue.workers),
+                    'service_time_ms': round(service_queue.service_time * 1000, 1)
+                }
+        return stats
+
+    def get_readiness(self, service):
+        """Whether a model has a worker ready, from the worker processes alone; never queues a call"""
+        service_queue = self._queues.get(service)
+        if service_queue is None:
+            raise LookupError(f"Service '{service}' is not in the inference pool")
+        ready = sum(1 for worker in service_queue.workers if worker.ready)
+        return {'ready': ready > 0, 'workers': len(service_queue.workers), 'ready_workers': ready}
+
+    def close(self):
+        for worker in self._workers:
+            worker.stop()
+        shutil.rmtree(self._socket_dir, ignore_errors=True)
+
+    def _retry_after(self, service_queue):
+        # Seconds until the backlog ahead of a new call should have drained
+        with service_queue.lock:
+            backlog = service_queue.calls.qsize() + service_queue.busy
+            seconds = backlog * service_queue.service_time / len(service_queue.workers)
+        return max(1, math.ceil(seconds))
+
+    def _dispatch(self, service_queue, worker):
+        """Feeds one worker process, one call at a time"""
+        while True:
+            call = service_queue.calls.get()
+            with service_queue.lock:
+                service_queue.busy += 1
+            elapsed = None
+            try:
+                worker.wait_ready()
+                started = time.perf_counter()
+                call.result = worker.client.call(service_queue.name, call.method, *call.args, **call.kwargs)
+                elapsed = time.perf_counter() - started
+            except (OSError, ProtocolError, RuntimeError) as e:
+                call.error = e
+                self._recover(worker, e)
+            except Exception as e:
+                # Raised by the model itself; the worker is fine
+                call.error = e
+            with service_queue.lock:
+                service_queue.busy -= 1
+                if elapsed is not None:
+                    service_queue.completed += 1
+                    service_queue.service_time += self.service_time_alpha * (elapsed - service_queue.service_time)
+                else:
+                    service_queue.failed += 1
+            call.done.set()
+
+    def _recover(self, worker, error):
+        logger.error(f"Inference worker {worker.name} failed: {str(error)}")
+        try:
+            # A dropped connection usually means the process is exiting
+            worker.process.wait(timeout=2)
+        except subprocess.TimeoutExpired:
+            return
+        logger.warning(f"Restarting inference worker {worker.name}")
+        if os.path.exists(worker.socket_path):
+            os.unlink(worker.socket_path)
+        worker.restarts += 1
+        worker.start()
@@ -0,0 +1,123 @@
+"""Compiled intent matching for the chat responders.
+
+Every trigger phrase is compiled once into an Aho-Corasick automaton, so a
+message is matched in a single left-to-right pass whose cost depends on the
+message length and not on the number of phrases. Phrases only match on word
+boundaries ('hi' does not fire inside 'this'), and when several phrases match,
+the one with the lowest priority wins, then the one added first.
+"""
+import collections
+
+def normalize(text):
+    """Lowercase and collapse whitespace; applied to phrases and messages alike"""
+    return ' '.join(text.lower().split())
+
+def _is_word_char(char):
+    return char.isalnum() or char == '_'
+
+class IntentMatcher:
+    def __init__(self):
+        self._phrases = []
+        self._goto = None
+
+    def add(self, phrase, payload, priority=0):
+        """Register a trigger phrase; payload is returned by match() when it wins"""
+        phrase = normalize(phrase)
+        if not phrase:
+            raise ValueError("Intent phrases must not be empty")
+        self._phrases.append((priority, len(self._phrases), phrase, payload))
+        self._goto = None
+        return self
+
+    def __len__(self):
+        return len(self._phrases)
+
+    def compile(self):
+        """Build the automaton; called automatically by the first match()"""
+        # Rank 0 is the best phrase: lowest priority, then insertion order
+        ranked = sorted(self._phrases)
+        self._priorities = [priority for priority, _, _, _ in ranked]
+        self._payloads = [payload for _, _, _, payload in ranked]
+
+        goto = [{}]
+        outputs = [[]]
+        for rank, (_, _, phrase, _) in enumerate(ranked):
+            state = 0
+            for char in phrase:
+                if char not in goto[state]:
+                    goto.append({})
+                    outputs.append([])
+                    goto[state][char] = len(goto) - 1
+                state = goto[state][char]
+            # (rank, length, needs boundary before, needs boundary after)
+            outputs[state].append((rank, len(phrase), _is_word_char(phrase[0]), _is_word_char(phrase[-1])))
+
+        # Breadth-first failure links; each state also reports the phrases of its suffix states
+        fail = [0] * len(goto)
+        pending = collections.deque(goto[0].values())
+        while pending:
+            state = pending.popleft()
+            outputs[state].sort()
+            for char, child in goto[state].items():
+                fallback = fail[state]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                fail[child] = goto[fallback].get(char, 0)
+                outputs[child] = outputs[child] + outputs[fail[child]]
+                pending.append(child)
+
+        self._goto = goto
+        self._fail = fail
+        self._outputs = outputs
+        return self
+
+    def match(self, text):
+        """Payload of the best phrase found in text, or None"""
+        return self.match_with_priority(text)[1]
+
+    def match_with_priority(self, text):
+        """(priority, payload) of the best phrase found in text, or (None, None)"""
+        if self._goto is None:
+            self.compile()
+        text = normalize(text)
+        goto, fail, outputs = self._goto, self._fail, self._outputs
+        last = len(text) - 1
+        state = 0
+        best = None
+        for end, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for rank, length, left, right in outputs[state]:
+                if best is not None and rank >= best:
+                    break
+                start = end - length + 1
+                if left and start > 0 and _is_word_char(text[start - 1]):
+                    continue
+                if right and end < last and _is_word_char(text[end + 1]):
+                    continue
+                best = rank
+                break
+            if best == 0:
+                break
+        if best is None:
+            return None, None
+        return self._priorities[best], self._payloads[best]
+
+# Priorities of the chat intent groups, most urgent first
+CRISIS, CONVERSATION, QUESTION, TOPIC = range(4)
+
+def build_chat_intents(qa_table, conversational_prompts, crisis_keywords, crisis_response):
+    """Compile the chat tables into one matcher whose payloads are lists of candidate responses"""
+    matcher = IntentMatcher()
+    for keyword in crisis_keywords:
+        matcher.add(keyword, [crisis_response], CRISIS)
+    for prompts in conversational_prompts.values():
+        for phrase, responses in prompts.items():
+            matcher.add(phrase, responses, CONVERSATION)
+    for questions in qa_table.values():
+        for question, answer in questions.items():
+            matcher.add(question, [answer], QUESTION)
+    for topic, questions in qa_table.items():
+        matcher.add(topic, list(questions.values()), TOPIC)
+    return matcher.compile()
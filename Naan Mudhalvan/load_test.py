@@ -0,0 +1,282 @@
+"""Load test of a running server with a realistic traffic mix.
+
+    python load_test.py --url http://127.0.0.1:5000 --rates 1,2,5,10 --duration 30 [--users 4] [--output report.json]
+
+Test users (loadtest-0, loadtest-1, ...) are signed up if needed and logged in
+through /login, then requests are sent at each target rate in turn for
+--duration seconds. The mix of /analyze/text, /analyze/audio, /analyze/visual,
+/transcribe, /analyze/questionnaire and /chat is set with --mix. Uploads use
+the synthetic speech-like audio and drawn faces of bench_analyzers.py.
+
+Arrivals follow a fixed schedule whether or not the server keeps up, and
+latency is measured from each request's scheduled time, so a saturated server
+shows up as growing latency instead of a quietly lower request rate. The JSON
+report has, for every rate, the achieved throughput, error and rejection
+(429/503) rates and latency percentiles and histograms per endpoint; the
+saturation curve lists these per offered rate, with the highest rate that met
+--slo-ms and --max-error-rate.
+"""
+import argparse
+import bisect
+import http.cookiejar
+import json
+import random
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from bench_analyzers import (make_texts, make_questionnaires, make_speech_like, make_face_jpeg,
+                             encode_wav, CHAT_MESSAGES)
+from metrics import DEFAULT_BUCKETS
+
+DEFAULT_MIX = 'text=40,chat=30,visual=15,questionnaire=8,audio=4,transcribe=3'
+
+def parse_mix(spec):
+    """Parse 'text=40,chat=30' into {'text': 40.0, 'chat': 30.0}"""
+    mix = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError(f"Unknown endpoint '{name}'")
+        mix[name] = float(weight)
+    return mix
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def multipart(fields, files):
+    """Encode form fields and (name, filename, content_type, data) files as multipart/form-data"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content_type, data in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+class Fixtures:
+    def __init__(self, seed=0):
+        rng = np.random.default_rng(seed)
+        self.texts = make_texts(random.Random(seed), 20) + make_texts(random.Random(seed + 1), 60)
+        self.questionnaires = make_questionnaires(random.Random(seed))
+        self.audio = [encode_wav(*make_speech_like(seconds, rng)) for seconds in (2, 3, 5)]
+        self.faces = [make_face_jpeg(640, 480, rng) for _ in range(4)]
+
+# Each endpoint builds (path, body, content type) from the fixtures
+ENDPOINTS = {
+    'text': lambda f, rng: ('/analyze/text', json.dumps({'text': rng.choice(f.texts)}).encode(), 'application/json'),
+    'chat': lambda f, rng: ('/chat', json.dumps({'message': rng.choice(CHAT_MESSAGES)}).encode(), 'application/json'),
+    'questionnaire': lambda f, rng: ('/analyze/questionnaire', json.dumps(rng.choice(f.questionnaires)).encode(),
+                                     'application/json'),
+    'visual': lambda f, rng: ('/analyze/visual', *multipart({}, [('image', 'frame.jpg', 'image/jpeg', rng.choice(f.faces))])),
+    'audio': lambda f, rng: ('/analyze/audio', *multipart({}, [('audio', 'recording.wav', 'audio/wav', rng.choice(f.audio))])),
+    'transcribe': lambda f, rng: ('/transcribe', *multipart({}, [('audio', 'recording.wav', 'audio/wav', rng.choice(f.audio))]))
+}
+
+class LoadTestUser:
+    def __init__(self, base_url, username, password):
+        self.base_url = base_url
+        self.username = username
+        self.password = password
+        self.cookies = http.cookiejar.CookieJar()
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookies), _NoRedirect)
+
+    def post_form(self, path, fields):
+        data = urllib.parse.urlencode(fields).encode()
+        try:
+            response = self.opener.open(self.base_url + path, data=data, timeout=30)
+            return response.status, response.headers.get('Location', '')
+        except urllib.error.HTTPError as e:
+            return e.code, e.headers.get('Location', '')
+
+    def login(self, signup=True):
+        if signup:
+            self.post_form('/signup', {
+                'username': self.username, 'email': f'{self.username}@example.com',
+                'password': self.password, 'confirm_password': self.password
+            })
+        status, location = self.post_form('/login', {'username': self.username, 'password': self.password})
+        # A successful login redirects away from the login page
+        if status != 302 or '/login' in location:
+            raise RuntimeError(f"Could not log in as {self.username}")
+
+    def post(self, path, body, content_type, timeout):
+        request = urllib.request.Request(self.base_url + path, data=body, headers={'Content-Type': content_type})
+        try:
+            with self.opener.open(request, timeout=timeout) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+class Recorder:
+    """Outcomes of one step, per endpoint"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.results = {}
+
+    def record(self, endpoint, status, latency):
+        with self.lock:
+            self.results.setdefault(endpoint, []).append((status, latency))
+
+def histogram(latencies):
+    counts = [0] * (len(DEFAULT_BUCKETS) + 1)
+    for latency in latencies:
+        counts[bisect.bisect_left(DEFAULT_BUCKETS, latency)] += 1
+    # Cumulative, as in the Prometheus histograms of /metrics
+    result, total = {}, 0
+    for bound, count in zip(list(DEFAULT_BUCKETS) + ['+Inf'], counts):
+        total += count
+        result[str(bound)] = total
+    return result
+
+def summarize(outcomes):
+    statuses = [status for status, _ in outcomes]
+    # Redirects are not followed, so a 3xx (e.g. to /login once the session expired) is an error too
+    latencies = [latency for status, latency in outcomes if status is not None and status < 300]
+    rejected = sum(1 for status in statuses if status in (429, 503))
+    errors = sum(1 for status in statuses if status is None or (status >= 300 and status not in (429, 503)))
+    result = {
+        'requests': len(outcomes),
+        'ok': len(latencies),
+        'errors': errors,
+        'rejected': rejected,
+        'error_rate': round(errors / len(outcomes), 4) if outcomes else 0.0,
+        'rejection_rate': round(rejected / len(outcomes), 4) if outcomes else 0.0,
+        'status_counts': {str(status): statuses.count(status) for status in sorted(set(statuses), key=str)}
+    }
+    if latencies:
+        values = np.array(latencies) * 1000
+        result.update({
+            'p50_ms': round(float(np.percentile(values, 50)), 1),
+            'p95_ms': round(float(np.percentile(values, 95)), 1),
+            'p99_ms': round(float(np.percentile(values, 99)), 1),
+            'max_ms': round(float(values.max()), 1),
+            'histogram': histogram(latencies)
+        })
+    return result
+
+def run_step(users, fixtures, mix, rate, duration, executor, timeout, poisson, rng):
+    recorder = Recorder()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    pending = []
+
+    def send(endpoint, user, scheduled):
+        path, body, content_type = ENDPOINTS[endpoint](fixtures, random.Random(scheduled))
+        try:
+            status = user.post(path, body, content_type, timeout)
+        except Exception:
+            status = None
+        # From the scheduled time, so time spent waiting for a free client thread counts too
+        recorder.record(endpoint, status, time.monotonic() - scheduled)
+
+    started = time.monotonic()
+    scheduled = started
+    sent = 0
+    while scheduled < started + duration:
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        endpoint = rng.choices(names, weights)[0]
+        pending.append(executor.submit(send, endpoint, users[sent % len(users)], scheduled))
+        sent += 1
+        scheduled += rng.expovariate(rate) if poisson else 1 / rate
+    for future in pending:
+        future.result()
+    elapsed = time.monotonic() - started
+
+    outcomes = [outcome for results in recorder.results.values() for outcome in results]
+    step = summarize(outcomes)
+    step.update({
+        'offered_rps': rate,
+        'achieved_rps': round(step['ok'] / elapsed, 2),
+        'elapsed_s': round(elapsed, 1),
+        'endpoints': {name: summarize(results) for name, results in sorted(recorder.results.items())}
+    })
+    return step
+
+def run(base_url, rates, duration, mix, user_count, password, concurrency, timeout, slo_ms, max_error_rate,
+        poisson=False, signup=True, seed=0):
+    rng = random.Random(seed)
+    fixtures = Fixtures(seed)
+    users = [LoadTestUser(base_url, f'loadtest-{i}', password) for i in range(user_count)]
+    for user in users:
+        user.login(signup)
+
+    steps = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for rate in rates:
+            step = run_step(users, fixtures, mix, rate, duration, executor, timeout, poisson, rng)
+            steps.append(step)
+            print(f"{rate} rps offered: {step['achieved_rps']} rps ok, p95 {step.get('p95_ms')} ms, "
+                  f"{step['error_rate']:.1%} errors, {step['rejection_rate']:.1%} rejected", flush=True)
+
+    saturation = [
+        {key: step.get(key) for key in ('offered_rps', 'achieved_rps', 'p50_ms', 'p95_ms', 'p99_ms',
+                                        'error_rate', 'rejection_rate')}
+        for step in steps
+    ]
+    sustained = [
+        step['offered_rps'] for step in steps
+        if step.get('p95_ms') is not None and step['p95_ms'] <= slo_ms
+        and step['error_rate'] + step['rejection_rate'] <= max_error_rate
+    ]
+    return {
+        'url': base_url,
+        'users': user_count,
+        'mix': mix,
+        'duration_s': duration,
+        'slo_ms': slo_ms,
+        'max_error_rate': max_error_rate,
+        'max_sustained_rps': max(sustained) if sustained else None,
+        'saturation_curve': saturation,
+        'steps': steps
+    }
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Drive a traffic mix at increasing rates against a running server')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--rates', default='1,2,5,10', help='Requests per second for each step')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds per step')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Relative weight of each endpoint')
+    parser.add_argument('--users', type=int, default=4, help='Test users to spread the requests over')
+    parser.add_argument('--password', default='loadtest-password')
+    parser.add_argument('--no-signup', action='store_true', help='The test users already exist')
+    parser.add_argument('--concurrency', type=int, default=64, help='Most requests in flight at once')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds before a request counts as an error')
+    parser.add_argument('--poisson', action='store_true', help='Random arrivals instead of evenly spaced ones')
+    parser.add_argument('--slo-ms', type=float, default=2000, help='p95 latency a rate must meet to count as sustained')
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--output', help='Also write the JSON report to this file')
+    args = parser.parse_args()
+
+    try:
+        mix = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+    rates = [float(rate) for rate in args.rates.split(',') if rate.strip()]
+
+    report = json.dumps(run(args.url.rstrip('/'), rates, args.duration, mix, args.users, args.password,
+                            args.concurrency, args.timeout, args.slo_ms, args.max_error_rate,
+                            poisson=args.poisson, signup=not args.no_signup), indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
@@ -0,0 +1,209 @@
+"""Per-stage latency metrics for the web apps.
+
+Code times a step with `with stage('whisper'):`. The duration goes into a
+histogram for the current request's endpoint and that stage, and into the
+request's Server-Timing header. Each thread records into its own shard, so an
+observation takes no lock; a scrape of /metrics merges the shards into the
+Prometheus text format. Stages timed outside any request (background jobs,
+model server processes) are recorded under the endpoint 'background' unless
+a request_timing() block names them.
+"""
+import bisect
+import contextlib
+import contextvars
+import threading
+import time
+import weakref
+
+# Histogram bucket upper bounds in seconds; model calls range from milliseconds to a minute
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Fewest per-thread shards at which dead threads' shards are folded without a scrape
+MIN_SWEEP_SHARDS = 64
+
+_current_timing = contextvars.ContextVar('request_timing', default=None)
+
+class RequestTiming:
+    """Stages of one request, in the order they finished"""
+
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = []
+
+    def server_timing(self, total):
+        parts = [f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.stages]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+class _Shard:
+    __slots__ = ('thread', 'histograms', 'requests')
+
+    def __init__(self, thread):
+        self.thread = weakref.ref(thread)
+        # (endpoint, stage) -> per-bucket counts, then the +Inf count, then the sum
+        self.histograms = {}
+        # (endpoint, status) -> count
+        self.requests = {}
+
+class LatencyMetrics:
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix='naan'):
+        self.buckets = tuple(buckets)
+        self.prefix = prefix
+        self._local = threading.local()
+        self._shards = []
+        # Totals of shards whose threads have exited
+        self._retired = _Shard(threading.current_thread())
+        # Shard count that triggers folding dead threads' shards, so a thread per request can't grow the list unscraped
+        self._sweep_at = MIN_SWEEP_SHARDS
+        # Only taken when a thread records for the first time and while scraping
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, stage, seconds):
+        histograms = self._shard().histograms
+        key = (endpoint, stage)
+        counts = histograms.get(key)
+        if counts is None:
+            counts = histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        counts[-1] += seconds
+
+    def count_request(self, endpoint, status):
+        requests = self._shard().requests
+        key = (endpoint, str(status))
+        requests[key] = requests.get(key, 0) + 1
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            timing = _current_timing.get()
+            if timing is not None:
+                timing.stages.append((name, elapsed))
+            self.observe(timing.endpoint if timing is not None else 'background', name, elapsed)
+
+    def begin_request(self, endpoint):
+        """Start timing a request; pass the result to finish_request"""
+        timing = RequestTiming(endpoint)
+        return timing, _current_timing.set(timing)
+
+    def finish_request(self, timing, token, status):
+        """Record the request's total time and status; returns its Server-Timing header value"""
+        _current_timing.reset(token)
+        total = time.perf_counter() - timing.started
+        self.observe(timing.endpoint, 'total', total)
+        self.count_request(timing.endpoint, status)
+        return timing.server_timing(total)
+
+    @contextlib.contextmanager
+    def request_timing(self, endpoint):
+        """Time a unit of work outside a web request, e.g. a background job"""
+        timing, token = self.begin_request(endpoint)
+        status = 'ok'
+        try:
+            yield timing
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            self.finish_request(timing, token, status)
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        histograms, requests = self._merge()
+        name = f'{self.prefix}_stage_duration_seconds'
+        lines = [
+            f'# HELP {name} Time spent in each stage of a request.',
+            f'# TYPE {name} histogram'
+        ]
+        for (endpoint, stage), counts in sorted(histograms.items()):
+            labels = f'endpoint="{_escape(endpoint)}",stage="{_escape(stage)}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            cumulative += counts[len(self.buckets)]
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {counts[-1]:.6f}')
+            lines.append(f'{name}_count{{{labels}}} {cumulative}')
+
+        name = f'{self.prefix}_requests_total'
+        lines.append(f'# HELP {name} Requests handled, by endpoint and status.')
+        lines.append(f'# TYPE {name} counter')
+        for (endpoint, status), count in sorted(requests.items()):
+            lines.append(f'{name}{{endpoint="{_escape(endpoint)}",status="{_escape(status)}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = _Shard(threading.current_thread())
+            with self._lock:
+                self._shards.append(shard)
+                if len(self._shards) >= self._sweep_at:
+                    self._retire_dead()
+                    # Doubling keeps the sweeps' cost constant per new thread
+                    self._sweep_at = max(MIN_SWEEP_SHARDS, 2 * len(self._shards))
+        return shard
+
+    def _retire_dead(self):
+        # Caller holds self._lock. Threads that have exited will not write again; fold their shards into the totals
+        live = []
+        for shard in self._shards:
+            thread = shard.thread()
+            if thread is not None and thread.is_alive():
+                live.append(shard)
+            else:
+                _add(self._retired, shard)
+        self._shards = live
+
+    def _merge(self):
+        with self._lock:
+            self._retire_dead()
+            merged = _Shard(threading.current_thread())
+            _add(merged, self._retired)
+            for shard in self._shards:
+                _add(merged, shard)
+        return merged.histograms, merged.requests
+
+def _add(target, shard):
+    # Copy first: the owning thread may add keys while this runs
+    for key, counts in list(shard.histograms.items()):
+        total = target.histograms.get(key)
+        if total is None:
+            target.histograms[key] = list(counts)
+        else:
+            for i, value in enumerate(counts):
+                total[i] += value
+    for key, count in list(shard.requests.items()):
+        target.requests[key] = target.requests.get(key, 0) + count
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_gauges(prefix, stats, label=None):
+    """Prometheus gauges for the numbers in a get_stats() dict.
+
+    With a label, stats maps each label value to its own dict, e.g. the
+    inference pool's {service: {...}} with label='service'.
+    """
+    rows = {None: stats} if label is None else stats
+    samples = {}
+    for label_value, values in rows.items():
+        for key, value in values.items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            labels = '' if label is None else f'{{{label}="{_escape(label_value)}"}}'
+            samples.setdefault(f'{prefix}_{key}', []).append(f'{prefix}_{key}{labels} {value}')
+    lines = []
+    for name, metric_samples in samples.items():
+        lines.append(f'# TYPE {name} gauge')
+        lines.extend(metric_samples)
+    return lines
+
+# Shared by every module of the process
+metrics = LatencyMetrics()
+stage = metrics.stage
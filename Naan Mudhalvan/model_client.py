@@ -0,0 +1,131 @@
+"""Thin client for model_server.py.
+
+Service proxies mirror the methods of the local objects they replace, so the
+web apps use e.g. text_analyzer.analyze(text) the same way whether the model
+is loaded in-process or shared through the model server.
+"""
+import itertools
+import logging
+import queue
+import socket
+import threading
+
+from model_protocol import CALL, CHUNK, END, ERROR, ProtocolError, send_frame, recv_frame
+
+logger = logging.getLogger(__name__)
+
+class ModelServerError(Exception):
+    """An exception raised by the model itself, re-raised in the client"""
+
+class InferenceBusyError(Exception):
+    """The model's inference queue is full; retry after retry_after seconds"""
+
+    def __init__(self, service, retry_after):
+        super().__init__(f"The {service} model is busy")
+        self.service = service
+        self.retry_after = retry_after
+        # JSON error body for the web apps and background jobs
+        self.details = {'error': 'The analysis service is busy, please try again shortly', 'retry_after': retry_after}
+
+class ModelClient:
+    def __init__(self, socket_path, timeout=300.0, max_idle=16):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._idle = queue.LifoQueue(maxsize=max_idle)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def call(self, service, method, *args, **kwargs):
+        """Call a model method; streamed results come back as a generator"""
+        connection = self._acquire()
+        with self._lock:
+            request_id = next(self._ids) & 0xFFFFFFFF
+        try:
+            send_frame(connection, CALL, request_id, [service, method, list(args), kwargs])
+            frame_type, _, value = self._receive(connection)
+        except BaseException:
+            connection.close()
+            raise
+
+        if frame_type == CHUNK:
+            return self._stream(connection, value)
+        self._release(connection)
+        if frame_type == END:
+            # A streamed result that produced nothing
+            return iter(())
+        if frame_type == ERROR:
+            if value.get('retry_after') is not None:
+                raise InferenceBusyError(service, value['retry_after'])
+            raise ModelServerError(f"{value['type']}: {value['message']}")
+        return value
+
+    def service(self, name):
+        return RemoteService(self, name)
+
+    def _stream(self, connection, first):
+        finished = False
+        try:
+            yield first
+            while True:
+                frame_type, _, value = self._receive(connection)
+                if frame_type == END:
+                    finished = True
+                    return
+                if frame_type == ERROR:
+                    finished = True
+                    raise ModelServerError(f"{value['type']}: {value['message']}")
+                yield value
+        finally:
+            if finished:
+                self._release(connection)
+            else:
+                # Abandoned mid-stream: closing the connection tells the server to stop
+                connection.close()
+
+    def _receive(self, connection):
+        frame = recv_frame(connection)
+        if frame is None:
+            raise ProtocolError("Model server closed the connection")
+        return frame
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            connection.settimeout(self.timeout)
+            connection.connect(self.socket_path)
+            return connection
+
+    def _release(self, connection):
+        try:
+            self._idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+class RemoteService:
+    """Proxy whose method calls run on the model server"""
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, method):
+        if method.startswith('_'):
+            raise AttributeError(method)
+
+        def remote_method(*args, **kwargs):
+            return self._client.call(self._name, method, *args, **kwargs)
+        remote_method.__name__ = method
+        return remote_method
+
+class RemoteEncoder(RemoteService):
+    """SentenceEncoder stand-in for QAIndex; the encoder weights stay in the model server"""
+
+    def __init__(self, client):
+        super().__init__(client, 'encoder')
+        self.name = client.call('encoder', 'name')
+
+    def load(self):
+        # The model server loads the encoder when it starts; not a remote method
+        pass
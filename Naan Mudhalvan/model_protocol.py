@@ -0,0 +1,155 @@
+"""Wire format shared by model_server.py and model_client.py.
+
+Every message is a frame: a 9-byte header (frame type, request id, payload
+length) followed by the payload. Payloads use a small tagged binary encoding
+of None, bools, ints, floats, strings, bytes, lists, dicts and NumPy arrays, so
+images and audio travel as raw bytes and embeddings as raw float32 buffers
+rather than as JSON text.
+"""
+import struct
+
+import numpy as np
+
+HEADER = struct.Struct('!BII')
+
+# Frame types
+CALL = 1      # payload: [service, method, args, kwargs]
+RESULT = 2    # payload: return value
+CHUNK = 3     # payload: one item of a streamed result
+END = 4       # end of a streamed result, empty payload
+ERROR = 5     # payload: {'type': ..., 'message': ...}
+
+MAX_PAYLOAD = 256 * 1024 * 1024
+
+_INT = struct.Struct('!q')
+_FLOAT = struct.Struct('!d')
+_LENGTH = struct.Struct('!I')
+
+class ProtocolError(Exception):
+    pass
+
+def encode(value):
+    parts = []
+    _encode(value, parts)
+    return b''.join(parts)
+
+def _encode(value, parts):
+    if value is None:
+        parts.append(b'N')
+    elif value is True:
+        parts.append(b'T')
+    elif value is False:
+        parts.append(b'F')
+    elif isinstance(value, np.ndarray):
+        array = np.ascontiguousarray(value)
+        dtype = array.dtype.str.encode('ascii')
+        parts.append(b'a' + bytes([len(dtype), array.ndim]) + dtype)
+        parts.append(struct.pack(f'!{array.ndim}I', *array.shape))
+        parts.append(_LENGTH.pack(array.nbytes))
+        parts.append(array.tobytes())
+    elif isinstance(value, np.generic):
+        _encode(value.item(), parts)
+    elif isinstance(value, int):
+        parts.append(b'i' + _INT.pack(value))
+    elif isinstance(value, float):
+        parts.append(b'd' + _FLOAT.pack(value))
+    elif isinstance(value, str):
+        data = value.encode('utf-8')
+        parts.append(b's' + _LENGTH.pack(len(data)) + data)
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        data = bytes(value)
+        parts.append(b'b' + _LENGTH.pack(len(data)) + data)
+    elif isinstance(value, (list, tuple)):
+        parts.append(b'l' + _LENGTH.pack(len(value)))
+        for item in value:
+            _encode(item, parts)
+    elif isinstance(value, dict):
+        parts.append(b'm' + _LENGTH.pack(len(value)))
+        for key, item in value.items():
+            _encode(key, parts)
+            _encode(item, parts)
+    else:
+        raise ProtocolError(f"Cannot encode {type(value).__name__}")
+
+def decode(data):
+    value, offset = _decode(memoryview(data), 0)
+    if offset != len(data):
+        raise ProtocolError("Trailing bytes after payload")
+    return value
+
+def _decode(data, offset):
+    tag = data[offset:offset + 1].tobytes()
+    offset += 1
+    if tag == b'N':
+        return None, offset
+    if tag == b'T':
+        return True, offset
+    if tag == b'F':
+        return False, offset
+    if tag == b'i':
+        return _INT.unpack_from(data, offset)[0], offset + _INT.size
+    if tag == b'd':
+        return _FLOAT.unpack_from(data, offset)[0], offset + _FLOAT.size
+    if tag in (b's', b'b'):
+        length = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        raw = data[offset:offset + length].tobytes()
+        return (raw.decode('utf-8') if tag == b's' else raw), offset + length
+    if tag == b'l':
+        count = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        items = []
+        for _ in range(count):
+            item, offset = _decode(data, offset)
+            items.append(item)
+        return items, offset
+    if tag == b'm':
+        count = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        items = {}
+        for _ in range(count):
+            key, offset = _decode(data, offset)
+            items[key], offset = _decode(data, offset)
+        return items, offset
+    if tag == b'a':
+        dtype_length, ndim = data[offset], data[offset + 1]
+        offset += 2
+        dtype = np.dtype(data[offset:offset + dtype_length].tobytes().decode('ascii'))
+        offset += dtype_length
+        shape = struct.unpack_from(f'!{ndim}I', data, offset)
+        offset += 4 * ndim
+        nbytes = _LENGTH.unpack_from(data, offset)[0]
+        offset += _LENGTH.size
+        array = np.frombuffer(data[offset:offset + nbytes], dtype=dtype).reshape(shape).copy()
+        return array, offset + nbytes
+    raise ProtocolError(f"Unknown tag {tag!r}")
+
+def send_frame(sock, frame_type, request_id, value=None):
+    payload = encode(value) if frame_type != END else b''
+    sock.sendall(HEADER.pack(frame_type, request_id, len(payload)) + payload)
+
+def recv_frame(sock):
+    """Read one frame; returns (frame_type, request_id, value) or None on a clean EOF"""
+    header = _recv_exactly(sock, HEADER.size)
+    if header is None:
+        return None
+    frame_type, request_id, length = HEADER.unpack(header)
+    if length > MAX_PAYLOAD:
+        raise ProtocolError(f"Frame of {length} bytes exceeds the limit")
+    payload = _recv_exactly(sock, length) if length else b''
+    if payload is None:
+        raise ProtocolError("Connection closed mid-frame")
+    return frame_type, request_id, (decode(payload) if length else None)
+
+def _recv_exactly(sock, size):
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            if received == 0:
+                return None
+            raise ProtocolError("Connection closed mid-frame")
+        received += count
+    return bytes(buffer)
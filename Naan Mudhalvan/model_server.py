@@ -0,0 +1,229 @@
+"""Local model server: loads every model once per node and serves them over a Unix socket.
+
+    python model_server.py [--socket /tmp/naan-mudhalvan-models.sock] [--services text,visual,...]
+
+Start it before the web apps and set MODEL_SERVER_SOCKET to the same path;
+app.py, chatbot.py and any number of web workers then call the models through
+model_client.py instead of loading their own copies of the weights.
+
+With --workers (or INFERENCE_WORKERS), e.g. 'whisper=1,visual=2', those models
+run in inference worker processes with bounded queues instead (see
+inference_pool.py), and a full queue is reported to clients as busy.
+
+Audio methods take file paths, so clients must run on the same node (which a
+Unix socket implies anyway).
+"""
+import argparse
+import inspect
+import logging
+import os
+import socketserver
+import traceback
+
+from dotenv import load_dotenv
+
+from model_protocol import CALL, RESULT, CHUNK, END, ERROR, ProtocolError, send_frame, recv_frame
+from inference_pool import InferencePool, parse_worker_counts
+from structured_logging import configure_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = '/tmp/naan-mudhalvan-models.sock'
+
+# Methods each service exposes to clients
+SERVICE_METHODS = {
+    'text': {'analyze', 'analyze_questionnaire'},
+    'voice': {'detect_emotion'},
+    'whisper': {'transcribe'},
+    'visual': {'analyze', 'analyze_batch', 'get_status'},
+    'encoder': {'encode', 'name'},
+    'chat': {'stream', 'get_stats'},
+    'pool': {'get_stats', 'get_readiness'}
+}
+
+def _load_text():
+    from text_analyzer import TextAnalyzer
+    return TextAnalyzer()
+
+def _load_voice():
+    from emotion_detector import EmotionDetector
+    return EmotionDetector()
+
+def _load_whisper():
+    import whisper
+    return whisper.load_model("base")
+
+def _load_visual():
+    from visual_analyzer import VisualAnalyzer
+    return VisualAnalyzer(background_warmup=os.getenv('VISUAL_BACKGROUND_WARMUP', '0') == '1')
+
+def _load_encoder():
+    from semantic_index import SentenceEncoder
+    encoder = SentenceEncoder()
+    # Load the weights now rather than on the first client request
+    encoder.encode(['warm up'])
+    return encoder
+
+def _load_chat():
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+    from generation_scheduler import create_chat_generator
+    tokenizer = AutoTokenizer.from_pretrained("microsoft/DialoGPT-medium")
+    model = AutoModelForCausalLM.from_pretrained("microsoft/DialoGPT-medium")
+    return create_chat_generator(tokenizer, model)
+
+SERVICE_LOADERS = {
+    'text': _load_text,
+    'voice': _load_voice,
+    'whisper': _load_whisper,
+    'visual': _load_visual,
+    'encoder': _load_encoder,
+    'chat': _load_chat
+}
+
+def load_services(names):
+    services = {}
+    for name in names:
+        try:
+            logger.info(f"Loading {name} service...")
+            services[name] = SERVICE_LOADERS[name]()
+            logger.info(f"{name} service loaded successfully")
+        except Exception as e:
+            logger.error(f"Failed to load {name} service: {str(e)}")
+            logger.error(traceback.format_exc())
+    return services
+
+class _ConnectionHandler(socketserver.BaseRequestHandler):
+    """Serves one client connection: one call at a time until the client disconnects"""
+
+    def handle(self):
+        while True:
+            try:
+                frame = recv_frame(self.request)
+            except (ProtocolError, OSError) as e:
+                logger.warning(f"Dropping model client connection: {str(e)}")
+                return
+            if frame is None:
+                return
+            frame_type, request_id, value = frame
+            if frame_type != CALL:
+                logger.warning(f"Unexpected frame type {frame_type} from model client")
+                return
+            if not self.server.model_server.respond(self.request, request_id, value):
+                return
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class ModelServer:
+    def __init__(self, socket_path, services):
+        self.socket_path = socket_path
+        self.services = services
+        self._server = None
+
+    def serve_forever(self):
+        if os.path.exists(self.socket_path):
+            # Left behind by a previous run
+            os.unlink(self.socket_path)
+        # Only the user running the apps may connect
+        previous_umask = os.umask(0o177)
+        try:
+            self._server = _UnixServer(self.socket_path, _ConnectionHandler)
+        finally:
+            os.umask(previous_umask)
+        self._server.model_server = self
+        logger.info(f"Model server listening on {self.socket_path} with services: {', '.join(self.services)}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            os.unlink(self.socket_path)
+
+    def shutdown(self):
+        if self._server is not None:
+            self._server.shutdown()
+
+    def respond(self, connection, request_id, call):
+        """Run one call and send its result; False if the client went away"""
+        try:
+            service, method, args, kwargs = call
+            result = self.dispatch(service, method, args, kwargs)
+        except Exception as e:
+            return self._send_error(connection, request_id, e)
+
+        try:
+            if not inspect.isgenerator(result):
+                send_frame(connection, RESULT, request_id, result)
+                return True
+            try:
+                for item in result:
+                    send_frame(connection, CHUNK, request_id, item)
+            except OSError:
+                raise
+            except Exception as e:
+                return self._send_error(connection, request_id, e)
+            send_frame(connection, END, request_id)
+            return True
+        except OSError:
+            # Client disconnected; closing the generator stops the work behind it
+            if inspect.isgenerator(result):
+                result.close()
+            return False
+
+    def dispatch(self, service, method, args, kwargs):
+        if service not in self.services:
+            raise LookupError(f"Service '{service}' is not loaded")
+        if method not in SERVICE_METHODS.get(service, ()):
+            raise LookupError(f"Method '{method}' is not exposed by service '{service}'")
+        attribute = getattr(self.services[service], method)
+        return attribute(*args, **kwargs) if callable(attribute) else attribute
+
+    def _send_error(self, connection, request_id, error):
+        payload = {'type': type(error).__name__, 'message': str(error)}
+        if hasattr(error, 'retry_after'):
+            # Queue full in the inference pool; the client answers 429
+            logger.warning(f"Rejected model call: {str(error)}")
+            payload['retry_after'] = error.retry_after
+        else:
+            logger.error(f"Error in model call: {str(error)}")
+        try:
+            send_frame(connection, ERROR, request_id, payload)
+            return True
+        except OSError:
+            return False
+
+if __name__ == '__main__':
+    load_dotenv()
+    parser = argparse.ArgumentParser(description='Serve the app models over a Unix domain socket')
+    parser.add_argument('--socket', default=os.getenv('MODEL_SERVER_SOCKET', DEFAULT_SOCKET))
+    parser.add_argument('--services', default=','.join(SERVICE_LOADERS),
+                        help='Comma-separated services to load')
+    parser.add_argument('--workers', default=os.getenv('INFERENCE_WORKERS', ''),
+                        help="Services to run in inference worker processes, e.g. 'whisper=1,visual=2'")
+    args = parser.parse_args()
+
+    configure_logging(
+        level=os.getenv('LOG_LEVEL', 'INFO'),
+        json_lines=os.getenv('LOG_FORMAT', 'json') == 'json',
+        log_file=os.getenv('LOG_FILE') or None
+    )
+
+    names = [name.strip() for name in args.services.split(',') if name.strip()]
+    unknown = [name for name in names if name not in SERVICE_LOADERS]
+    if unknown:
+        parser.error(f"Unknown services: {', '.join(unknown)}")
+    try:
+        worker_counts = parse_worker_counts(args.workers)
+    except ValueError as e:
+        parser.error(str(e))
+
+    # Pooled services run in their own worker processes; the rest are loaded here
+    services = load_services([name for name in names if name not in worker_counts])
+    if worker_counts:
+        pool = InferencePool(
+            worker_counts,
+            max_queued=int(os.getenv('INFERENCE_QUEUE_SIZE', '8')),
+            threads_per_worker=int(os.getenv('INFERENCE_THREADS', '0')) or None
+        )
+        services.update({name: pool.service(name) for name in worker_counts})
+        services['pool'] = pool
+    ModelServer(args.socket, services).serve_forever()
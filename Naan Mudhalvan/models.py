@@ -16,4 +16,23 @@ class User(UserMixin, db.Model):
         self.password_hash = generate_password_hash(password)
         
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password) 
\ No newline at end of file
+        return check_password_hash(self.password_hash, password)
+
+class UserWellbeing(db.Model):
+    """Rolling per-user aggregates, updated in place on every analysis (one row per user)"""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    # Exponential moving averages of the 0-1 wellbeing score and of each emotion
+    wellbeing_ema = db.Column(db.Float)
+    wellbeing_trend = db.Column(db.Float, default=0.0, nullable=False)
+    last_wellbeing = db.Column(db.Float)
+    happiness_ema = db.Column(db.Float)
+    sadness_ema = db.Column(db.Float)
+    anxiety_ema = db.Column(db.Float)
+    anger_ema = db.Column(db.Float)
+    calm_ema = db.Column(db.Float)
+    # Number of analyses per modality
+    text_count = db.Column(db.Integer, default=0, nullable=False)
+    audio_count = db.Column(db.Integer, default=0, nullable=False)
+    visual_count = db.Column(db.Integer, default=0, nullable=False)
+    questionnaire_count = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
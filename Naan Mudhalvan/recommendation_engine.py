@@ -1,3 +1,72 @@
+import numpy as np
+
+# Fixed feature vector every analysis is reduced to before rules are evaluated
+FEATURES = [
+    'wellbeing',            # mental health score normalized to 0-1 (higher is better)
+    'happiness',
+    'sadness',
+    'anxiety',
+    'anger',
+    'calm',
+    'depression',
+    'negative_expression',  # 1.0 if mental_health_indicators.facial_expression == 'negative'
+    'poor_eye_contact',     # 1.0 if mental_health_indicators.eye_contact == 'poor'
+    # Per-user rolling aggregates from WellbeingTracker (NaN without history)
+    'history_wellbeing',
+    'history_trend',
+    'history_anxiety',
+    'history_sadness',
+    'history_sessions'
+]
+FEATURE_INDEX = {name: i for i, name in enumerate(FEATURES)}
+
+# Score ranges produced by the analyzers, used to put every score on 0-1
+SCORE_SCALES = {
+    'mental_health_score': (5, 25),   # TextAnalyzer.analyze, VisualAnalyzer
+    'overall_score': (0, 30)          # TextAnalyzer.analyze_questionnaire
+}
+
+# Declarative rule table. A rule fires when all of its conditions hold;
+# conditions on missing features (NaN) never hold.
+RULES = [
+    {'id': 'priority_high', 'when': [('wellbeing', '<', 0.3)], 'priority': 'high_priority'},
+    {'id': 'priority_medium', 'when': [('wellbeing', '>=', 0.3), ('wellbeing', '<', 0.6)], 'priority': 'medium_priority'},
+    {'id': 'priority_low', 'when': [('wellbeing', '>=', 0.6)], 'priority': 'low_priority'},
+    # Consistently low results raise the priority even if today's analysis looks better
+    {'id': 'history_low', 'when': [('history_wellbeing', '<', 0.3), ('history_sessions', '>=', 3)],
+     'priority': 'high_priority'},
+    {'id': 'negative_expression', 'when': [('negative_expression', '>', 0.5)], 'personalized': [
+        "Practice positive self-talk and affirmations",
+        "Try smiling more, even if you don't feel like it"
+    ]},
+    {'id': 'poor_eye_contact', 'when': [('poor_eye_contact', '>', 0.5)], 'personalized': [
+        "Practice maintaining eye contact in conversations",
+        "Consider joining a social skills group"
+    ]},
+    {'id': 'anxiety', 'when': [('anxiety', '>', 0.5)], 'personalized': [
+        "Try progressive muscle relaxation exercises",
+        "Practice grounding techniques when feeling anxious"
+    ]},
+    {'id': 'depression', 'when': [('depression', '>', 0.5)], 'personalized': [
+        "Set small, achievable daily goals",
+        "Try to maintain a regular daily routine"
+    ]},
+    {'id': 'history_declining', 'when': [('history_trend', '<', -0.05), ('history_sessions', '>=', 3)], 'personalized': [
+        "Your recent check-ins show a downward trend; consider talking to someone you trust or a professional"
+    ]},
+    {'id': 'history_improving', 'when': [('history_trend', '>', 0.05), ('history_sessions', '>=', 3)], 'personalized': [
+        "Your recent check-ins are improving; keep up the routines that are helping"
+    ]},
+    {'id': 'history_anxiety', 'when': [('history_anxiety', '>', 0.5), ('history_sessions', '>=', 3)], 'personalized': [
+        "Anxiety has been elevated across your recent sessions; a daily relaxation practice may help"
+    ]},
+    {'id': 'history_sadness', 'when': [('history_sadness', '>', 0.5), ('history_sessions', '>=', 3)], 'personalized': [
+        "Sadness has persisted across your recent sessions; scheduling enjoyable activities can help"
+    ]}
+]
+
+OPERATORS = ['<', '<=', '>', '>=', '==']
+
 class RecommendationEngine:
     def __init__(self):
         self.recommendation_categories = {
@@ -54,68 +123,151 @@ class RecommendationEngine:
             }
         }
 
-    def get_recommendations(self, analysis):
-        # Extract mental health score from analysis
-        mental_health_score = analysis.get('mental_health_score', 50)
-        
-        # Determine priority level based on mental health score
-        priority = self._determine_priority(mental_health_score)
-        
-        # Get recommendations for each category
-        recommendations = {
+        # Compiled once; every call only evaluates arrays
+        self._compile_rules(RULES)
+
+    def get_recommendations(self, analysis, history=None):
+        """Recommendations for one analysis (plus optional WellbeingTracker aggregates)"""
+        return self.get_recommendations_batch([analysis], [history])[0]
+
+    def get_recommendations_batch(self, analyses, histories=None):
+        """Recommendations for many analyses (dicts, or an (n, len(FEATURES)) array) in one pass"""
+        if isinstance(analyses, np.ndarray):
+            features = analyses.astype(np.float64, copy=False)
+        else:
+            histories = histories or [None] * len(analyses)
+            features = np.array(
+                [self.extract_features(analysis, history) for analysis, history in zip(analyses, histories)],
+                dtype=np.float64
+            )
+        if len(features) == 0:
+            return []
+
+        matches = self._evaluate(features)
+
+        # Rows that fire the same rules get the same (cached) output
+        signatures = np.packbits(matches, axis=1)
+        results = []
+        for row, signature in zip(matches, signatures):
+            key = signature.tobytes()
+            output = self._output_cache.get(key)
+            if output is None:
+                output = self._format_output(row)
+                self._output_cache[key] = output
+            # A fresh dict and lists per result, so a caller editing its answer can't change the cached one
+            results.append({category: list(items) for category, items in output.items()})
+        return results
+
+    def clear_cache(self):
+        """Forget the formatted outputs, e.g. to time the uncached path"""
+        self._output_cache = {}
+
+    def extract_features(self, analysis, history=None):
+        """Reduce an analysis dict from any analyzer (and user history) to the fixed feature vector"""
+        vector = np.full(len(FEATURES), np.nan)
+        score = self.normalized_score(analysis)
+        # No usable score: the rules treat it as medium priority
+        vector[FEATURE_INDEX['wellbeing']] = 0.5 if score is None else score
+
+        emotions = analysis.get('emotions') or self._nested_text_analysis(analysis).get('emotions') or {}
+        for name in ('happiness', 'sadness', 'anxiety', 'anger', 'calm', 'depression'):
+            if name in emotions:
+                vector[FEATURE_INDEX[name]] = emotions[name]
+
+        indicators = analysis.get('mental_health_indicators') or {}
+        if 'facial_expression' in indicators:
+            vector[FEATURE_INDEX['negative_expression']] = float(indicators['facial_expression'] == 'negative')
+        if 'eye_contact' in indicators:
+            vector[FEATURE_INDEX['poor_eye_contact']] = float(indicators['eye_contact'] == 'poor')
+
+        if history:
+            history_values = {
+                'history_wellbeing': history.get('wellbeing'),
+                'history_trend': history.get('trend'),
+                'history_anxiety': history['emotions'].get('anxiety'),
+                'history_sadness': history['emotions'].get('sadness'),
+                'history_sessions': history.get('sessions')
+            }
+            for name, value in history_values.items():
+                if value is not None:
+                    vector[FEATURE_INDEX[name]] = value
+        return vector
+
+    def normalized_score(self, analysis):
+        """The analysis's score on 0-1, or None if it has none or only a placeholder one"""
+        # Audio results carry their score inside the transcription's text analysis
+        for source in (analysis, self._nested_text_analysis(analysis)):
+            if source.get('fallback'):
+                return None
+            for key, (low, high) in SCORE_SCALES.items():
+                score = source.get(key)
+                if isinstance(score, (int, float)):
+                    return min(1.0, max(0.0, (score - low) / (high - low)))
+        return None
+
+    def is_fallback(self, analysis):
+        """True when the analysis (or an audio result's text analysis) failed and holds placeholder scores"""
+        return bool(analysis.get('fallback') or self._nested_text_analysis(analysis).get('fallback'))
+
+    def _nested_text_analysis(self, analysis):
+        text_analysis = analysis.get('text_analysis') or {}
+        return text_analysis.get('text_analysis') or {}
+
+    def _compile_rules(self, rules):
+        """Flatten the rule table into arrays so all rules are evaluated with a few NumPy ops"""
+        self.rules = rules
+        condition_features, condition_operators, condition_thresholds, condition_rules = [], [], [], []
+        for rule_index, rule in enumerate(rules):
+            for feature, operator, threshold in rule['when']:
+                condition_features.append(FEATURE_INDEX[feature])
+                condition_operators.append(OPERATORS.index(operator))
+                condition_thresholds.append(threshold)
+                condition_rules.append(rule_index)
+
+        self._condition_features = np.array(condition_features, dtype=np.intp)
+        self._condition_thresholds = np.array(condition_thresholds, dtype=np.float64)
+        self._operator_masks = np.array([
+            [op == i for op in condition_operators] for i in range(len(OPERATORS))
+        ], dtype=bool)
+        # condition -> rule incidence matrix; a rule matches when none of its conditions fail
+        self._condition_to_rule = np.zeros((len(condition_rules), len(rules)), dtype=np.int32)
+        self._condition_to_rule[np.arange(len(condition_rules)), condition_rules] = 1
+        self._output_cache = {}
+
+    def _evaluate(self, features):
+        values = features[:, self._condition_features]
+        thresholds = self._condition_thresholds
+        with np.errstate(invalid='ignore'):
+            holds = (
+                (self._operator_masks[0] & (values < thresholds)) |
+                (self._operator_masks[1] & (values <= thresholds)) |
+                (self._operator_masks[2] & (values > thresholds)) |
+                (self._operator_masks[3] & (values >= thresholds)) |
+                (self._operator_masks[4] & (values == thresholds))
+            )
+        failures = (~holds).astype(np.int32) @ self._condition_to_rule
+        return failures == 0
+
+    def _format_output(self, matched):
+        priority = 'medium_priority'
+        personalized = []
+        for rule, fired in zip(self.rules, matched):
+            if not fired:
+                continue
+            if 'priority' in rule:
+                priority = rule['priority']
+            personalized.extend(rule.get('personalized', []))
+
+        return {
             'immediate_actions': self._get_category_recommendations('immediate_actions', priority),
             'lifestyle_changes': self._get_category_recommendations('lifestyle_changes', priority),
-            'professional_help': self._get_category_recommendations('professional_help', priority)
+            'professional_help': self._get_category_recommendations('professional_help', priority),
+            'personalized': personalized
         }
-        
-        # Add personalized recommendations based on specific indicators
-        personalized_recommendations = self._get_personalized_recommendations(analysis)
-        recommendations['personalized'] = personalized_recommendations
-        
-        return recommendations
-
-    def _determine_priority(self, score):
-        if score < 30:
-            return 'high_priority'
-        elif score < 60:
-            return 'medium_priority'
-        else:
-            return 'low_priority'
 
     def _get_category_recommendations(self, category, priority):
         return self.recommendation_categories[category][priority]
 
-    def _get_personalized_recommendations(self, analysis):
-        personalized = []
-        
-        # Check for specific indicators in the analysis
-        if 'mental_health_indicators' in analysis:
-            indicators = analysis['mental_health_indicators']
-            
-            # Add recommendations based on facial expression
-            if 'facial_expression' in indicators:
-                if indicators['facial_expression'] == 'negative':
-                    personalized.append("Practice positive self-talk and affirmations")
-                    personalized.append("Try smiling more, even if you don't feel like it")
-            
-            # Add recommendations based on eye contact
-            if 'eye_contact' in indicators:
-                if indicators['eye_contact'] == 'poor':
-                    personalized.append("Practice maintaining eye contact in conversations")
-                    personalized.append("Consider joining a social skills group")
-        
-        # Add recommendations based on emotions
-        if 'emotions' in analysis:
-            emotions = analysis['emotions']
-            if 'anxiety' in emotions and emotions['anxiety'] > 0.5:
-                personalized.append("Try progressive muscle relaxation exercises")
-                personalized.append("Practice grounding techniques when feeling anxious")
-            if 'depression' in emotions and emotions['depression'] > 0.5:
-                personalized.append("Set small, achievable daily goals")
-                personalized.append("Try to maintain a regular daily routine")
-        
-        return personalized
-
     def format_recommendations(self, recommendations):
         formatted = {
             'summary': "Based on your analysis, here are some recommendations to support your mental health:",
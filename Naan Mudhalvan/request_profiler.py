@@ -0,0 +1,251 @@
+"""On-demand sampling profiler for live requests.
+
+An admin arms a session for one route (or '*' for every route), covering its
+next N requests, a time window, or whichever ends first. While a profiled
+request runs, a background thread samples the Python stack of every thread
+working on it every few milliseconds: the request thread, the inference
+threads it awaits in asgi_app.py, and the job worker of a background job.
+When the session ends, the samples are written to the output directory as
+collapsed stacks (one 'outer;...;inner count' line per stack, the input of
+flamegraph.pl and speedscope) and a summary of the busiest functions.
+
+With no session armed, a request only pays for one attribute check. Models
+running in a model server or inference pool process are outside this process
+and show up as the wait for their reply.
+"""
+import collections
+import contextlib
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+_current_session = contextvars.ContextVar('profile_session', default=None)
+
+class ProfilerBusyError(Exception):
+    pass
+
+class ProfileSession:
+    def __init__(self, route, requests, seconds, interval):
+        self.session_id = time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+        self.route = route
+        self.interval = interval
+        # Requests still to profile; None when only the time window applies
+        self.remaining = requests
+        self.deadline = time.monotonic() + seconds
+        self.started = time.time()
+        self.finished = None
+        self.stopped = False
+        self.profiled = 0
+        self.in_flight = 0
+        # Thread ident -> number of profiled requests that thread is working for
+        self.threads = {}
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.files = []
+        self.sampler = None
+
+    def admitting(self, now):
+        return not self.stopped and self.remaining != 0 and now < self.deadline
+
+    def done(self, now):
+        return self.stopped or now >= self.deadline or (self.remaining == 0 and self.in_flight == 0)
+
+    def get_stats(self):
+        return {
+            'session_id': self.session_id,
+            'route': self.route,
+            'state': 'finished' if self.finished else 'running',
+            'requests_profiled': self.profiled,
+            'requests_remaining': self.remaining,
+            'in_flight': self.in_flight,
+            'samples': self.samples,
+            'interval_ms': self.interval * 1000,
+            'started': self.started,
+            'finished': self.finished,
+            'files': self.files
+        }
+
+class RequestProfiler:
+    def __init__(self, output_dir, interval=0.005, max_seconds=600, top=40):
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.top = top
+        self.last = None
+        self._session = None
+        self._lock = threading.Lock()
+
+    def start(self, route, requests=None, seconds=None):
+        """Profile the route's next `requests` requests and/or the next `seconds` seconds"""
+        if not requests and not seconds:
+            raise ValueError("Give a number of requests or of seconds to profile")
+        # A negative count would never reach zero and leave the session running for max_seconds
+        if requests is not None and requests < 1:
+            raise ValueError("The number of requests must be positive")
+        if seconds is not None and not seconds > 0:
+            raise ValueError("The number of seconds must be positive")
+        seconds = min(seconds or self.max_seconds, self.max_seconds)
+        with self._lock:
+            if self._session is not None:
+                raise ProfilerBusyError(f"Profiling session {self._session.session_id} is still running")
+            session = self._session = self.last = ProfileSession(route, requests or None, seconds, self.interval)
+        session.sampler = threading.Thread(target=self._sample, args=(session,),
+                                           name='request-profiler', daemon=True)
+        session.sampler.start()
+        logger.info(f"Profiling route {route} (requests: {requests}, seconds: {seconds}) as {session.session_id}")
+        return session.get_stats()
+
+    def stop(self):
+        """End the running session now and write what it sampled; returns its stats"""
+        session = self._session
+        if session is None:
+            return None
+        session.stopped = True
+        session.sampler.join(timeout=30)
+        return session.get_stats()
+
+    def get_status(self):
+        session = self.last
+        return session.get_stats() if session is not None else None
+
+    def begin(self, route, track_thread=True):
+        """Start profiling this request if a session wants it; pass a non-None result to end()"""
+        session = self._session
+        if session is None or session.route not in (route, '*'):
+            return None
+        ident = threading.get_ident() if track_thread else None
+        with self._lock:
+            if not session.admitting(time.monotonic()):
+                return None
+            if session.remaining is not None:
+                session.remaining -= 1
+            session.profiled += 1
+            session.in_flight += 1
+            if ident is not None:
+                session.threads[ident] = session.threads.get(ident, 0) + 1
+        return session, _current_session.set(session), ident
+
+    def end(self, handle):
+        session, token, ident = handle
+        try:
+            _current_session.reset(token)
+        except ValueError:
+            # A streamed response can finish in a different context than it started in
+            _current_session.set(None)
+        with self._lock:
+            if ident is not None:
+                self._detach(session, ident)
+            session.in_flight -= 1
+
+    @contextlib.contextmanager
+    def profiling(self, route):
+        """Profile a unit of work outside a web request, e.g. a background job"""
+        handle = self.begin(route)
+        try:
+            yield
+        finally:
+            if handle is not None:
+                self.end(handle)
+
+    @contextlib.contextmanager
+    def attached(self):
+        """Sample this thread too while it works for the current profiled request, e.g. an inference thread"""
+        session = _current_session.get()
+        if session is None:
+            yield
+            return
+        ident = threading.get_ident()
+        with self._lock:
+            session.threads[ident] = session.threads.get(ident, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._detach(session, ident)
+
+    def _detach(self, session, ident):
+        # Caller holds self._lock
+        depth = session.threads.get(ident, 0) - 1
+        if depth > 0:
+            session.threads[ident] = depth
+        else:
+            session.threads.pop(ident, None)
+
+    def _sample(self, session):
+        while True:
+            time.sleep(session.interval)
+            with self._lock:
+                if session.done(time.monotonic()):
+                    self._session = None
+                    break
+                idents = list(session.threads)
+            if not idents:
+                continue
+            frames = sys._current_frames()
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    session.stacks[_collapse(frame)] += 1
+                    session.samples += 1
+            del frames, frame
+        try:
+            self._write(session)
+        except OSError as e:
+            logger.error(f"Error writing profile {session.session_id}: {str(e)}")
+        session.finished = time.time()
+        logger.info(f"Profiling session {session.session_id} finished: {session.profiled} requests, {session.samples} samples")
+
+    def _write(self, session):
+        os.makedirs(self.output_dir, exist_ok=True)
+        base = os.path.join(self.output_dir, f"{session.session_id}-{re.sub(r'[^A-Za-z0-9_.-]', '_', session.route)}")
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            for stack, count in session.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+        with open(base + '.top.txt', 'w', encoding='utf-8') as f:
+            f.write(format_summary(session, self.top))
+        session.files = [base + '.collapsed', base + '.top.txt']
+
+def _frame_name(frame):
+    code = frame.f_code
+    path = code.co_filename.replace('\\', '/')
+    # Library frames keep their package path, app frames just the file name
+    path = path.split('site-packages/')[-1] if 'site-packages/' in path else os.path.basename(path)
+    return f'{code.co_name} ({path}:{code.co_firstlineno})'
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame).replace(';', ':'))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def top_functions(stacks):
+    """Samples per function: own (it was running) and total (it was on the stack)"""
+    own = collections.Counter()
+    total = collections.Counter()
+    for stack, count in stacks.items():
+        names = stack.split(';')
+        own[names[-1]] += count
+        for name in set(names):
+            total[name] += count
+    return own, total
+
+def format_summary(session, top):
+    own, total = top_functions(session.stacks)
+    samples = max(session.samples, 1)
+    lines = [
+        f"Profile {session.session_id} of route {session.route}: {session.profiled} requests, "
+        f"{session.samples} samples every {session.interval * 1000:g} ms",
+    ]
+    for title, counts in (('Own time', own), ('Total time', total)):
+        lines += ['', f'{title}:', f"{'samples':>8} {'%':>6}  function"]
+        for name, count in counts.most_common(top):
+            lines.append(f'{count:>8} {count * 100 / samples:>6.1f}  {name}')
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,145 @@
+"""Semantic retrieval over the mental-health Q&A table.
+
+Every question is embedded once with a small sentence encoder and kept in one
+contiguous, L2-normalized float32 matrix, so answering a message is a single
+matrix-vector product followed by a top-k selection. The matrix is saved next to
+a fingerprint of the table and the encoder; a restart with the same table loads
+it instead of embedding everything again.
+"""
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODER = 'sentence-transformers/all-MiniLM-L6-v2'
+
+class SentenceEncoder:
+    """Mean-pooled transformer sentence embeddings (MiniLM by default), loaded by load() or on first use"""
+
+    def __init__(self, model_name=None, max_length=64):
+        self.name = model_name or os.getenv('QA_ENCODER_MODEL', DEFAULT_ENCODER)
+        self.max_length = max_length
+        self._tokenizer = None
+        self._model = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        """Load the tokenizer and model if not loaded yet; safe to call from several threads"""
+        with self._load_lock:
+            if self._model is not None:
+                return
+            from transformers import AutoModel, AutoTokenizer
+            logger.info(f"Loading sentence encoder {self.name}...")
+            tokenizer = AutoTokenizer.from_pretrained(self.name)
+            model = AutoModel.from_pretrained(self.name)
+            model.eval()
+            self._tokenizer = tokenizer
+            # Set last: encode() takes a non-None model to mean both are ready
+            self._model = model
+
+    def encode(self, texts, batch_size=32):
+        """Embed a list of texts; returns an (n, dim) float32 array"""
+        import torch
+        if self._model is None:
+            self.load()
+        if not texts:
+            return np.zeros((0, self._model.config.hidden_size), dtype=np.float32)
+        batches = []
+        for i in range(0, len(texts), batch_size):
+            inputs = self._tokenizer(
+                texts[i:i + batch_size], padding=True, truncation=True,
+                max_length=self.max_length, return_tensors='pt'
+            )
+            with torch.inference_mode():
+                hidden = self._model(**inputs).last_hidden_state
+            # Average the token vectors, ignoring padding
+            mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            pooled = (hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1e-9)
+            batches.append(pooled.numpy().astype(np.float32))
+        return np.concatenate(batches)
+
+class QAIndex:
+    def __init__(self, qa_table, encoder=None, index_path=None, min_score=0.45):
+        self.encoder = encoder or SentenceEncoder()
+        self.index_path = index_path
+        self.min_score = min_score
+
+        # One entry per question: (topic, question, answer)
+        self.entries = [
+            (topic, question, answer)
+            for topic, questions in qa_table.items()
+            for question, answer in questions.items()
+        ]
+        self.fingerprint = self._fingerprint()
+        self.embeddings = self._load() if index_path else None
+        if self.embeddings is None:
+            self.embeddings = self._normalize(self.encoder.encode([self._entry_text(e) for e in self.entries]))
+            if index_path:
+                self._save()
+        else:
+            # The saved index skipped embedding; load the encoder now rather than in the first chat request
+            self.encoder.load()
+
+    def search(self, text, k=3):
+        """Top-k entries for a message as a list of (score, topic, question, answer), best first"""
+        query = self._normalize(self.encoder.encode([text]))[0]
+        scores = self.embeddings @ query
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(float(scores[i]),) + self.entries[i] for i in top]
+
+    def answer(self, text):
+        """Answer of the closest question, or None if nothing is similar enough"""
+        if not self.entries:
+            return None
+        score, topic, question, answer = self.search(text, k=1)[0]
+        if score < self.min_score:
+            return None
+        logger.info(f"Retrieved '{question}' ({topic}) with similarity {score:.2f}")
+        return answer
+
+    def _entry_text(self, entry):
+        topic, question, _ = entry
+        return f"{question} ({topic})"
+
+    def _normalize(self, vectors):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def _fingerprint(self):
+        digest = hashlib.sha256(self.encoder.name.encode('utf-8'))
+        for entry in self.entries:
+            digest.update(b'\0' + self._entry_text(entry).encode('utf-8'))
+        return digest.hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return None
+        try:
+            with np.load(self.index_path) as data:
+                if str(data['fingerprint']) != self.fingerprint:
+                    logger.info("Q&A table or encoder changed, rebuilding the retrieval index")
+                    return None
+                embeddings = np.ascontiguousarray(data['embeddings'], dtype=np.float32)
+            logger.info(f"Loaded retrieval index with {len(embeddings)} questions from {self.index_path}")
+            return embeddings
+        except Exception as e:
+            logger.error(f"Error loading retrieval index: {str(e)}")
+            return None
+
+    def _save(self):
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            # Write then rename so a crash never leaves a truncated index behind
+            temp_path = self.index_path + '.tmp.npz'
+            np.savez(temp_path, embeddings=self.embeddings, fingerprint=np.array(self.fingerprint))
+            os.replace(temp_path, self.index_path)
+            logger.info(f"Saved retrieval index to {self.index_path}")
+        except Exception as e:
+            logger.error(f"Error saving retrieval index: {str(e)}")
@@ -0,0 +1,138 @@
+import collections
+import itertools
+import logging
+import queue
+import threading
+import time
+
+from async_waiters import AsyncWaiters
+
+logger = logging.getLogger(__name__)
+
+class StreamSession:
+    """One browser camera stream: a small drop-oldest frame queue and its latest result"""
+
+    def __init__(self, session_id, user_id, queue_size=2):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.frames = collections.deque(maxlen=queue_size)
+        self.lock = threading.Lock()
+        self.result = None
+        self.result_version = 0
+        self.result_updated = threading.Condition(self.lock)
+        # Async senders of asgi_app.py, woken on a new result and on close
+        self.result_waiters = AsyncWaiters()
+        self.frames_received = 0
+        self.frames_dropped = 0
+        self.frames_analyzed = 0
+        self.scheduled = False
+        self.closed = False
+        self.created_at = time.time()
+
+    def wait_for_result(self, after_version, timeout=None):
+        """Block until a result newer than after_version exists; returns (version, result)"""
+        with self.result_updated:
+            self.result_updated.wait_for(lambda: self.result_version > after_version or self.closed, timeout)
+            return self.result_version, self.result
+
+    def get_stats(self):
+        return {
+            'frames_received': self.frames_received,
+            'frames_dropped': self.frames_dropped,
+            'frames_analyzed': self.frames_analyzed,
+            'queued': len(self.frames)
+        }
+
+class StreamSessionManager:
+    """Per-session frame queues served fairly by one shared pool of analysis threads.
+
+    A session is placed on the run queue at most once. A worker takes a session,
+    analyzes one frame from it, and puts it back at the tail if more frames are
+    waiting, so every active session gets one frame analyzed per turn and a
+    busy session can't block the others.
+    """
+
+    def __init__(self, visual_analyzer, workers=2, queue_size=2):
+        self.visual_analyzer = visual_analyzer
+        self.queue_size = queue_size
+        self.sessions = {}
+        self._lock = threading.Lock()
+        self._run_queue = queue.Queue()
+        self._ids = itertools.count(1)
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f'stream-analysis-{i}')
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def open(self, user_id):
+        session = StreamSession(next(self._ids), user_id, self.queue_size)
+        with self._lock:
+            self.sessions[session.session_id] = session
+        logger.info(f"Opened stream session {session.session_id} for user {user_id}")
+        return session
+
+    def close(self, session):
+        with session.lock:
+            session.closed = True
+            session.frames.clear()
+            session.result_updated.notify_all()
+        session.result_waiters.notify()
+        with self._lock:
+            self.sessions.pop(session.session_id, None)
+        logger.info(f"Closed stream session {session.session_id}: {session.get_stats()}")
+
+    def submit(self, session, frame):
+        """Queue a frame for analysis, dropping the oldest queued frame when full"""
+        with session.lock:
+            if session.closed:
+                return
+            if len(session.frames) == session.frames.maxlen:
+                session.frames_dropped += 1
+            session.frames.append(frame)
+            session.frames_received += 1
+            if session.scheduled:
+                return
+            session.scheduled = True
+        self._run_queue.put(session)
+
+    def latest_for_user(self, user_id):
+        """Most recently created open session of a user, or None"""
+        with self._lock:
+            sessions = [s for s in self.sessions.values() if s.user_id == user_id]
+        return max(sessions, key=lambda s: s.created_at) if sessions else None
+
+    def get_stats(self):
+        with self._lock:
+            sessions = list(self.sessions.values())
+        return {
+            'sessions': len(sessions),
+            'workers': len(self._workers),
+            'run_queue': self._run_queue.qsize(),
+            'frames_dropped': sum(s.frames_dropped for s in sessions)
+        }
+
+    def _work(self):
+        while True:
+            session = self._run_queue.get()
+            with session.lock:
+                frame = session.frames.popleft() if session.frames else None
+            if frame is not None:
+                try:
+                    result = self.visual_analyzer.analyze(frame)
+                except Exception as e:
+                    logger.error(f"Error analyzing stream frame: {str(e)}")
+                    result = None
+            with session.lock:
+                if frame is not None and result is not None and not session.closed:
+                    session.result = result
+                    session.result_version += 1
+                    session.frames_analyzed += 1
+                    session.result_updated.notify_all()
+                requeue = bool(session.frames) and not session.closed
+                session.scheduled = requeue
+            session.result_waiters.notify()
+            if requeue:
+                # Back of the line: other sessions get their turn first
+                self._run_queue.put(session)
@@ -0,0 +1,213 @@
+"""Non-blocking structured logging.
+
+A log call only builds the record and puts it on a queue. A background thread
+formats each record as one JSON line and writes it to stderr and, optionally,
+a UTF-8 log file, so a request never waits on the console or the disk. Pass
+values as arguments (logger.debug("Saved %s", path)) rather than f-strings:
+the message is then only formatted by the writer thread, and not at all for
+records that are dropped. Arguments other than strings, numbers and bytes are
+formatted on the calling thread, before they can change.
+
+While the pipeline is configured, records skip looking up their caller's
+source line and process (logging._srcfile, logging.logProcesses and
+logging.logMultiprocessing, as in the Optimization section of the logging
+HOWTO); no line this module writes shows them. close() restores them.
+
+Debug records are sampled per request. When a request starts, it is picked
+with its route's sample rate, and only picked requests keep their debug lines,
+so the debug log of a sampled request is complete. Records at INFO and above
+are always kept. Every line carries the route and a request id.
+"""
+import atexit
+import contextlib
+import contextvars
+import datetime
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import uuid
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Attributes every LogRecord has; anything else came from extra={...}
+_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'route', 'request_id'}
+
+_current_context = contextvars.ContextVar('log_context', default=None)
+
+# Argument types that cannot change between the log call and the writer thread
+_IMMUTABLE_ARGS = (str, int, float, bool, bytes, type(None))
+
+def parse_sample_rates(spec):
+    """Parse 'default=0.05,analyze_text=1' into {'default': 0.05, 'analyze_text': 1.0}"""
+    rates = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        route, _, rate = item.partition('=')
+        rates[route.strip()] = float(rate)
+    return rates
+
+class _LogContext:
+    __slots__ = ('route', 'request_id', 'debug')
+
+    def __init__(self, route, debug):
+        self.route = route
+        self.request_id = uuid.uuid4().hex[:16]
+        self.debug = debug
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'route': getattr(record, 'route', None),
+            'request_id': getattr(record, 'request_id', None),
+            'thread': record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+class _SamplingFilter(logging.Filter):
+    """Tags records with the current request and drops debug records of unsampled requests"""
+
+    def __init__(self, pipeline):
+        super().__init__()
+        self.pipeline = pipeline
+
+    def filter(self, record):
+        context = _current_context.get()
+        if context is None:
+            record.route = 'background'
+            record.request_id = None
+            return record.levelno > logging.DEBUG or random.random() < self.pipeline.sample_rate('background')
+        record.route = context.route
+        record.request_id = context.request_id
+        return record.levelno > logging.DEBUG or context.debug
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # The stock handler formats the message here, on the caller's thread; leave it to the writer
+        # unless an argument is mutable and could change before the writer gets to it
+        args = record.args if isinstance(record.args, tuple) else (record.args,)
+        if record.args and not all(isinstance(arg, _IMMUTABLE_ARGS) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        return record
+
+    def enqueue(self, record):
+        # Never block a request on a slow writer; count what is lost instead
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # Wait for room so a full queue cannot stop the writer from shutting down
+        self.queue.put(self._sentinel)
+
+class LogPipeline:
+    def __init__(self):
+        self.sample_rates = {}
+        self.handler = None
+        self.listener = None
+        self._sampling = False
+        # Record-creation flags as they were before configure(), restored by close()
+        self._saved_flags = None
+        atexit.register(self.close)
+
+    def configure(self, level='INFO', json_lines=True, log_file=None, sample_rates=None, queue_size=10000):
+        """Route all logging through the queue; replaces handlers set up earlier, e.g. by basicConfig"""
+        self.close()
+        self.sample_rates = dict(sample_rates or {})
+        formatter = JsonFormatter() if json_lines else logging.Formatter(TEXT_FORMAT)
+        writers = [logging.StreamHandler(sys.stderr)]
+        if log_file:
+            writers.append(logging.FileHandler(log_file, encoding='utf-8'))
+        for writer in writers:
+            writer.setFormatter(formatter)
+
+        log_queue = queue.Queue(maxsize=queue_size)
+        self.handler = _QueueHandler(log_queue)
+        self.handler.addFilter(_SamplingFilter(self))
+        self.listener = _QueueListener(log_queue, *writers)
+        self.listener.start()
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+            handler.close()
+        root.addHandler(self.handler)
+        root.setLevel(level)
+        # Looking up the caller's frame and process is the dearest part of a record; the lines carry neither
+        self._saved_flags = (logging._srcfile, logging.logProcesses, logging.logMultiprocessing)
+        logging._srcfile = None
+        logging.logProcesses = False
+        logging.logMultiprocessing = False
+        # Sampling only matters when debug records get as far as the filter
+        self._sampling = root.isEnabledFor(logging.DEBUG)
+
+    def sample_rate(self, route):
+        rate = self.sample_rates.get(route)
+        return self.sample_rates.get('default', 1.0) if rate is None else rate
+
+    def begin_request(self, route):
+        """Tag this request's records and decide whether it keeps debug lines; pass the result to end_request"""
+        debug = self._sampling and random.random() < self.sample_rate(route)
+        return _current_context.set(_LogContext(route, debug))
+
+    def end_request(self, token):
+        try:
+            _current_context.reset(token)
+        except ValueError:
+            # A streamed response can finish in a different context than it started in
+            _current_context.set(None)
+
+    @contextlib.contextmanager
+    def request_logging(self, route):
+        """Tag records of a unit of work outside a web request, e.g. a background job"""
+        token = self.begin_request(route)
+        try:
+            yield
+        finally:
+            self.end_request(token)
+
+    def current_request_id(self):
+        context = _current_context.get()
+        return context.request_id if context is not None else None
+
+    def get_stats(self):
+        if self.handler is None:
+            return {}
+        return {'queued': self.handler.queue.qsize(), 'dropped': self.handler.dropped}
+
+    def close(self):
+        """Write out the queued records and stop the writer thread"""
+        if self.listener is None:
+            return
+        listener, self.listener = self.listener, None
+        listener.stop()
+        for writer in listener.handlers:
+            writer.close()
+        if self._saved_flags is not None:
+            logging._srcfile, logging.logProcesses, logging.logMultiprocessing = self._saved_flags
+            self._saved_flags = None
+
+# Shared by every module of the process
+log_pipeline = LogPipeline()
+configure_logging = log_pipeline.configure
@@ -0,0 +1,39 @@
+import zlib
+
+import numpy as np
+
+from model_client import RemoteEncoder
+from semantic_index import QAIndex
+
+QA_TABLE = {
+    'sleep': {'how can i sleep better': 'Keep a regular bedtime.'},
+    'anxiety': {'what helps with panic': 'Slow breathing helps.'}
+}
+
+class StubModelClient:
+    """Answers like a model server that only exposes the encoder's 'encode' and 'name'"""
+
+    def __init__(self):
+        self.calls = []
+
+    def call(self, service, method, *args, **kwargs):
+        self.calls.append(method)
+        if method == 'name':
+            return 'stub-encoder'
+        if method == 'encode':
+            texts = args[0]
+            return np.array([np.random.default_rng(zlib.crc32(text.encode())).random(8) for text in texts],
+                            dtype=np.float32)
+        raise LookupError(f"Method '{method}' is not exposed by service '{service}'")
+
+def test_saved_index_with_remote_encoder(tmp_path):
+    index_path = str(tmp_path / 'qa_index.npz')
+    first = QAIndex(QA_TABLE, encoder=RemoteEncoder(StubModelClient()), index_path=index_path)
+
+    # The restart loads the saved index instead of embedding the table again
+    client = StubModelClient()
+    second = QAIndex(QA_TABLE, encoder=RemoteEncoder(client), index_path=index_path)
+    assert 'load' not in client.calls
+    assert client.calls == ['name']
+    np.testing.assert_array_equal(first.embeddings, second.embeddings)
+    assert second.answer('how can i sleep better') == 'Keep a regular bedtime.'
@@ -7,6 +7,7 @@ import logging
 import os
 import numpy as np
 from transformers import pipeline
+from metrics import stage
 import random
 
 class TextAnalyzer:
@@ -77,11 +78,14 @@ class TextAnalyzer:
                         'calm': random.uniform(0.3, 0.9)
                     },
                     'mental_health_score': random.randint(8, 22),
-                    'mental_health_status': 'Neutral - No text provided'
+                    'mental_health_status': 'Neutral - No text provided',
+                    # Placeholder scores: kept out of the user's wellbeing history
+                    'fallback': True
                 }
 
             # Get emotion predictions
-            results = self.emotion_analyzer(text)[0]
+            with stage('bertweet'):
+                results = self.emotion_analyzer(text)[0]
             
             # Map the model's emotions to our categories
             emotion_mapping = {
@@ -155,7 +159,8 @@ class TextAnalyzer:
                     'calm': random.uniform(0.3, 0.9)
                 },
                 'mental_health_score': random.randint(8, 22),
-                'mental_health_status': 'Neutral - Error in analysis'
+                'mental_health_status': 'Neutral - Error in analysis',
+                'fallback': True
             }
 
     def _get_mental_health_status(self, score):
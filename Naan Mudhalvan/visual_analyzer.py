@@ -1,11 +1,39 @@
-from deepface import DeepFace
+from facial_emotion import EmotionModel
 import cv2
 import numpy as np
 import logging
+import struct
+import time
+
+# JPEG start-of-frame markers that carry the image dimensions
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+# cv2 reduced-resolution decode flags, largest reduction first
+REDUCED_DECODE_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
 
 class VisualAnalyzer:
-    def __init__(self):
+    # Input size of the DeepFace facial emotion CNN
+    EMOTION_INPUT_SIZE = (48, 48)
+
+    def __init__(self, max_decode_side=640, max_detect_side=320, face_margin=0.15,
+                 emotion_model=None, emotion_backend=None, background_warmup=False):
         self.logger = logging.getLogger(__name__)
+        self.max_decode_side = max_decode_side
+        self.max_detect_side = max_detect_side
+        self.face_margin = face_margin
+
+        # Build the face detector now and run it once so the first request doesn't pay for it
+        start = time.perf_counter()
+        self.face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        self.detect_face(np.zeros((self.max_detect_side, self.max_detect_side, 3), dtype=np.uint8))
+        self.detector_load_ms = self._elapsed_ms(start)
+
+        # The emotion CNN is held for the lifetime of the analyzer (optionally loaded in the background)
+        self.emotion_model = emotion_model or EmotionModel(backend=emotion_backend, background=background_warmup)
         self.emotion_mapping = {
             'angry': 'anger',
             'disgust': 'anger',
@@ -18,58 +46,37 @@ class VisualAnalyzer:
 
     def analyze(self, image_data):
         try:
-            # Convert image data to numpy array
-            nparr = np.frombuffer(image_data, np.uint8)
-            img = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            # Analyze face and emotions
-            result = DeepFace.analyze(img, actions=['emotion'], enforce_detection=False)
-            
-            if isinstance(result, list):
-                result = result[0]  # Take the first face if multiple faces detected
-            
-            # Extract emotion scores
-            emotion_scores = result['emotion']
-            
-            # Map DeepFace emotions to our emotion categories
-            mapped_emotions = {
-                'happiness': emotion_scores.get('happy', 0) / 100,
-                'sadness': emotion_scores.get('sad', 0) / 100,
-                'anxiety': (emotion_scores.get('fear', 0) + emotion_scores.get('surprise', 0)) / 200,
-                'anger': (emotion_scores.get('angry', 0) + emotion_scores.get('disgust', 0)) / 200,
-                'calm': emotion_scores.get('neutral', 0) / 100
-            }
-            
-            # Calculate mental health score based on emotions
-            # Higher happiness and calm = higher score
-            # Higher sadness, anxiety, and anger = lower score
-            happiness_weight = 0.4
-            calm_weight = 0.3
-            sadness_weight = -0.2
-            anxiety_weight = -0.1
-            anger_weight = -0.1
-            
-            # Calculate weighted score (0-1)
-            weighted_score = (
-                mapped_emotions['happiness'] * happiness_weight +
-                mapped_emotions['calm'] * calm_weight +
-                mapped_emotions['sadness'] * sadness_weight +
-                mapped_emotions['anxiety'] * anxiety_weight +
-                mapped_emotions['anger'] * anger_weight
-            ) + 0.5  # Add 0.5 to center the score around 0.5
-            
-            # Normalize to 0-1 range
-            normalized_score = max(0, min(1, weighted_score))
-            
-            # Convert to mental health score (5-25)
-            mental_health_score = 5 + (normalized_score * 20)
-            
-            return {
-                'emotions': mapped_emotions,
-                'mental_health_score': round(mental_health_score),
-                'mental_health_status': self._get_mental_health_status(mental_health_score)
-            }
-            
+            timings = {}
+            start = time.perf_counter()
+
+            # Decode at the smallest resolution that still keeps enough detail
+            img = self.decode_image(image_data)
+            if img is None:
+                raise ValueError("Could not decode image data")
+            timings['decode_ms'] = self._elapsed_ms(start)
+
+            # Find the largest face with a cheap Haar cascade
+            stage_start = time.perf_counter()
+            face_box = self.detect_face(img)
+            timings['detect_ms'] = self._elapsed_ms(stage_start)
+
+            # Crop and resize the face to the emotion model's input size
+            stage_start = time.perf_counter()
+            face = self.crop_face(img, face_box)
+            timings['crop_ms'] = self._elapsed_ms(stage_start)
+
+            # Classify the crop only, with the preloaded emotion model
+            stage_start = time.perf_counter()
+            emotion_scores = self.emotion_model.predict([face])[0]
+            timings['classify_ms'] = self._elapsed_ms(stage_start)
+
+            analysis = self._build_analysis(emotion_scores)
+            analysis['face_detected'] = face_box is not None
+            timings['total_ms'] = self._elapsed_ms(start)
+            analysis['timings'] = timings
+            self.logger.debug("Visual analysis timings: %s", timings)
+            return analysis
+
         except Exception as e:
             self.logger.error(f"Error in visual analysis: {str(e)}")
             # Return default values in case of error
@@ -82,13 +89,242 @@ class VisualAnalyzer:
                     'calm': 0.4
                 },
                 'mental_health_score': 15,
-                'mental_health_status': 'Neutral - Unable to analyze facial expressions'
+                'mental_health_status': 'Neutral - Unable to analyze facial expressions',
+                # Placeholder scores: kept out of the user's wellbeing history
+                'fallback': True
             }
 
+    def analyze_batch(self, images):
+        """Analyze several frames, classifying all face crops in one forward pass"""
+        timings = {}
+        start = time.perf_counter()
+
+        # Decode and locate the face in every frame first
+        frames = []
+        for image_data in images:
+            try:
+                frames.append(self.decode_image(image_data))
+            except Exception as e:
+                self.logger.warning(f"Skipping undecodable frame: {str(e)}")
+                frames.append(None)
+        timings['decode_ms'] = self._elapsed_ms(start)
+
+        stage_start = time.perf_counter()
+        face_boxes = [self.detect_face(img) if img is not None else None for img in frames]
+        timings['detect_ms'] = self._elapsed_ms(stage_start)
+
+        stage_start = time.perf_counter()
+        valid = [i for i, img in enumerate(frames) if img is not None]
+        faces = [self.crop_face(frames[i], face_boxes[i]) for i in valid]
+        timings['crop_ms'] = self._elapsed_ms(stage_start)
+
+        # One batched CNN call for every crop
+        stage_start = time.perf_counter()
+        try:
+            scores = self.emotion_model.predict(faces)
+        except Exception as e:
+            self.logger.error(f"Error in batch visual analysis: {str(e)}")
+            scores = [None] * len(valid)
+        timings['classify_ms'] = self._elapsed_ms(stage_start)
+
+        results = [{'error': 'Could not decode image data'} for _ in frames]
+        for i, emotion_scores in zip(valid, scores):
+            if emotion_scores is None:
+                results[i] = {'error': 'Unable to analyze facial expressions'}
+                continue
+            results[i] = self._build_analysis(emotion_scores)
+            results[i]['face_detected'] = face_boxes[i] is not None
+            results[i]['dominant_emotion'] = max(emotion_scores, key=emotion_scores.get)
+
+        summary = self._summarize(
+            [scores[n] for n, i in enumerate(valid) if scores[n] is not None and face_boxes[i] is not None] or
+            [score for score in scores if score is not None]
+        )
+        summary['frames'] = len(frames)
+        summary['faces_detected'] = sum(1 for box in face_boxes if box is not None)
+        timings['total_ms'] = self._elapsed_ms(start)
+        timings['per_frame_ms'] = round(timings['total_ms'] / max(1, len(frames)), 2)
+        summary['timings'] = timings
+        return {
+            'frames': results,
+            'summary': summary
+        }
+
+    def _summarize(self, scores):
+        """Aggregate per-frame emotion scores over the whole batch"""
+        if not scores:
+            # Same neutral defaults as a failed single-frame analysis
+            return {
+                'emotions': {
+                    'happiness': 0.5,
+                    'sadness': 0.3,
+                    'anxiety': 0.2,
+                    'anger': 0.1,
+                    'calm': 0.4
+                },
+                'mental_health_score': 15,
+                'mental_health_status': 'Neutral - Unable to analyze facial expressions',
+                'dominant_emotion': None,
+                'fallback': True
+            }
+
+        mean_scores = {
+            label: sum(score.get(label, 0) for score in scores) / len(scores)
+            for label in scores[0]
+        }
+        dominant_counts = {}
+        for score in scores:
+            dominant = max(score, key=score.get)
+            dominant_counts[dominant] = dominant_counts.get(dominant, 0) + 1
+
+        summary = self._build_analysis(mean_scores)
+        summary['dominant_emotion'] = max(dominant_counts, key=dominant_counts.get)
+        summary['dominant_emotion_counts'] = dominant_counts
+        return summary
+
+    def get_status(self):
+        """Readiness data for the visual subsystem"""
+        status = self.emotion_model.get_status()
+        status['detector_load_ms'] = self.detector_load_ms
+        return status
+
+    def decode_image(self, image_data):
+        """Decode image bytes, letting libjpeg downscale while decoding when possible"""
+        nparr = np.frombuffer(image_data, np.uint8)
+        size = self._image_size(image_data)
+
+        flag = cv2.IMREAD_COLOR
+        if size is not None:
+            longest = max(size)
+            for factor, reduced_flag in REDUCED_DECODE_FLAGS:
+                if longest // factor >= self.max_decode_side:
+                    flag = reduced_flag
+                    break
+
+        img = cv2.imdecode(nparr, flag)
+        if img is None:
+            return None
+
+        # Formats without reduced decoding support (or odd sizes) are resized afterwards
+        return self._limit_size(img, self.max_decode_side)
+
+    def detect_face(self, img):
+        """Return the (x, y, w, h) box of the largest face in img, or None"""
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        small = self._limit_size(gray, self.max_detect_side)
+        scale = img.shape[1] / small.shape[1]
+
+        faces = self.face_cascade.detectMultiScale(
+            small,
+            scaleFactor=1.1,
+            minNeighbors=5,
+            minSize=(30, 30)
+        )
+        if len(faces) == 0:
+            return None
+
+        x, y, w, h = max(faces, key=lambda f: f[2] * f[3])
+        return tuple(int(round(v * scale)) for v in (x, y, w, h))
+
+    def crop_face(self, img, face_box):
+        """Crop face_box (plus a margin) from img and resize it for the emotion model"""
+        if face_box is None:
+            # No face found: fall back to classifying the whole (downscaled) frame
+            return cv2.resize(img, self.EMOTION_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+
+        x, y, w, h = face_box
+        margin_x = int(w * self.face_margin)
+        margin_y = int(h * self.face_margin)
+        x0 = max(0, x - margin_x)
+        y0 = max(0, y - margin_y)
+        x1 = min(img.shape[1], x + w + margin_x)
+        y1 = min(img.shape[0], y + h + margin_y)
+        return cv2.resize(img[y0:y1, x0:x1], self.EMOTION_INPUT_SIZE, interpolation=cv2.INTER_AREA)
+
+    def _build_analysis(self, emotion_scores):
+        # Map DeepFace emotions to our emotion categories
+        mapped_emotions = {
+            'happiness': emotion_scores.get('happy', 0) / 100,
+            'sadness': emotion_scores.get('sad', 0) / 100,
+            'anxiety': (emotion_scores.get('fear', 0) + emotion_scores.get('surprise', 0)) / 200,
+            'anger': (emotion_scores.get('angry', 0) + emotion_scores.get('disgust', 0)) / 200,
+            'calm': emotion_scores.get('neutral', 0) / 100
+        }
+
+        # Calculate mental health score based on emotions
+        # Higher happiness and calm = higher score
+        # Higher sadness, anxiety, and anger = lower score
+        happiness_weight = 0.4
+        calm_weight = 0.3
+        sadness_weight = -0.2
+        anxiety_weight = -0.1
+        anger_weight = -0.1
+
+        # Calculate weighted score (0-1)
+        weighted_score = (
+            mapped_emotions['happiness'] * happiness_weight +
+            mapped_emotions['calm'] * calm_weight +
+            mapped_emotions['sadness'] * sadness_weight +
+            mapped_emotions['anxiety'] * anxiety_weight +
+            mapped_emotions['anger'] * anger_weight
+        ) + 0.5  # Add 0.5 to center the score around 0.5
+
+        # Normalize to 0-1 range
+        normalized_score = max(0, min(1, weighted_score))
+
+        # Convert to mental health score (5-25)
+        mental_health_score = 5 + (normalized_score * 20)
+
+        return {
+            'emotions': mapped_emotions,
+            'mental_health_score': round(mental_health_score),
+            'mental_health_status': self._get_mental_health_status(mental_health_score)
+        }
+
+    def _limit_size(self, img, max_side):
+        height, width = img.shape[:2]
+        longest = max(height, width)
+        if longest <= max_side:
+            return img
+        scale = max_side / longest
+        return cv2.resize(img, (max(1, int(width * scale)), max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+
+    def _image_size(self, data):
+        """Read (width, height) from a JPEG or PNG header without decoding"""
+        if data[:8] == b'\x89PNG\r\n\x1a\n' and len(data) >= 24:
+            return struct.unpack('>II', data[16:24])
+
+        if data[:2] != b'\xff\xd8':
+            return None
+
+        i = 2
+        while i + 9 < len(data):
+            if data[i] != 0xFF:
+                i += 1
+                continue
+            marker = data[i + 1]
+            if marker == 0xFF:
+                # Fill byte before a marker
+                i += 1
+                continue
+            if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+                # Standalone markers have no length field
+                i += 2
+                continue
+            if marker in JPEG_SOF_MARKERS:
+                height, width = struct.unpack('>HH', data[i + 5:i + 9])
+                return width, height
+            segment_length = struct.unpack('>H', data[i + 2:i + 4])[0]
+            i += 2 + segment_length
+        return None
+
+    def _elapsed_ms(self, start):
+        return round((time.perf_counter() - start) * 1000, 2)
+
     def _get_mental_health_status(self, score):
         if score >= 22: return 'Mentally Healthy - Emotionally aware, good coping mechanisms'
         if score >= 18: return 'Stable but Vulnerable - Slight signs of worry, minor detachment'
         if score >= 14: return 'Mild Emotional Imbalance - Mood swings, early signs of stress'
         if score >= 10: return 'Moderate Issues Detected - Anxiety, emotional numbness'
         if score >= 6: return 'Severe Mental Distress - Major depression, trauma, PTSD'
-        return 'Critical / Emergency - Severe emotional distress' 
\ No newline at end of file
+        return 'Critical / Emergency - Severe emotional distress'
@@ -0,0 +1,94 @@
+import logging
+import math
+
+from models import db, UserWellbeing
+from recommendation_engine import FEATURE_INDEX
+
+logger = logging.getLogger(__name__)
+
+EMOTIONS = ['happiness', 'sadness', 'anxiety', 'anger', 'calm']
+MODALITIES = ['text', 'audio', 'visual', 'questionnaire']
+
+class WellbeingTracker:
+    """Keeps per-user rolling aggregates up to date without scanning past results.
+
+    Each analysis updates a single UserWellbeing row in O(1) (EMAs, trend and
+    per-modality counts), locked for the read-modify-write so concurrent
+    analyses of one user, in any worker or process, don't lose updates.
+    Reads are a primary-key lookup, so every worker sees the latest history.
+    """
+
+    def __init__(self, recommendation_engine, alpha=0.3):
+        self.recommendation_engine = recommendation_engine
+        self.alpha = alpha
+
+    def update(self, user_id, modality, analysis):
+        """Fold one analysis into the user's aggregates; returns the updated aggregates"""
+        if modality not in MODALITIES:
+            raise ValueError(f"Unknown modality '{modality}'")
+        if self.recommendation_engine.is_fallback(analysis):
+            # A failed analysis's placeholder scores say nothing about the user
+            logger.debug("Skipping wellbeing update for a failed %s analysis", modality)
+            return self.get(user_id)
+        try:
+            features = self.recommendation_engine.extract_features(analysis)
+            row = self._locked_row(user_id)
+            if row is None:
+                row = UserWellbeing(user_id=user_id)
+                db.session.add(row)
+
+            # Only a real score moves the wellbeing average and trend
+            wellbeing = self.recommendation_engine.normalized_score(analysis)
+            if wellbeing is not None:
+                if row.last_wellbeing is not None:
+                    change = wellbeing - row.last_wellbeing
+                    row.wellbeing_trend = self._ema(row.wellbeing_trend or 0.0, change)
+                row.wellbeing_ema = self._ema(row.wellbeing_ema, wellbeing)
+                row.last_wellbeing = wellbeing
+
+            for emotion in EMOTIONS:
+                value = features[FEATURE_INDEX[emotion]]
+                if not math.isnan(value):
+                    column = f'{emotion}_ema'
+                    setattr(row, column, self._ema(getattr(row, column), float(value)))
+
+            count_column = f'{modality}_count'
+            setattr(row, count_column, (getattr(row, count_column) or 0) + 1)
+            db.session.commit()
+
+            return self._to_dict(row)
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Error updating wellbeing aggregates: {str(e)}")
+            return self.get(user_id)
+
+    def get(self, user_id):
+        """Current aggregates for a user, or None if there is no history"""
+        row = UserWellbeing.query.get(user_id)
+        return self._to_dict(row) if row is not None else None
+
+    def _locked_row(self, user_id):
+        # The row (or None) locked until the session commits or rolls back
+        # populate_existing: the session may already hold an older copy of the row
+        query = UserWellbeing.query.filter_by(user_id=user_id).populate_existing()
+        if db.engine.dialect.name == 'sqlite':
+            # SQLite has no row locks and ignores FOR UPDATE; a write takes the database's write lock,
+            # which holds until the commit, even when it matches no row yet
+            query.update({'user_id': user_id}, synchronize_session=False)
+            return query.first()
+        return query.with_for_update().first()
+
+    def _ema(self, previous, value):
+        if previous is None:
+            return float(value)
+        return (1 - self.alpha) * previous + self.alpha * float(value)
+
+    def _to_dict(self, row):
+        counts = {modality: getattr(row, f'{modality}_count') or 0 for modality in MODALITIES}
+        return {
+            'wellbeing': row.wellbeing_ema,
+            'trend': row.wellbeing_trend or 0.0,
+            'emotions': {emotion: getattr(row, f'{emotion}_ema') for emotion in EMOTIONS},
+            'counts': counts,
+            'sessions': sum(counts.values())
+        }